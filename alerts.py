@@ -0,0 +1,412 @@
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+import pandas as pd
+import requests
+
+from summary_query import FILTER_RE, OPS
+
+# --------------------------------------------------------------------
+# サマリに対するアラートルール
+#   - ルールは JSON で宣言し、条件は /api/data の ?filter= と同じ書式 (AND)
+#       [{"name": "spike_flat", "when": "volume_spike_flag==true,small_price_move_flag==true"},
+#        {"name": "funding_high", "when": "funding_rate>=0.0001", "timeframes": ["15m", "1h"]}]
+#   - 全ルールの条件を (列, 演算子, 値) の単位で重複なく集め、同じ列・演算子の条件は
+#     1回のブロードキャスト比較でまとめて評価する (条件 × 銘柄の bool 行列)。
+#     ルールの一致は「ルール × 条件番号」の表で行列の行を引いて AND するだけ
+#     (条件数の最大値回の配列演算。ルール毎に DataFrame を走査しない)
+#   - 前回の評価と比べて、新しく一致した銘柄 (enter) / 外れた銘柄 (leave) だけを通知する
+#   - 通知先 (sink) はカンマ区切りで指定: "stdout", "file:PATH" (JSON Lines), "webhook:URL"
+#     送信は別スレッドで行い、更新処理を待たせない
+# --------------------------------------------------------------------
+
+RECENT_EVENTS = 200
+WEBHOOK_TIMEOUT_SEC = 5
+NOTIFY_QUEUE_SIZE = 1000
+
+
+class AlertError(ValueError):
+    pass
+
+
+class AlertRule:
+    __slots__ = ("name", "conditions", "timeframes")
+
+    def __init__(self, name, conditions, timeframes=None):
+        self.name = name
+        self.conditions = conditions
+        self.timeframes = set(timeframes) if timeframes else None
+
+    def applies_to(self, tf):
+        return self.timeframes is None or tf in self.timeframes
+
+    @property
+    def columns(self):
+        return list(dict.fromkeys(col for col, _, _ in self.conditions))
+
+
+def parse_rule(item):
+    name = str(item.get("name") or "").strip()
+    if not name:
+        raise AlertError("rule without name")
+    when = item.get("when")
+    parts = when if isinstance(when, list) else str(when or "").split(",")
+    conditions = []
+    for expr in parts:
+        if not str(expr).strip():
+            continue
+        m = FILTER_RE.match(str(expr))
+        if not m:
+            raise AlertError(f"{name}: invalid condition: {expr}")
+        conditions.append(m.groups())
+    if not conditions:
+        raise AlertError(f"{name}: no conditions")
+    return AlertRule(name, conditions, item.get("timeframes"))
+
+
+def parse_rules(items):
+    """ルール定義 (dict のリスト) → AlertRule のリスト。不正なルールはログを出して飛ばす"""
+    rules, seen = [], set()
+    for item in items or []:
+        try:
+            rule = parse_rule(item)
+        except (AlertError, AttributeError) as e:
+            print(f"Invalid alert rule: {e}")
+            continue
+        if rule.name in seen:
+            print(f"Duplicate alert rule ignored: {rule.name}")
+            continue
+        seen.add(rule.name)
+        rules.append(rule)
+    return rules
+
+
+def load_rules(path):
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return parse_rules(data.get("rules") if isinstance(data, dict) else data)
+
+
+class CompiledRules:
+    """1つの時間足に掛かるルールを、条件の重複を除いた評価表にしたもの"""
+
+    def __init__(self, rules):
+        self.rules = rules
+        atoms = {}
+        terms = [[atoms.setdefault(cond, len(atoms)) for cond in rule.conditions] for rule in rules]
+        self.atoms = list(atoms)
+        self.rule_columns = [rule.columns for rule in rules]
+        self.columns = list(dict.fromkeys(c for cols in self.rule_columns for c in cols))
+        # ルール × 条件番号。条件の少ないルールは常に True の行 (末尾) で埋める
+        width = max((len(t) for t in terms), default=0)
+        self.table = np.full((len(rules), width), len(self.atoms), dtype=np.int64)
+        for r, t in enumerate(terms):
+            self.table[r, :len(t)] = t
+        # (列, 演算子) → (条件の番号, 値の文字列)
+        self.groups = {}
+        for k, (col, op, raw) in enumerate(self.atoms):
+            rows, raws = self.groups.setdefault((col, op), ([], []))
+            rows.append(k)
+            raws.append(raw)
+
+    def evaluate(self, df):
+        """ルール × 銘柄の一致 (bool 行列)"""
+        n = len(df)
+        hits = np.zeros((len(self.atoms) + 1, n), dtype=bool)
+        hits[-1] = True
+        for (col, op), (rows, raws) in self.groups.items():
+            if col not in df.columns:
+                continue
+            values = df[col].to_numpy()
+            if values.dtype.kind in "biuf":
+                hits[rows] = OPS[op](values.astype(float)[None, :], _thresholds(raws)[:, None])
+            else:
+                for k, raw in zip(rows, raws):
+                    hits[k] = OPS[op](values.astype(str), raw)
+        if not self.rules or n == 0:
+            return np.zeros((len(self.rules), n), dtype=bool)
+        matched = hits[self.table[:, 0]]
+        for k in range(1, self.table.shape[1]):
+            matched &= hits[self.table[:, k]]
+        return matched
+
+
+def _thresholds(raws):
+    out = np.empty(len(raws))
+    for k, raw in enumerate(raws):
+        low = raw.lower()
+        if low in ("true", "yes"):
+            out[k] = 1.0
+        elif low in ("false", "no"):
+            out[k] = 0.0
+        else:
+            try:
+                out[k] = float(raw)
+            except ValueError:
+                out[k] = np.nan  # 比較は常に False (!= は True)
+    return out
+
+
+class AlertEngine:
+    def __init__(self, rules=(), state_path=None):
+        self.rules = list(rules)
+        self.state_path = state_path
+        self.compiled = {}
+        # 時間足 → (ルール名, 銘柄の配列, ルール × 銘柄の一致) 前回の評価結果
+        self.matched = {}
+        self.recent = deque(maxlen=RECENT_EVENTS)
+        self.lock = threading.Lock()
+        self._load_state()
+
+    def set_rules(self, rules):
+        with self.lock:
+            self.rules = list(rules)
+            self.compiled = {}
+
+    def _compiled(self, tf):
+        compiled = self.compiled.get(tf)
+        if compiled is None:
+            compiled = self.compiled[tf] = CompiledRules([r for r in self.rules if r.applies_to(tf)])
+        return compiled
+
+    def _previous(self, tf, names, symbols):
+        """
+        前回の一致を今回のルール × 銘柄の並びに合わせたものと、
+        今回のサマリに無い銘柄で前回一致していた (ルール番号, 銘柄) を返す
+        """
+        previous = self.matched.get(tf)
+        if previous is None:
+            return np.zeros((len(names), len(symbols)), dtype=bool), []
+        prev_names, prev_symbols, prev_hits = previous
+        same_symbols = len(prev_symbols) == len(symbols) and np.array_equal(prev_symbols, symbols)
+        if prev_names == names and same_symbols:
+            return prev_hits, []
+        prev = np.zeros((len(names), len(symbols)), dtype=bool)
+        if prev_names == names:
+            rule_map = np.arange(len(names))
+        else:
+            index = {name: k for k, name in enumerate(prev_names)}
+            rule_map = np.array([index.get(name, -1) for name in names], dtype=np.int64)
+        known = rule_map >= 0
+        if same_symbols:
+            sym_map = np.arange(len(symbols))
+        else:
+            sym_map = pd.Index(prev_symbols).get_indexer(symbols)
+        found = sym_map >= 0
+        prev[np.ix_(known, found)] = prev_hits[np.ix_(rule_map[known], sym_map[found])]
+
+        # 銘柄ごと消えた (上場廃止など) ものは leave
+        missing = np.ones(len(prev_symbols), dtype=bool)
+        missing[sym_map[found]] = False
+        gone = []
+        if missing.any():
+            rows, cols = np.nonzero(prev_hits[np.ix_(rule_map[known], missing)])
+            gone_rules = np.flatnonzero(known)[rows]
+            gone = list(zip(gone_rules, prev_symbols[missing][cols]))
+        return prev, gone
+
+    def evaluate(self, tf, summary_df, ts_ms=None):
+        """
+        新しいサマリでルールを評価し、前回から一致 / 不一致が変わった分のイベントを返す
+        {"event": "enter" | "leave", "rule", "tf", "symbol", "ts", "values": {条件の列: 値}}
+        """
+        ts_ms = ts_ms or int(time.time() * 1000)
+        with self.lock:
+            compiled = self._compiled(tf)
+            if not compiled.rules:
+                self.matched.pop(tf, None)
+                return []
+            names = tuple(rule.name for rule in compiled.rules)
+            symbols = summary_df["symbol"].to_numpy()
+            hits = compiled.evaluate(summary_df)
+            prev, gone = self._previous(tf, names, symbols)
+            self.matched[tf] = (names, symbols, hits)
+
+            # 変わったところだけを取り出す (一致し続けている銘柄は見ない)
+            changed = hits != prev
+            if not gone and not changed.any():
+                return []
+
+            # イベントには条件に使った列の値を付ける (tolist で Python の値にしておく)
+            columns = {c: summary_df[c].tolist() for c in compiled.columns if c in summary_df.columns}
+            events = []
+
+            def event(kind, r, symbol, i=None):
+                values = {}
+                if i is not None:
+                    values = {c: columns[c][i] for c in compiled.rule_columns[r] if c in columns}
+                events.append({"event": kind, "rule": names[r], "tf": tf, "symbol": str(symbol),
+                               "ts": ts_ms, "values": values})
+
+            rows, cols = np.nonzero(changed)
+            for r, i, entered in zip(rows, cols, hits[rows, cols]):
+                event("enter" if entered else "leave", r, symbols[i], i)
+            for r, symbol in gone:
+                event("leave", r, symbol)
+            self.recent.extend(events)
+            self._save_state(ts_ms)
+            return events
+
+    def matches(self):
+        """時間足 → {ルール名: [一致中の銘柄]}"""
+        with self.lock:
+            return self._matches()
+
+    def _matches(self):
+        out = {}
+        for tf, (names, symbols, hits) in self.matched.items():
+            rows, cols = np.nonzero(hits)
+            by_rule = out.setdefault(tf, {})
+            for r, i in zip(rows, cols):
+                by_rule.setdefault(names[r], []).append(str(symbols[i]))
+        return out
+
+    def status(self):
+        with self.lock:
+            return {
+                "rules": [rule.name for rule in self.rules],
+                "matches": self._matches(),
+                "recent": list(self.recent),
+            }
+
+    # ---------------- 状態の保存 (再起動をまたいで enter / leave を判定する) ----------------
+    def _save_state(self, ts_ms):
+        if not self.state_path:
+            return
+        state = {
+            "updated_ms": ts_ms,
+            "rules": [rule.name for rule in self.rules],
+            "matches": self._matches(),
+            "recent": list(self.recent),
+        }
+        tmp = f"{self.state_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp, self.state_path)
+        except OSError as e:
+            print(f"Error saving alert state: {e}")
+
+    def _load_state(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+            for tf, by_rule in state.get("matches", {}).items():
+                names = tuple(by_rule)
+                symbols = np.array(sorted({s for matched in by_rule.values() for s in matched}), dtype=object)
+                index = {s: i for i, s in enumerate(symbols)}
+                hits = np.zeros((len(names), len(symbols)), dtype=bool)
+                for r, name in enumerate(names):
+                    hits[r, [index[s] for s in by_rule[name]]] = True
+                self.matched[tf] = (names, symbols, hits)
+            self.recent.extend(state.get("recent", []))
+        except (OSError, ValueError, TypeError, AttributeError) as e:
+            print(f"Error loading alert state {self.state_path}: {e}")
+
+
+# --------------------------------------------------------------------
+# 通知先
+# --------------------------------------------------------------------
+def format_event(event):
+    values = " ".join(f"{k}={v}" for k, v in event["values"].items())
+    return f"[alert] {event['event']} {event['rule']} {event['tf']} {event['symbol']} {values}".rstrip()
+
+
+class StdoutSink:
+    def send(self, events):
+        for event in events:
+            print(format_event(event))
+
+
+class FileSink:
+    """JSON Lines で追記"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def send(self, events):
+        with open(self.path, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event, ensure_ascii=False) + "\n")
+
+
+class WebhookSink:
+    """{"text": 要約, "events": [...]} を POST (Slack / Discord 互換の text 付き)"""
+
+    def __init__(self, url, timeout=WEBHOOK_TIMEOUT_SEC):
+        self.url = url
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def send(self, events):
+        text = "\n".join(format_event(e) for e in events)
+        resp = self.session.post(self.url, json={"text": text, "events": events}, timeout=self.timeout)
+        resp.raise_for_status()
+
+
+# "種類:引数" → sink。独自の通知先は SINK_TYPES に追加する
+SINK_TYPES = {
+    "stdout": lambda arg: StdoutSink(),
+    "file": FileSink,
+    "webhook": WebhookSink,
+}
+
+
+def parse_sinks(spec):
+    sinks = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        kind, _, arg = part.partition(":")
+        factory = SINK_TYPES.get(kind)
+        if factory is None:
+            print(f"Unknown alert sink: {kind}")
+            continue
+        sinks.append(factory(arg))
+    return sinks
+
+
+class AlertNotifier:
+    """イベントをキューに積み、別スレッドで全ての sink へ送る"""
+
+    def __init__(self, sinks):
+        self.sinks = list(sinks)
+        self.queue = queue.Queue(maxsize=NOTIFY_QUEUE_SIZE)
+        self.stats = {"sent": 0, "failed": 0, "dropped": 0}
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def notify(self, events):
+        if not events or not self.sinks:
+            return
+        self._start()
+        try:
+            self.queue.put_nowait(events)
+        except queue.Full:
+            self.stats["dropped"] += len(events)
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            events = self.queue.get()
+            for sink in self.sinks:
+                try:
+                    sink.send(events)
+                    self.stats["sent"] += len(events)
+                except Exception as e:
+                    self.stats["failed"] += len(events)
+                    print(f"Error sending alerts ({type(sink).__name__}): {e}")
+            self.queue.task_done()
@@ -0,0 +1,274 @@
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from bybit_parse import parse_klines
+
+# --------------------------------------------------------------------
+# 銘柄毎のバー (Kline + OI) リングバッファ
+#   - 銘柄毎に最後に見たタイムスタンプを保持し、差分取得の起点にする
+#   - 同じタイムスタンプのバー (確定前の足) はその場で上書き
+#   - npz に保存してプロセス再起動後も引き継ぐ
+#   - tickers だけで始めた足 (start_bar) は synthetic とし、REST の値で上書きされるまで
+#     履歴への追記 (bars_after) とローリング統計の対象から外す
+# --------------------------------------------------------------------
+
+BAR_FIELDS = ("open", "high", "low", "close", "volume", "openInterest")
+N_FIELDS = len(BAR_FIELDS)
+OI_COL = BAR_FIELDS.index("openInterest")
+
+# 15分足 × 96本 = 1日分 (実際の容量は呼び出し側が時間足に合わせて指定)
+DEFAULT_CAPACITY = 96
+
+
+class SymbolBars:
+    __slots__ = ("ts", "values", "synthetic", "head", "count")
+
+    def __init__(self, capacity):
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.values = np.full((capacity, N_FIELDS), np.nan)
+        self.synthetic = np.zeros(capacity, dtype=bool)
+        self.head = 0
+        self.count = 0
+
+    @property
+    def capacity(self):
+        return len(self.ts)
+
+    def last_timestamp(self):
+        if self.count == 0:
+            return 0
+        return int(self.ts[(self.head - 1) % self.capacity])
+
+    def _find(self, t):
+        # 新しい方から探す (更新対象はほぼ最新の数本)
+        for k in range(1, self.count + 1):
+            i = (self.head - k) % self.capacity
+            if self.ts[i] == t:
+                return i
+            if self.ts[i] < t:
+                return -1
+        return -1
+
+    def upsert(self, t, row):
+        i = self._find(t)
+        if i >= 0:
+            mask = ~np.isnan(row)
+            self.values[i, mask] = row[mask]
+            self.synthetic[i] = False
+            return
+        if self.count and t < self.last_timestamp():
+            # 保持範囲より古い / 欠番の埋め戻しは対象外
+            return
+        i = self.head
+        self.ts[i] = t
+        self.values[i] = row
+        self.synthetic[i] = False
+        self.head = (self.head + 1) % self.capacity
+        self.count = min(self.count + 1, self.capacity)
+
+    def upsert_many(self, ts, rows):
+        """
+        ts 昇順。最新足以前 (確定前の足の上書き) は1本ずつ、
+        それより新しい足はまとめて書き込む
+        """
+        if self.count:
+            k = int(np.searchsorted(ts, self.last_timestamp(), side="right"))
+            for t, row in zip(ts[:k], rows[:k]):
+                self.upsert(int(t), row)
+            ts, rows = ts[k:], rows[k:]
+        n = len(ts)
+        if n == 0:
+            return
+        if n > self.capacity:
+            ts, rows, n = ts[-self.capacity:], rows[-self.capacity:], self.capacity
+        idx = (self.head + np.arange(n)) % self.capacity
+        self.ts[idx] = ts
+        self.values[idx] = rows
+        self.synthetic[idx] = False
+        self.head = (self.head + n) % self.capacity
+        self.count = min(self.count + n, self.capacity)
+
+    def latest(self, n):
+        n = min(n, self.count)
+        idx = (self.head - n + np.arange(n)) % self.capacity
+        return self.ts[idx], self.values[idx]
+
+    def first_synthetic(self):
+        """最も古い synthetic な足の ts (無ければ 0)"""
+        if not self.synthetic.any():
+            return 0
+        n = self.count
+        idx = (self.head - n + np.arange(n)) % self.capacity
+        flags = self.synthetic[idx]
+        return int(self.ts[idx][flags][0]) if flags.any() else 0
+
+
+class BarStore:
+    def __init__(self, path=None, capacity=DEFAULT_CAPACITY):
+        self.path = path
+        self.capacity = capacity
+        self.rings = {}
+        self.lock = threading.Lock()
+
+    def _ring(self, symbol):
+        ring = self.rings.get(symbol)
+        if ring is None:
+            ring = self.rings[symbol] = SymbolBars(self.capacity)
+        return ring
+
+    def last_timestamp(self, symbol):
+        with self.lock:
+            ring = self.rings.get(symbol)
+            return ring.last_timestamp() if ring else 0
+
+    def upsert_klines(self, symbol, kline_list):
+        """
+        Bybit /v5/market/kline の list ([start, open, high, low, close, volume, turnover] 新しい順)
+        をそのまま取り込む
+        """
+        ts, bars = parse_klines(kline_list)
+        return self.upsert_bars(symbol, ts, bars)
+
+    def upsert_bars(self, symbol, ts, bars):
+        """ts (epoch ms, 昇順) と bars (n, BAR_FIELDS) を取り込む。NaN の列は既存の値を残す"""
+        if len(ts) == 0:
+            return 0
+        with self.lock:
+            self._ring(symbol).upsert_many(ts, bars)
+        return len(ts)
+
+    def update_latest(self, symbol, close=None, open_interest=None):
+        """tickers の最新値で確定前の足を更新する"""
+        with self.lock:
+            ring = self.rings.get(symbol)
+            if ring is None or ring.count == 0:
+                return
+            i = (ring.head - 1) % ring.capacity
+            row = ring.values[i]
+            if close is not None and not np.isnan(close):
+                row[3] = close
+                row[1] = close if np.isnan(row[1]) else max(row[1], close)
+                row[2] = close if np.isnan(row[2]) else min(row[2], close)
+            if open_interest is not None and not np.isnan(open_interest):
+                row[OI_COL] = open_interest
+
+    def start_bar(self, symbol, ts):
+        """
+        確定前の足 ts を前の足の終値 (始値 = 高値 = 安値 = 終値) で始める (tickers だけで足が切り替わるとき)。
+        出来高は REST で取り直すまで 0、OI は前の足の値。synthetic として印を付ける。
+        前の足が無い / ts 以降の足がある場合は何もしない
+        """
+        with self.lock:
+            ring = self.rings.get(symbol)
+            if ring is None or ring.count == 0 or ring.last_timestamp() >= ts:
+                return False
+            prev = ring.values[(ring.head - 1) % ring.capacity]
+            row = np.array([prev[3], prev[3], prev[3], prev[3], 0.0, prev[OI_COL]])
+            ring.upsert(ts, row)
+            ring.synthetic[(ring.head - 1) % ring.capacity] = True
+        return True
+
+    def first_synthetic(self, symbol):
+        """REST の値で上書きされていない synthetic な足のうち最も古い ts (無ければ 0)"""
+        with self.lock:
+            ring = self.rings.get(symbol)
+            return ring.first_synthetic() if ring else 0
+
+    def symbol_bars(self, symbol, since_ms=0):
+        """1銘柄分の since_ms 以降のバーを (ts, values) の配列 (コピー) で返す"""
+        with self.lock:
+            ring = self.rings.get(symbol)
+            if ring is None or ring.count == 0:
+                return np.zeros(0, dtype=np.int64), np.zeros((0, N_FIELDS))
+            ts, vals = ring.latest(ring.count)
+        mask = ts >= since_ms
+        return ts[mask], vals[mask]
+
+    def bars_since(self, since_ms, symbols=None):
+        """
+        since_ms 以降のバーを symbol, ts 昇順の DataFrame で返す
+        (列: symbol, ts, open, high, low, close, volume, openInterest)
+        """
+        return self._frame(symbols, lambda symbol, ts, ring: ts >= since_ms)
+
+    def bars_after(self, watermarks, before_ms):
+        """
+        銘柄毎に watermarks[symbol] より後で before_ms より前の足を bars_since と同じ形で返す
+        (watermarks に無い銘柄は全て)。履歴への追記用なので、synthetic な足があればその手前まで
+        """
+        def select(symbol, ts, ring):
+            first = ring.first_synthetic()
+            end_ms = min(before_ms, first) if first else before_ms
+            return (ts > watermarks.get(symbol, 0)) & (ts < end_ms)
+        return self._frame(None, select)
+
+    def _frame(self, symbols, select):
+        """各銘柄のリングから select(symbol, ts, ring) が True の足を集め、symbol, ts 昇順の DataFrame にする"""
+        names, ts_parts, val_parts = [], [], []
+        with self.lock:
+            for symbol in (self.rings if symbols is None else symbols):
+                ring = self.rings.get(symbol)
+                if ring is None or ring.count == 0:
+                    continue
+                ts, vals = ring.latest(ring.count)
+                mask = select(symbol, ts, ring)
+                if mask.any():
+                    names.append(np.full(mask.sum(), symbol, dtype=object))
+                    ts_parts.append(ts[mask])
+                    val_parts.append(vals[mask])
+        if not names:
+            return pd.DataFrame(columns=["symbol", "ts", *BAR_FIELDS])
+        df = pd.DataFrame(np.concatenate(val_parts), columns=list(BAR_FIELDS))
+        df.insert(0, "ts", np.concatenate(ts_parts))
+        df.insert(0, "symbol", np.concatenate(names))
+        return df.sort_values(["symbol", "ts"], kind="mergesort").reset_index(drop=True)
+
+    # ---------------- 永続化 ----------------
+    def save(self, path=None):
+        path = path or self.path
+        if not path:
+            return
+        with self.lock:
+            symbols = sorted(self.rings)
+            rings = [self.rings[s] for s in symbols]
+            ts = np.stack([r.ts for r in rings]) if rings else np.zeros((0, self.capacity), np.int64)
+            values = np.stack([r.values for r in rings]) if rings else np.zeros((0, self.capacity, N_FIELDS))
+            synthetic = np.stack([r.synthetic for r in rings]) if rings else np.zeros((0, self.capacity), bool)
+            heads = np.array([r.head for r in rings], dtype=np.int64)
+            counts = np.array([r.count for r in rings], dtype=np.int64)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, symbols=np.array(symbols, dtype=str), ts=ts, values=values, synthetic=synthetic,
+                     heads=heads, counts=counts)
+        os.replace(tmp, path)
+
+    def load(self, path=None):
+        path = path or self.path
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                symbols, ts, values = z["symbols"], z["ts"], z["values"]
+                heads, counts = z["heads"], z["counts"]
+                # synthetic の無い古いファイルは全て REST の値として扱う
+                synthetic = z["synthetic"] if "synthetic" in z.files else np.zeros(ts.shape, bool)
+        except Exception as e:
+            print(f"Error loading bar store {path}: {e}")
+            return 0
+        if ts.ndim != 2 or ts.shape[1] != self.capacity:
+            print(f"Bar store capacity changed, ignoring {path}")
+            return 0
+        with self.lock:
+            self.rings = {}
+            for k, symbol in enumerate(symbols):
+                ring = SymbolBars(self.capacity)
+                ring.ts[:] = ts[k]
+                ring.values[:] = values[k]
+                ring.synthetic[:] = synthetic[k]
+                ring.head = int(heads[k])
+                ring.count = int(counts[k])
+                self.rings[str(symbol)] = ring
+        return len(symbols)
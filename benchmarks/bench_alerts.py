@@ -0,0 +1,111 @@
+"""
+アラートルール評価のベンチマーク (ルール毎にマスクを作る / 条件をまとめて評価する AlertEngine)
+
+    python benchmarks/bench_alerts.py [--rules 10 100 1000] [--symbols 500] [--repeat 5]
+
+ルールは price_change_rate / oi_change_rate / funding_rate の閾値とフラグを 1〜3 個組み合わせたもの
+(閾値は少数の値から選ぶので、ルール間で同じ条件が重なる)
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from alerts import AlertEngine, parse_rules  # noqa: E402
+from summary_query import OPS  # noqa: E402
+
+CONDITIONS = (
+    [f"price_change_rate>={v}" for v in (-3, -1, 0, 1, 3)]
+    + [f"oi_change_rate>={v}" for v in (1, 2, 5, 10)]
+    + [f"funding_rate>={v}" for v in (0.0001, 0.0005)]
+    + ["volume_spike_flag==true", "small_price_move_flag==true", "funding_rate<0"]
+)
+
+
+def make_summary(n_symbols, seed=0):
+    rng = np.random.default_rng(seed)
+    price = rng.normal(0, 2, n_symbols)
+    return pd.DataFrame({
+        "symbol": [f"SYM{i}USDT" for i in range(n_symbols)],
+        "price_change_rate": np.round(price, 3),
+        "volume_change_rate": np.round(rng.normal(0, 30, n_symbols), 3),
+        "oi_change_rate": np.round(rng.normal(0, 4, n_symbols), 3),
+        "funding_rate": np.round(rng.normal(0.0001, 0.0003, n_symbols), 6),
+        "volume_spike_flag": rng.random(n_symbols) < 0.1,
+        "small_price_move_flag": np.abs(price) <= 0.5,
+    })
+
+
+def make_rules(n_rules, seed=0):
+    rng = np.random.default_rng(seed)
+    return parse_rules([
+        {"name": f"rule{i}", "when": list(rng.choice(CONDITIONS, rng.integers(1, 4), replace=False))}
+        for i in range(n_rules)
+    ])
+
+
+def per_rule(rules, df):
+    # 比較用: ルール毎・条件毎に列を比較してマスクを作る
+    out = {}
+    for rule in rules:
+        mask = np.ones(len(df), dtype=bool)
+        for col, op, raw in rule.conditions:
+            values = df[col].to_numpy()
+            value = raw.lower() == "true" if values.dtype.kind == "b" else float(raw)
+            mask &= OPS[op](values, value)
+        out[rule.name] = set(df["symbol"].to_numpy()[mask])
+    return out
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rules", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--symbols", type=int, default=500)
+    parser.add_argument("--changed", type=float, default=0.02, help="更新毎に値が変わる銘柄の割合")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    df = make_summary(args.symbols)
+    changed = np.random.default_rng(1).random(len(df)) < args.changed
+    df2 = df.copy()
+    df2[changed] = make_summary(args.symbols, seed=1)[changed]
+    print(f"symbols: {args.symbols}  changed per refresh: {changed.sum()}")
+    print(f"{'rules':>6} {'per-rule[ms]':>13} {'match[ms]':>10} {'speedup':>8} {'evaluate[ms]':>13} {'events':>7}  match")
+    for n_rules in args.rules:
+        rules = make_rules(n_rules)
+        t_old, old = best_of(lambda: per_rule(rules, df), args.repeat)
+
+        engine = AlertEngine(rules)
+        engine.evaluate("15m", df)
+        compiled = engine._compiled("15m")
+        t_match, _ = best_of(lambda: compiled.evaluate(df), args.repeat)
+        matches = engine.matches().get("15m", {})
+        match = all(set(matches.get(rule.name, [])) == old[rule.name] for rule in rules)
+
+        # 定常状態: 一部の銘柄の値が変わったサマリと元のサマリを交互に評価 (enter / leave の抽出を含む)
+        frames = [df, df2]
+
+        def step():
+            frames.reverse()
+            return engine.evaluate("15m", frames[0])
+
+        t_eval, events = best_of(step, args.repeat)
+        print(f"{n_rules:>6} {t_old * 1000:>13.2f} {t_match * 1000:>10.2f} {t_old / t_match:>7.1f}x "
+              f"{t_eval * 1000:>13.2f} {len(events):>7}  {match}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+"""
+1銘柄分の Kline / OI レスポンスの解析 + 突き合わせのマイクロベンチマーク
+  original: 行毎に pytz + datetime + dict → DataFrame, OI も DataFrame にして pd.merge
+  objects:  np.asarray(list of list) → 1本ずつ upsert, OI は DataFrame → 1点ずつ探索して代入
+  typed:    bybit_parse (型付き配列 + searchsorted) → バーストアへまとめて書き込み
+
+    python benchmarks/bench_parse.py [--bars 4 48 288 1440] [--repeat 200]
+
+各段階 (kline 解析 / OI 解析 / 突き合わせ+書き込み) と合計を µs/銘柄 で表示
+"""
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+from pytz import timezone as pytz_timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from bar_store import BarStore, N_FIELDS, OI_COL  # noqa: E402
+from bybit_parse import merge_oi, parse_klines, parse_oi  # noqa: E402
+
+BAR_MS = 5 * 60 * 1000
+
+
+def make_rows(n_bars, seed=0):
+    """Bybit と同じ形 (文字列, 新しい順) の kline / OI の list"""
+    rng = np.random.default_rng(seed)
+    ts = 1_735_689_600_000 + np.arange(n_bars)[::-1] * BAR_MS
+    close = rng.lognormal(0, 1, n_bars)
+    klines = [
+        [str(t), f"{c * 0.999:.6f}", f"{c * 1.01:.6f}", f"{c * 0.99:.6f}", f"{c:.6f}",
+         f"{v:.3f}", f"{v * c:.3f}"]
+        for t, c, v in zip(ts, close, rng.lognormal(8, 1, n_bars))
+    ]
+    oi = [{"openInterest": f"{x:.3f}", "timestamp": str(t)} for t, x in zip(ts, rng.lognormal(10, 1, n_bars))]
+    return klines, oi
+
+
+# ---------------- original ----------------
+def original_klines(rows):
+    return pd.DataFrame([
+        {
+            "symbol": "SYM",
+            "timestamp": datetime.fromtimestamp(int(e[0]) / 1000, tz=timezone.utc).astimezone(pytz_timezone("Asia/Tokyo")),
+            "open": float(e[1]),
+            "high": float(e[2]),
+            "low": float(e[3]),
+            "close": float(e[4]),
+            "volume": float(e[5]),
+            "fundingRate": 0.0001,
+        }
+        for e in rows
+    ])
+
+
+def original_oi(rows):
+    df = pd.DataFrame(rows)
+    df["timestamp"] = pd.to_numeric(df["timestamp"], errors="coerce") // 1000
+    df["timestamp"] = pd.to_datetime(df["timestamp"], unit='s', utc=True).dt.tz_convert("Asia/Tokyo")
+    df["openInterest"] = pd.to_numeric(df["openInterest"], errors='coerce')
+    return df
+
+
+def original_merge(kline_df, oi_df):
+    return pd.merge(kline_df, oi_df, on="timestamp", how="left").fillna(0)
+
+
+# ---------------- objects (直前の実装) ----------------
+def objects_klines(rows):
+    arr = np.asarray([row[:6] for row in rows], dtype=np.float64)
+    arr = arr[np.argsort(arr[:, 0])]
+    ts = arr[:, 0].astype(np.int64)
+    bars = np.full((len(arr), N_FIELDS), np.nan)
+    bars[:, :5] = arr[:, 1:6]
+    return ts, bars
+
+
+def objects_merge(store, ts, bars, oi_df):
+    with store.lock:
+        ring = store._ring("SYM")
+        for t, row in zip(ts, bars):
+            ring.upsert(int(t), row)
+        oi_ms = oi_df["timestamp"].astype("int64").values // 10**6
+        for t, v in zip(oi_ms, oi_df["openInterest"].values):
+            i = ring._find(int(t))
+            if i >= 0 and not np.isnan(v):
+                ring.values[i, OI_COL] = float(v)
+
+
+# ---------------- typed ----------------
+def typed_merge(store, ts, bars, oi):
+    merge_oi(ts, bars, *oi)
+    store.upsert_bars("SYM", ts, bars)
+
+
+def best_us(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t0)
+    return best * 1e6
+
+
+def run(n_bars, repeat):
+    klines, oi_rows = make_rows(n_bars)
+    capacity = n_bars + 1
+    results = {}
+
+    k_df, o_df = original_klines(klines), original_oi(oi_rows)
+    results["original"] = (
+        best_us(lambda: original_klines(klines), repeat),
+        best_us(lambda: original_oi(oi_rows), repeat),
+        best_us(lambda: original_merge(k_df, o_df), repeat),
+    )
+
+    ts, bars = objects_klines(klines)
+    results["objects"] = (
+        best_us(lambda: objects_klines(klines), repeat),
+        best_us(lambda: original_oi(oi_rows), repeat),
+        best_us(lambda: objects_merge(BarStore(None, capacity), ts, bars.copy(), o_df), repeat),
+    )
+
+    ts, bars = parse_klines(klines)
+    oi = parse_oi(oi_rows)
+    results["typed"] = (
+        best_us(lambda: parse_klines(klines), repeat),
+        best_us(lambda: parse_oi(oi_rows), repeat),
+        best_us(lambda: typed_merge(BarStore(None, capacity), ts, bars.copy(), oi), repeat),
+    )
+
+    # 書き込み結果が直前の実装と同じか
+    a, b = BarStore(None, capacity), BarStore(None, capacity)
+    objects_merge(a, *objects_klines(klines), o_df)
+    typed_merge(b, *parse_klines(klines), parse_oi(oi_rows))
+    ta, va = a.symbol_bars("SYM")
+    tb, vb = b.symbol_bars("SYM")
+    match = np.array_equal(ta, tb) and np.array_equal(va, vb, equal_nan=True)
+    return results, match
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--bars", type=int, nargs="+", default=[4, 48, 288, 1440])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'bars':>6} {'impl':>9} {'kline[us]':>10} {'oi[us]':>9} {'merge[us]':>10} {'total[us]':>10}")
+    for n in args.bars:
+        results, match = run(n, max(3, args.repeat * 4 // max(n, 4)))
+        for impl, (k, o, m) in results.items():
+            print(f"{n:>6} {impl:>9} {k:>10.1f} {o:>9.1f} {m:>10.1f} {k + o + m:>10.1f}"
+                  + (f"  match={match}" if impl == "typed" else ""))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,115 @@
+"""
+取得後の集計パイプラインのベンチマーク
+  旧: 銘柄毎に DataFrame → pd.concat → 全銘柄まとめて再集計 + groupby
+  新: 銘柄が届く度にサマリ行へ畳み込み (summary_stream.SummaryAccumulator)
+
+    python benchmarks/bench_pipeline.py [--symbols 100 500] [--arrival-ms 0]
+
+ネットワークは使わず、合成したバーを入れたバーストアから「届いた順」に処理する。
+--arrival-ms を指定すると銘柄毎にその分待ってから処理する (取得待ちの模擬)。
+first[ms] は最初のサマリ行が読めるまでの時間、peak[MB] は tracemalloc のピーク
+(tracemalloc 有効時は遅くなるため時間とは別の実行で計測)
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import fetch_data as fd  # noqa: E402
+from bar_store import BarStore  # noqa: E402
+
+
+def make_store(n_symbols, now_ms, seed=0):
+    rng = np.random.default_rng(seed)
+    store = BarStore(None, fd.BAR_STORE_CAPACITY)
+    n = fd.BAR_STORE_CAPACITY
+    ts = now_ms // fd.BAR_MS * fd.BAR_MS - np.arange(n)[::-1] * fd.BAR_MS
+    symbols = [f"SYM{i}USDT" for i in range(n_symbols)]
+    for symbol in symbols:
+        close = rng.lognormal(0, 1) * np.cumprod(rng.uniform(0.995, 1.005, n))
+        bars = np.column_stack(
+            [close, close * 1.01, close * 0.99, close, rng.lognormal(8, 1, n), rng.lognormal(10, 1, n)])
+        store.upsert_bars(symbol, ts, bars)
+    funding = {s: float(rng.normal(0.0001, 0.0002)) for s in symbols}
+    # 取得順 (as_completed) を模してシャッフル
+    order = list(rng.permutation(symbols))
+    return store, order, funding
+
+
+def legacy(order, funding, now_ms, arrival):
+    t0 = time.perf_counter()
+    all_data = []
+    for symbol in order:
+        if arrival:
+            time.sleep(arrival)
+        all_data.append(fd.timeframe_frame([symbol], fd.DEFAULT_TIMEFRAME, {symbol: funding[symbol]}, now_ms))
+    df_all = pd.concat(all_data, ignore_index=True)
+    fetched = df_all["symbol"].unique().tolist()
+    rates = df_all.groupby("symbol")["fundingRate"].last().to_dict()
+    frames = fd.build_summaries(fetched, rates, now_ms)
+    total = time.perf_counter() - t0
+    # 全銘柄が揃うまでサマリは1行も無い
+    return frames, total, total
+
+
+def streaming(order, funding, now_ms, arrival):
+    t0 = time.perf_counter()
+    first = None
+    builds = fd.new_summary_builds(len(order))
+    for symbol in order:
+        if arrival:
+            time.sleep(arrival)
+        fd.reduce_symbol(builds, symbol, funding[symbol], now_ms)
+        if first is None:
+            first = time.perf_counter() - t0
+    frames = {tf: fd.with_rolling(tf, acc.frame()) for tf, acc in builds.items()}
+    return frames, first, time.perf_counter() - t0
+
+
+def measure(fn, *args):
+    # 時間は計測なしで、メモリは tracemalloc を有効にして別に実行
+    frames, first, total = fn(*args)
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return frames, first, total, peak / 1e6
+
+
+def same(old, new):
+    # 出来高の合計は加算順の違いで最下位ビットがずれることがある
+    try:
+        for tf in old:
+            pd.testing.assert_frame_equal(old[tf].reset_index(drop=True), new[tf].reset_index(drop=True))
+        return True
+    except AssertionError:
+        return False
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, nargs="+", default=[100, 500])
+    parser.add_argument("--arrival-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    arrival = args.arrival_ms / 1000
+    now_ms = int(time.time() * 1000)
+
+    print(f"timeframes: {','.join(fd.ENABLED_TIMEFRAMES)}  arrival: {args.arrival_ms}ms/symbol")
+    print(f"{'symbols':>8} {'mode':>10} {'first[ms]':>10} {'total[ms]':>10} {'peak[MB]':>9}  match")
+    for n in args.symbols:
+        fd.bar_store, order, funding = make_store(n, now_ms)
+        old, *m_old = measure(legacy, order, funding, now_ms, arrival)
+        new, *m_new = measure(streaming, order, funding, now_ms, arrival)
+        match = same(old, new)
+        for mode, (first, total, peak) in (("legacy", m_old), ("streaming", m_new)):
+            print(f"{n:>8} {mode:>10} {first * 1000:>10.1f} {total * 1000:>10.1f} {peak:>9.1f}"
+                  + (f"  {match}" if mode == "streaming" else ""))
+
+
+if __name__ == "__main__":
+    main()
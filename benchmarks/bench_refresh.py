@@ -0,0 +1,241 @@
+"""
+取得〜集計のエンドツーエンド・ベンチマーク (tests/mock_bybit.py を相手に実行。ネットワーク不要)
+
+    python benchmarks/bench_refresh.py [--symbols 450 2000 5000] [--modes update parallel summarize]
+        [--latency-ms 30] [--jitter-ms 10] [--error-rate 0] [--throttle-rate 0] [--throttle-kind retcode]
+        [--concurrency 50] [--no-rate-limit] [--replay DIR] [--json out.json]
+
+  update:    update_data() (銘柄一覧 → 取得 → 全時間足のサマリ → 保存)
+  parallel:  fetch_data_parallel() (取得 + 基準時間足の DataFrame)
+  summarize: summarize_data_4bars() (取得済みの DataFrame の集計だけ。最良値)
+
+シナリオ毎に別プロセスで実行し、モックサーバもさらに別のプロセスで動かす (RSS と CPU を分けるため)。
+出力は data/ ではなく一時ディレクトリに書く。
+wall[s] / req (クライアントの送信数) / srv (サーバが受けた数) / retry / fail / peak[MB] (最大 RSS) /
++rss[MB] (import 後からの増分) / p50, p99[ms] (1銘柄の Kline / OI / Funding が全て返るまで)
+既定ではレート制御 (IP 110 req/s) も本番どおりにかかる。CPU 側だけを見たいときは --no-rate-limit
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from urllib.request import urlopen
+
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+# モックサーバ (mock_bybit) はテストと共通で tests/ にある
+TESTS_DIR = os.path.join(ROOT, "tests")
+sys.path.insert(0, ROOT)
+sys.path.insert(0, TESTS_DIR)
+
+# 1銘柄分のリクエスト (async: update_data の経路, sync: fetch_data_parallel のスレッドプール)
+TRACKED_ASYNC = ("get_kline_data_async", "get_open_interest_history_async", "get_funding_rate_async")
+TRACKED_SYNC = ("get_kline_data", "get_open_interest_history", "get_funding_rate")
+
+
+def rss_mb():
+    # Linux の ru_maxrss は KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def server_stats(base_url, reset=False):
+    root = base_url.split("/v5/")[0]
+    with urlopen(root + ("/__reset" if reset else "/__stats"), timeout=10) as r:
+        return json.load(r)
+
+
+# --------------------------------------------------------------------
+# 子プロセス: 1シナリオを実行して結果を1行の JSON で出力
+# --------------------------------------------------------------------
+def isolate(fd, tmp):
+    """保存先を一時ディレクトリへ (リポジトリの data/ を書き換えない)"""
+    from alerts import AlertEngine
+    from bar_store import BarStore
+    from rolling_stats import RollingStats
+    from shared_summary import SharedSummaryWriter
+    from summary_cache import SummaryCache
+
+    fd.DATA_DIR = tmp
+    fd.REFRESH_LOCK_PATH = os.path.join(tmp, "refresh.lock")
+    fd.shared_writer = SharedSummaryWriter(os.path.join(tmp, "shared"))
+    fd.bar_store = BarStore(None, fd.BAR_STORE_CAPACITY)
+    fd.rolling_stats = {tf: RollingStats(fd.SUMMARY_LOOKBACKS, fd.ROLLING_EWMA_SPAN) for tf in fd.ENABLED_TIMEFRAMES}
+    fd.summary_cache = SummaryCache()
+    fd.alert_engine = AlertEngine(state_path=os.path.join(tmp, "alerts.json"))
+    fd.symbol_registry.path = None
+    fd.symbol_registry.instruments = {}
+
+
+def track_latency(fd):
+    """銘柄毎に最初のリクエスト開始から最後の応答までを記録"""
+    spans = {}
+
+    def record(symbol, t0):
+        t1 = time.perf_counter()
+        span = spans.setdefault(symbol, [t0, t1])
+        span[0], span[1] = min(span[0], t0), max(span[1], t1)
+
+    def wrap_async(fn):
+        async def wrapper(session, symbol, *args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return await fn(session, symbol, *args, **kwargs)
+            finally:
+                record(symbol, t0)
+        return wrapper
+
+    def wrap_sync(fn):
+        def wrapper(symbol, *args, **kwargs):
+            t0 = time.perf_counter()
+            try:
+                return fn(symbol, *args, **kwargs)
+            finally:
+                record(symbol, t0)
+        return wrapper
+
+    for name in TRACKED_ASYNC:
+        setattr(fd, name, wrap_async(getattr(fd, name)))
+    for name in TRACKED_SYNC:
+        setattr(fd, name, wrap_sync(getattr(fd, name)))
+    return spans
+
+
+def run_child(cfg):
+    os.environ["HISTORY_ENABLED"] = "0"
+    import fetch_data as fd
+    from mock_bybit import point_to
+    from rate_limiter import RequestScheduler
+
+    tmp = tempfile.mkdtemp(prefix="bench_refresh_")
+    isolate(fd, tmp)
+    point_to(fd, cfg["base_url"])
+    fd.ASYNC_CONCURRENCY = cfg["concurrency"]
+    if cfg["no_rate_limit"]:
+        fd.request_scheduler = RequestScheduler(endpoint_rate=1e6, ip_rate=1e6)
+    spans = track_latency(fd)
+    mode = cfg["mode"]
+
+    if mode != "update":
+        symbols = fd.fetch_all_symbols()
+    if mode == "summarize":
+        df = fd.fetch_data_parallel(symbols)
+    base_rss = rss_mb()
+    spans.clear()
+    fd.request_scheduler.reset_stats()
+    server_stats(cfg["base_url"], reset=True)
+
+    t0 = time.perf_counter()
+    if mode == "update":
+        ok = fd.update_data()
+    elif mode == "parallel":
+        ok = not fd.fetch_data_parallel(symbols).empty
+    else:
+        best = float("inf")
+        for _ in range(5):
+            t1 = time.perf_counter()
+            ok = not fd.summarize_data_4bars(df).empty
+            best = min(best, time.perf_counter() - t1)
+    wall = time.perf_counter() - t0 if mode != "summarize" else best
+
+    lat = np.array([(b - a) * 1000 for a, b in spans.values()])
+    client = fd.request_scheduler.stats()
+    return {
+        "symbols": cfg["symbols"], "mode": mode, "ok": bool(ok), "wall_s": wall,
+        "requests": client["requests"], "server_requests": server_stats(cfg["base_url"])["requests"],
+        "retries": client["retried"], "failures": client["failed"],
+        "peak_rss_mb": rss_mb(), "rss_growth_mb": rss_mb() - base_rss,
+        "p50_ms": float(np.percentile(lat, 50)) if len(lat) else None,
+        "p99_ms": float(np.percentile(lat, 99)) if len(lat) else None,
+    }
+
+
+# --------------------------------------------------------------------
+# 親プロセス
+# --------------------------------------------------------------------
+def start_mock(args, n_symbols):
+    cmd = [sys.executable, os.path.join(TESTS_DIR, "mock_bybit.py"), "serve", "--port", str(args.port),
+           "--symbols", str(n_symbols), "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+           "--error-rate", str(args.error_rate), "--throttle-rate", str(args.throttle_rate),
+           "--throttle-kind", args.throttle_kind]
+    if args.replay:
+        cmd += ["--replay", args.replay]
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, text=True)
+    line = proc.stdout.readline()
+    if not line.startswith("mock Bybit:"):
+        proc.kill()
+        raise RuntimeError(f"mock server failed to start: {line!r}")
+    return proc, line.split()[2]
+
+
+def run_scenario(cfg, verbose):
+    out = subprocess.run([sys.executable, os.path.abspath(__file__), "--child", json.dumps(cfg)],
+                         capture_output=True, text=True)
+    if verbose:
+        sys.stderr.write(out.stdout + out.stderr)
+    for line in reversed(out.stdout.splitlines()):
+        if line.startswith("RESULT "):
+            return json.loads(line[len("RESULT "):])
+    raise RuntimeError(f"scenario failed: {cfg}\n{out.stderr[-2000:]}")
+
+
+def fmt_ms(value):
+    return f"{value:>8.1f}" if value is not None else f"{'-':>8}"
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, nargs="+", default=[450])
+    parser.add_argument("--modes", nargs="+", default=["update", "parallel", "summarize"],
+                        choices=["update", "parallel", "summarize"])
+    parser.add_argument("--latency-ms", type=float, default=30.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-rate", type=float, default=0.0)
+    parser.add_argument("--throttle-kind", default="retcode", choices=["retcode", "http", "mixed"],
+                        help="スロットリングの返し方 (retCode=10006 / HTTP 429 / 半々)")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--no-rate-limit", action="store_true")
+    parser.add_argument("--replay", default=None)
+    parser.add_argument("--port", type=int, default=18090)
+    parser.add_argument("--json", default=None, help="結果を JSON で保存 (回帰の比較用)")
+    parser.add_argument("--verbose", action="store_true")
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print("RESULT " + json.dumps(run_child(json.loads(args.child))), flush=True)
+        return
+
+    print(f"latency {args.latency_ms}±{args.jitter_ms}ms  errors {args.error_rate}  "
+          f"throttle {args.throttle_rate} ({args.throttle_kind})  concurrency {args.concurrency}  rate limit {'off' if args.no_rate_limit else 'on'}  "
+          f"timeframes {os.environ.get('TIMEFRAMES', 'all')}")
+    print(f"{'symbols':>7} {'mode':>9} {'wall[s]':>8} {'req':>6} {'srv':>6} {'retry':>5} {'fail':>4} "
+          f"{'peak[MB]':>8} {'+rss[MB]':>8} {'p50[ms]':>8} {'p99[ms]':>8}  ok")
+    results = []
+    for n in args.symbols:
+        mock, base_url = start_mock(args, n)
+        try:
+            for mode in args.modes:
+                cfg = {"symbols": n, "mode": mode, "base_url": base_url, "concurrency": args.concurrency,
+                       "no_rate_limit": args.no_rate_limit}
+                r = run_scenario(cfg, args.verbose)
+                results.append(r)
+                print(f"{n:>7} {mode:>9} {r['wall_s']:>8.3f} {r['requests']:>6} {r['server_requests']:>6} "
+                      f"{r['retries']:>5} {r['failures']:>4} {r['peak_rss_mb']:>8.1f} {r['rss_growth_mb']:>8.1f} "
+                      f"{fmt_ms(r['p50_ms'])} {fmt_ms(r['p99_ms'])}  {r['ok']}", flush=True)
+        finally:
+            mock.terminate()
+            mock.wait()
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "child"}, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+summarize_data_4bars のベンチマーク (旧: 銘柄毎 groupby ループ / 新: ベクトル演算)
+
+    python benchmarks/bench_summary.py [--sizes 500 5000 50000] [--bars 5]
+
+sizes は 銘柄数 × 本数 (= 行数)。4本前と比べるので銘柄毎に 5本 (最新 + 4本) 必要
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from fetch_data import summarize_data_4bars  # noqa: E402
+
+
+def summarize_data_4bars_legacy(data):
+    # 旧実装 (比較用。volume_spike_flag の誤代入と、4本前 / 直前4本の平均の位置を修正済み)
+    summary = []
+    for symbol, group in data.groupby("symbol"):
+        group = group.sort_values("timestamp")
+        if len(group) < 5:
+            continue
+        latest = group.iloc[-1]
+
+        def calc_rate(df, col):
+            val_new = df[col].iloc[-1]
+            val_old = df[col].iloc[-5]
+            if val_old != 0:
+                return (val_new - val_old) / val_old * 100
+            return 0.0
+
+        price_chg = calc_rate(group, "close")
+        vol_chg = calc_rate(group, "volume")
+        oi_chg = calc_rate(group, "openInterest")
+        vol_latest = group["volume"].iloc[-1]
+        vol_ma_4 = group["volume"].iloc[-5:-1].mean()
+        summary.append({
+            "symbol": symbol,
+            "timestamp": latest["timestamp"].strftime('%Y-%m-%d %H:%M:%S'),
+            "open": latest["open"],
+            "high": latest["high"],
+            "low": latest["low"],
+            "close": latest["close"],
+            "volume": latest["volume"],
+            "openInterest": latest.get("openInterest", 0),
+            "funding_rate": round(latest.get("fundingRate", 0), 6),
+            "price_change_rate": round(price_chg, 3),
+            "volume_change_rate": round(vol_chg, 3),
+            "oi_change_rate": round(oi_chg, 3),
+            "volume_spike_flag": bool(vol_ma_4 > 0 and vol_latest >= 2.0 * vol_ma_4),
+            "small_price_move_flag": bool(abs(price_chg) <= 0.5),
+        })
+    return pd.DataFrame(summary).fillna(0)
+
+
+def make_bars(n_rows, n_bars, seed=0):
+    rng = np.random.default_rng(seed)
+    n_symbols = max(1, n_rows // n_bars)
+    symbols = np.repeat([f"SYM{i}USDT" for i in range(n_symbols)], n_bars)
+    start = pd.Timestamp("2025-01-01", tz="Asia/Tokyo")
+    ts = start + pd.to_timedelta(np.tile(np.arange(n_bars) * 15, n_symbols), unit="min")
+    close = rng.lognormal(0, 1, n_symbols * n_bars)
+    df = pd.DataFrame({
+        "symbol": symbols,
+        "timestamp": ts,
+        "open": close * rng.uniform(0.99, 1.01, len(close)),
+        "high": close * 1.01,
+        "low": close * 0.99,
+        "close": close,
+        "volume": rng.lognormal(8, 1, len(close)),
+        "fundingRate": rng.normal(0.0001, 0.0002, len(close)),
+        "openInterest": rng.lognormal(10, 1, len(close)),
+    })
+    # 取得順 (as_completed) を模してシャッフル
+    return df.sample(frac=1.0, random_state=seed).reset_index(drop=True)
+
+
+def best_of(fn, data, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(data)
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[500, 5000, 50000])
+    parser.add_argument("--bars", type=int, default=5)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'symbols':>8} {'legacy[ms]':>12} {'vectorized[ms]':>15} {'speedup':>8}  match")
+    for n_rows in args.sizes:
+        data = make_bars(n_rows, args.bars)
+        t_old, old = best_of(summarize_data_4bars_legacy, data, args.repeat)
+        t_new, new = best_of(summarize_data_4bars, data, args.repeat)
+        match = old.reset_index(drop=True).equals(new.reset_index(drop=True))
+        print(f"{n_rows:>8} {data['symbol'].nunique():>8} {t_old * 1000:>12.1f} {t_new * 1000:>15.1f} "
+              f"{t_old / t_new:>7.1f}x  {match}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+"""
+/api/data のレスポンス形式のベンチマーク (行指向 JSON / 列指向 JSON / MessagePack / Arrow IPC)
+
+    python benchmarks/bench_wire.py [--symbols 450 2000] [--page 100] [--repeat 5]
+
+全件 (キャッシュする本文) と、ダッシュボードが取る1ページ分 (リクエスト毎に作る本文) について
+エンコード時間と、無圧縮 / gzip / brotli (入っていれば) のサイズを出す
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from wire_format import available_formats, brotli, compress, encode_frame  # noqa: E402
+
+
+def make_summary(n_symbols, seed=0):
+    # fetch_data.summarize_data_4bars と同じ列・丸め
+    rng = np.random.default_rng(seed)
+    close = np.round(np.exp(rng.normal(0, 3, n_symbols)), 6)
+    return pd.DataFrame({
+        "symbol": [f"SYM{i}USDT" for i in range(n_symbols)],
+        "timestamp": "2025-01-19 23:30:00",
+        "open": np.round(close * (1 + rng.normal(0, 0.01, n_symbols)), 6),
+        "high": np.round(close * 1.01, 6),
+        "low": np.round(close * 0.99, 6),
+        "close": close,
+        "volume": np.round(rng.lognormal(12, 2, n_symbols)),
+        "openInterest": np.round(rng.lognormal(15, 2, n_symbols), 1),
+        "funding_rate": np.round(rng.normal(0.0001, 0.0003, n_symbols), 6),
+        "price_change_rate": np.round(rng.normal(0, 2, n_symbols), 3),
+        "volume_change_rate": np.round(rng.normal(0, 30, n_symbols), 3),
+        "oi_change_rate": np.round(rng.normal(0, 4, n_symbols), 3),
+        "volume_spike_flag": rng.random(n_symbols) < 0.1,
+        "small_price_move_flag": rng.random(n_symbols) < 0.2,
+    })
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbols", type=int, nargs="+", default=[450, 2000])
+    parser.add_argument("--page", type=int, default=100)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    encodings = ["gzip"] + (["br"] if brotli is not None else [])
+    print(f"formats: {','.join(available_formats())}  encodings: {','.join(encodings)}")
+    print(f"{'symbols':>7} {'body':>5} {'format':>8} {'encode[ms]':>11} {'raw[B]':>8} "
+          + " ".join(f"{e + '[B]':>8} {e + '[ms]':>9}" for e in encodings))
+    for n in args.symbols:
+        df = make_summary(n)
+        page = df.sort_values("price_change_rate", ascending=False).head(args.page)
+        meta = {"total": n, "matched": n, "offset": 0, "limit": args.page}
+        for name, frame, frame_meta in (("full", df, None), ("page", page, meta)):
+            for fmt in available_formats():
+                t_enc, body = best_of(lambda: encode_frame(fmt, frame, frame_meta), args.repeat)
+                line = f"{n:>7} {name:>5} {fmt:>8} {t_enc * 1000:>11.2f} {len(body):>8}"
+                for encoding in encodings:
+                    t_comp, packed = best_of(lambda: compress(body, encoding), args.repeat)
+                    line += f" {len(packed):>8} {t_comp * 1000:>9.2f}"
+                print(line, flush=True)
+
+
+if __name__ == "__main__":
+    main()
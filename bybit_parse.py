@@ -0,0 +1,78 @@
+from itertools import chain
+
+import numpy as np
+import pandas as pd
+
+# --------------------------------------------------------------------
+# Bybit の生レスポンス (result.list) → 型付き NumPy 配列
+#   - タイムスタンプは epoch ms (int64) のまま扱い、タイムゾーンは表示時にだけ付ける
+#   - kline / OI とも新しい順で返るので、反転して昇順にする
+#   - OI は kline の ts にソート済み配列同士の突き合わせ (searchsorted) で合わせる
+# --------------------------------------------------------------------
+
+# bars の列: open, high, low, close, volume, openInterest (bar_store.BAR_FIELDS と同じ順)
+N_FIELDS = 6
+OI_COL = 5
+
+
+def _ascending(ts, *arrays):
+    if len(ts) > 1 and ts[0] > ts[-1]:
+        ts = ts[::-1]
+        arrays = tuple(a[::-1] for a in arrays)
+    if len(ts) > 2 and np.any(ts[1:] < ts[:-1]):
+        order = np.argsort(ts, kind="stable")
+        ts = ts[order]
+        arrays = tuple(a[order] for a in arrays)
+    return (ts, *arrays)
+
+
+def parse_klines(rows):
+    """
+    /v5/market/kline の list ([start, open, high, low, close, volume, turnover] の文字列)
+    → (ts int64 昇順, bars float64 (n, 6))。openInterest 列は NaN
+    """
+    n = len(rows)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.full((0, N_FIELDS), np.nan)
+    try:
+        # 文字列 → float を1回のループで (行毎の list / 2次元の文字列配列を作らない)
+        arr = np.fromiter(chain.from_iterable(row[:6] for row in rows), dtype=np.float64, count=n * 6)
+        arr = arr.reshape(n, 6)
+    except ValueError:
+        # 列数が揃わない / 数値でない値が混ざる場合は1行ずつ
+        arr = pd.DataFrame([row[:6] for row in rows]).apply(pd.to_numeric, errors="coerce").to_numpy(np.float64)
+        arr = arr[~np.isnan(arr[:, 0])]
+    ts, values = _ascending(arr[:, 0].astype(np.int64), arr[:, 1:6])
+    bars = np.full((len(ts), N_FIELDS), np.nan)
+    bars[:, :5] = values
+    return ts, bars
+
+
+def parse_oi(rows):
+    """
+    /v5/market/open-interest の list ({"openInterest": "...", "timestamp": "..."})
+    → (ts int64 昇順, openInterest float64)
+    """
+    n = len(rows)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0)
+    try:
+        ts = np.fromiter((r["timestamp"] for r in rows), dtype=np.int64, count=n)
+        oi = np.fromiter((r["openInterest"] for r in rows), dtype=np.float64, count=n)
+    except (KeyError, TypeError, ValueError):
+        ts = pd.to_numeric(pd.Series([r.get("timestamp") for r in rows]), errors="coerce")
+        oi = pd.to_numeric(pd.Series([r.get("openInterest") for r in rows]), errors="coerce").to_numpy(np.float64)
+        valid = ts.notna().to_numpy()
+        ts, oi = ts.to_numpy()[valid].astype(np.int64), oi[valid]
+    return _ascending(ts, oi)
+
+
+def merge_oi(ts, bars, oi_ts, oi):
+    """ts が一致する足の openInterest 列に OI を入れる (ts / oi_ts とも昇順)"""
+    if len(ts) == 0 or len(oi_ts) == 0:
+        return bars
+    idx = np.searchsorted(oi_ts, ts)
+    idx[idx == len(oi_ts)] = len(oi_ts) - 1
+    hit = oi_ts[idx] == ts
+    bars[hit, OI_COL] = oi[idx[hit]]
+    return bars
@@ -0,0 +1,66 @@
+"""
+取得・集計専用のプロセス (ホストに1つ)
+
+    python collector.py
+    RUN_ROLE=web gunicorn frontend:app --workers 4 --worker-class gthread --threads 64
+
+Bybit からの取得とサマリの作成はこのプロセスだけが行い、結果は data/shared/ の
+共有サマリ (ヘッダ付きファイル, rename で差し替え) に書く。Web ワーカーは mmap で読むだけなので、
+ワーカー数に関係なく更新は1回、書きかけのデータを返すこともない。
+Web ワーカーからの更新要求 (/ や POST /api/fetch) は data/shared/refresh_request.json で受け取る
+
+共有サマリはホストのファイル (mmap) なので、集計プロセスと Web ワーカーは同じホスト (dyno) で動かす。
+Procfile の web はこのプロセスを裏で起動し (落ちたら5秒後に起動し直す)、gunicorn を RUN_ROLE=web で動かす。
+RUN_ROLE を指定しない (standalone) 場合は従来どおり各ワーカーが自分で更新する
+
+/api/stream (SSE) は1接続がワーカーのスレッドを切断まで占有する。同時接続はワーカー毎に
+SSE_MAX_CLIENTS (既定 48) までで、超えた分は 503。--threads はそれより多くして通常のリクエスト用に残す
+"""
+import os
+import signal
+import sys
+import time
+
+os.environ["RUN_ROLE"] = "collector"
+
+import fetch_data as fd  # noqa: E402
+from shared_summary import read_json, write_json_atomic  # noqa: E402
+
+
+def handle_request(last_seen):
+    request = read_json(fd.COLLECTOR_REQUEST_PATH)
+    if not request or request.get("requested_at", 0) <= last_seen:
+        return last_seen
+    fd.refresh_scheduler.request(trigger=request.get("trigger", "manual"))
+    return request["requested_at"]
+
+
+def main():
+    print(f"Collector started (mode={fd.FETCH_MODE}, pid={os.getpid()})")
+    # SIGTERM でも atexit (見送っていたバーの状態の保存) を通して終わる
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    fd.load_bar_state()
+    if fd.FETCH_MODE == "stream":
+        fd.stream_ingestor.start(fd.fetch_all_symbols)
+    else:
+        fd.refresh_scheduler.start_background()
+        fd.refresh_scheduler.request(trigger="startup")
+
+    # 起動前に出ていた要求は無視する
+    last_seen = time.time()
+    last_status = None
+    while True:
+        if fd.FETCH_MODE != "stream":
+            last_seen = handle_request(last_seen)
+        status = fd.refresh_status()
+        if status != last_status:
+            try:
+                write_json_atomic(fd.COLLECTOR_STATUS_PATH, status)
+                last_status = status
+            except OSError as e:
+                print(f"Error writing collector status: {e}")
+        time.sleep(fd.SHARED_POLL_SEC)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,109 +1,296 @@
 import os
+import asyncio
+import atexit
 import threading
 import time
-from flask import Flask, render_template, jsonify, request
 import pandas as pd
+import numpy as np
 import requests
+import aiohttp
 from datetime import datetime, timedelta, timezone
-from pytz import timezone as pytz_timezone
 from concurrent.futures import ThreadPoolExecutor, as_completed
-
-app = Flask(__name__)
+from rate_limiter import RequestScheduler
+from funding_cache import FundingRateCache
+from bar_store import BarStore
+from bybit_parse import parse_klines, parse_oi, merge_oi
+from summary_cache import SummaryCache
+from snapshot_files import write_frame
+from shared_summary import SharedSummaryReader, SharedSummaryWriter, host_lock, read_json, write_json_atomic
+from refresh_scheduler import RefreshScheduler
+from refresh_tiers import TierPlanner, parse_tiers
+from history_store import HistoryStore
+from symbol_registry import SymbolRegistry, INSTRUMENTS_PAGE_LIMIT
+from live_events import EventBroker, delta_payload
+from summary_stream import SummaryAccumulator
+from rolling_stats import RollingStats, parse_lookbacks
+from alerts import AlertEngine, AlertNotifier, load_rules, parse_sinks
+from ws_ingest import WebSocketIngestor
+from metrics import registry as metrics_registry
+from timeframes import (
+    TIMEFRAMES, DEFAULT_TIMEFRAME, BYBIT_KLINE_INTERVALS, BYBIT_OI_INTERVALS, timeframe_ms, window_start_ms,
+    resample_bars, resample_arrays, to_summary_input,
+)
 
 # Bybit API endpoints
 BASE_URL_KLINE = "https://api.bybit.com/v5/market/kline"
 BASE_URL_OI = "https://api.bybit.com/v5/market/open-interest"
 BASE_URL_SYMBOLS = "https://api.bybit.com/v5/market/instruments-info"
 BASE_URL_FUNDING_HISTORY = "https://api.bybit.com/v5/market/funding/history"
+BASE_URL_TICKERS = "https://api.bybit.com/v5/market/tickers"
 
 HEADERS = {
     "User-Agent": "my-simple-script/1.0"
 }
 
-# 15分足固定 & 4本取得
-KLINE_INTERVAL = "15"       # Bybitの "15" → 15分足
-OI_INTERVAL = "15min"
-LIMIT_KLINE = 4             # Klineは4本
-LIMIT_OI = 20               # OIはstart/endを絞って最大20などにしておく
+# 基準足 (5分足) だけを取得し、各時間足 (5m/15m/30m/1h/4h/1d) はローカルで再集計する
+KLINE_INTERVAL = "5"        # Bybitの "5" → 5分足
+OI_INTERVAL = "5min"
+LIMIT_KLINE_PAGE = 1000     # Klineの1リクエスト上限
+LIMIT_OI = 200              # OIの1リクエスト上限 (以降は cursor でページング)
+# サマリのルックバック (本数)。先頭の N で既存の列 (最新の足と N 本前の変化率、直前 N 本の出来高平均との比較)
+# を作り、全ての N について直前 N 本に対する volume_z_N / oi_z_N、2つ目以降は price_change_rate_N も付ける。
+# 例) SUMMARY_LOOKBACKS="4,20,96"。長い窓はローリング統計 (rolling_stats.py) を足1本毎に O(1) で更新する
+SUMMARY_LOOKBACKS = parse_lookbacks(os.environ.get("SUMMARY_LOOKBACKS", "4"))
+SUMMARY_BARS = SUMMARY_LOOKBACKS[0]   # 各時間足で N 本前からの変化率を見る
+SUMMARY_WINDOW = SUMMARY_BARS + 1     # 最新の足 + N 本前まで
+ROLLING_EWMA_SPAN = int(os.environ.get("ROLLING_EWMA_SPAN", "20"))
+# バーストアの基準足で足りない長さのルックバックは、初回だけ時間足そのものの Kline / OI で埋める
+ROLLING_SEED = os.environ.get("ROLLING_SEED", "1") == "1"
+
+# 対象時間足 (環境変数 TIMEFRAMES="5m,15m,1h" などで絞り込み可)
+ENABLED_TIMEFRAMES = [
+    tf for tf in os.environ.get("TIMEFRAMES", ",".join(TIMEFRAMES)).split(",") if tf in TIMEFRAMES
+] or [DEFAULT_TIMEFRAME]
+LONGEST_TIMEFRAME = max(ENABLED_TIMEFRAMES, key=lambda tf: TIMEFRAMES[tf])
+
+# 非同期取得の同時実行数 (keep-alive接続プールの上限も兼ねる)
+ASYNC_CONCURRENCY = int(os.environ.get("FETCH_CONCURRENCY", "50"))
+ASYNC_TIMEOUT_SEC = 15
+
+# 更新スケジュール: 最後の成功から REFRESH_FRESHNESS_SEC 秒以内は再取得しない。
+# バックグラウンド更新は REFRESH_CADENCE_MIN 分足の確定 (+ 数秒) に合わせて実行
+REFRESH_FRESHNESS_SEC = int(os.environ.get("REFRESH_FRESHNESS_SEC", "60"))
+REFRESH_CADENCE_MIN = int(os.environ.get("REFRESH_CADENCE_MIN", "15"))
+REFRESH_OFFSET_SEC = 5
+# ティア別更新 (FETCH_MODE=full): "件数:間隔,..." 例) "50:1,150:3,0:6"。空なら毎回全銘柄
+REFRESH_TIERS = os.environ.get("REFRESH_TIERS", "")
 
-# 過去60分にすれば理論上4本の15分足を取得
-MINUTES_FOR_15M = 60
+# 取得モード: "full" = 全銘柄 Kline/OI/Funding, "snapshot" = tickers一括 + 足確定時のみ個別取得,
+#           "stream" = WebSocket (kline / tickers) で常時更新。REST は(再)接続時の埋め直しのみ
+FETCH_MODE = os.environ.get("FETCH_MODE", "full")
+BAR_MS = int(KLINE_INTERVAL) * 60 * 1000
+# 最長の時間足 SUMMARY_WINDOW 本分 + 1本分の余裕を基準足で保持
+BAR_STORE_CAPACITY = (SUMMARY_WINDOW + 1) * timeframe_ms(LONGEST_TIMEFRAME) // BAR_MS
 
 # データ保存ディレクトリ
 DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
 os.makedirs(DATA_DIR, exist_ok=True)
-CSV_PATH = os.path.join(DATA_DIR, "latest_summary_15m.csv")
+BAR_STORE_PATH = os.path.join(DATA_DIR, "bar_store_5m.npz")
+HISTORY_DIR = os.path.join(DATA_DIR, "history")
+HISTORY_ENABLED = os.environ.get("HISTORY_ENABLED", "1") == "1"
+INSTRUMENTS_PATH = os.path.join(DATA_DIR, "instruments_linear.json")
+
+# 実行形態: "standalone" = 各プロセスが自分で更新 (従来どおり),
+#          "collector"  = 更新専用プロセス (collector.py),
+#          "web"        = 更新せず、集計プロセスが書いた共有サマリ (mmap) を読むだけ
+RUN_ROLE = os.environ.get("RUN_ROLE", "standalone")
+SHARED_DIR = os.path.join(DATA_DIR, "shared")
+REFRESH_LOCK_PATH = os.path.join(SHARED_DIR, "refresh.lock")
+COLLECTOR_STATUS_PATH = os.path.join(SHARED_DIR, "collector.json")
+COLLECTOR_REQUEST_PATH = os.path.join(SHARED_DIR, "refresh_request.json")
+SHARED_POLL_SEC = 1.0
+# 銘柄一覧 (instruments-info) は上場・廃止が稀なので長めの TTL でキャッシュ
+INSTRUMENTS_TTL_SEC = int(os.environ.get("INSTRUMENTS_TTL_SEC", "3600"))
+
+# アラート: ルール定義 (JSON。無ければ無効, 更新されたら次の評価で読み直す) と通知先
+#   ALERT_SINKS="stdout,file:data/alerts.jsonl,webhook:https://..."
+ALERT_RULES_PATH = os.environ.get(
+    "ALERT_RULES_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "alert_rules.json"))
+ALERT_SINKS = os.environ.get("ALERT_SINKS", "stdout")
+# 一致中の銘柄と最近のイベント (再起動後の enter / leave 判定と、Web ワーカーの /api/alerts 用)
+ALERT_STATE_PATH = os.path.join(SHARED_DIR, "alerts.json")
+
+# /api/stream (SSE) の同時接続数の上限 (ワーカー毎)。gthread では1接続が1スレッドを切断まで占有するので、
+# gunicorn の --threads (Procfile の WEB_THREADS, 既定 64) より少なくし、通常のリクエスト用に残す。
+# 上限を超えた接続は 503 + Retry-After (ダッシュボードはその後に繋ぎ直す)
+SSE_MAX_CLIENTS = int(os.environ.get("SSE_MAX_CLIENTS", "48"))
+
+# サマリのスナップショット形式: "csv" (既定) / "feather" (Arrow IPC + zstd。CSV も併せて書く)
+SNAPSHOT_FORMAT = os.environ.get("SNAPSHOT_FORMAT", "csv")
+
+def summary_csv_path(tf):
+    return os.path.join(DATA_DIR, f"latest_summary_{tf}.csv")
+
+def summary_snapshot_path(tf):
+    # 他プロセス / 再起動後に読み直すファイル
+    if SNAPSHOT_FORMAT == "feather":
+        return os.path.join(DATA_DIR, f"latest_summary_{tf}.feather")
+    return summary_csv_path(tf)
+
+def rolling_stats_path(tf):
+    return os.path.join(DATA_DIR, f"rolling_{tf}.npz")
+
+CSV_PATH = summary_csv_path(DEFAULT_TIMEFRAME)
+
+# ローリング統計の列 → ダッシュボードの表示名
+ROLLING_COLUMNS = {}
+for _n in SUMMARY_LOOKBACKS:
+    if _n != SUMMARY_BARS:
+        ROLLING_COLUMNS[f"price_change_rate_{_n}"] = f"価格変動({_n})"
+    ROLLING_COLUMNS[f"volume_z_{_n}"] = f"出来高z({_n})"
+    ROLLING_COLUMNS[f"oi_z_{_n}"] = f"OIz({_n})"
+ROLLING_COLUMNS["volume_ewma_z"] = "出来高z(EWMA)"
 
 # ロックを使用してデータ更新の競合を防ぐ
 data_update_lock = threading.Lock()
 
+# 全Bybitリクエスト共通のスケジューラ (レート制御・リトライ・統計)
+request_scheduler = RequestScheduler(registry=metrics_registry)
+# 同期取得用の keep-alive セッション
+http_session = requests.Session()
+http_session.headers.update(HEADERS)
+
+# Funding Rate は次回精算時刻までキャッシュ
+funding_cache = FundingRateCache()
+
+# 銘柄毎のバーを保持し、差分 (最後に見た足以降) だけを取得する。再起動後は load_bar_state で npz から復元
+bar_store = BarStore(BAR_STORE_PATH, BAR_STORE_CAPACITY)
+
+# 時間足毎・銘柄毎のローリング統計 (確定足の合計・二乗和・EWMA)。bar_store と一緒に復元
+rolling_stats = {tf: RollingStats(SUMMARY_LOOKBACKS, ROLLING_EWMA_SPAN) for tf in ENABLED_TIMEFRAMES}
+# (銘柄, 時間足) → 最後に初期値を取得した足。上場直後で本数が足りない銘柄を毎回取りに行かない
+rolling_seeded = {}
+
+# /api/data 用: 時間足毎のサマリを JSON bytes + ETag で保持
+summary_cache = SummaryCache()
+
+# 全サマリと確定済みの基準足を Parquet に追記 (バックテスト / /api/history 用)
+history_store = HistoryStore(HISTORY_DIR)
+
+# 時間足毎のサマリをヘッダ付きのファイルで他プロセス (Web ワーカー) と共有
+shared_writer = SharedSummaryWriter(SHARED_DIR)
+shared_reader = SharedSummaryReader(SHARED_DIR)
+
+# /api/stream (SSE) の購読者へ進捗と差分を配信
+event_broker = EventBroker(SSE_MAX_CLIENTS)
+
+# サマリを公開する度にアラートルールを評価し、一致が変わった銘柄だけを通知
+alert_engine = AlertEngine(state_path=ALERT_STATE_PATH)
+alert_notifier = AlertNotifier(parse_sinks(ALERT_SINKS))
+
+# 銘柄の優先度 (シグナル / 売買代金) 別の更新間隔と、銘柄毎の最終取得時刻
+tier_planner = TierPlanner(parse_tiers(REFRESH_TIERS), REFRESH_CADENCE_MIN * 60)
+
+# 更新中のサマリ (時間足 → SummaryAccumulator)。/api/data?partial=1 で途中結果を返す
+partial_summaries = {}
+
+# 更新処理のメトリクス (/metrics)。リクエスト単位のものは request_scheduler が記録
+refresh_stage_seconds = metrics_registry.histogram(
+    "refresh_stage_duration_seconds", "Duration of each refresh stage.", ("stage",))
+refresh_seconds = metrics_registry.histogram(
+    "refresh_duration_seconds", "Duration of a full data refresh.", ("mode",))
+refresh_total = metrics_registry.counter(
+    "refresh_total", "Data refreshes by result.", ("mode", "result"))
+refresh_last_duration = metrics_registry.gauge(
+    "refresh_last_duration_seconds", "Duration of the most recent refresh.")
+refresh_last_success = metrics_registry.gauge(
+    "refresh_last_success_timestamp_seconds", "Unix time the last successful refresh finished.")
+refresh_symbols = metrics_registry.gauge(
+    "refresh_symbols", "Symbols listed / fetched in the most recent refresh.", ("state",))
+registry_symbols = metrics_registry.gauge(
+    "instruments_symbols", "Cached USDT instruments by status.", ("status",))
+
 # --------------------------------------------------------------------
 # 1. シンボル一覧 (USDT建て・先物)
+#    instruments-info は cursor で全ページ取得し、INSTRUMENTS_TTL_SEC の間キャッシュ。
+#    取引中 (status=Trading) かつ上場済みの銘柄だけを個別取得の対象にする
 # --------------------------------------------------------------------
+def fetch_instruments_page(cursor=None, category="linear"):
+    params = {"category": category, "limit": INSTRUMENTS_PAGE_LIMIT}
+    if cursor:
+        params["cursor"] = cursor
+    return request_scheduler.get_json(http_session, BASE_URL_SYMBOLS, params, "instruments-info")
+
+symbol_registry = SymbolRegistry(
+    fetch_instruments_page, INSTRUMENTS_TTL_SEC, INSTRUMENTS_PATH,
+    symbol_filter=lambda symbol, meta: symbol.endswith("USDT"),
+)
+
 def fetch_all_symbols(category="linear"):
     try:
-        params = {"category": category}
-        resp = requests.get(BASE_URL_SYMBOLS, params=params, headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        print("HTTPステータスコード:", resp.status_code)
-
-        symbols = [
-            item["symbol"] for item in data.get("result", {}).get("list", [])
-            if item.get("symbol", "").endswith("USDT")
-        ]
+        symbol_registry.refresh()
+        symbols = symbol_registry.active_symbols()
+        for status, count in symbol_registry.status_counts().items():
+            registry_symbols.set(count, status=status)
         return symbols
     except Exception as e:
         print(f"Error fetching symbols: {e}")
         return []
 
 # --------------------------------------------------------------------
-# 2. Kline (15分足 × 4本)
+# 2. Kline (5分足。limit が1000を超える場合は end をずらしてページング)
 # --------------------------------------------------------------------
-def get_kline_data(symbol, start_time, end_time):
+def kline_params(symbol, start_ms, end_ms, limit, interval=KLINE_INTERVAL):
+    return {
+        "category": "linear",
+        "symbol": symbol,
+        "interval": interval,  # "5"
+        "start": start_ms,
+        "end": end_ms,
+        "limit": min(limit, LIMIT_KLINE_PAGE)
+    }
+
+def get_kline_data(symbol, start_time, end_time, limit=SUMMARY_BARS):
     try:
-        params = {
-            "category": "linear",
-            "symbol": symbol,
-            "interval": KLINE_INTERVAL,  # "15"
-            "start": int(start_time.timestamp() * 1000),
-            "end": int(end_time.timestamp() * 1000),
-            "limit": LIMIT_KLINE        # 4
-        }
-        resp = requests.get(BASE_URL_KLINE, params=params, headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("result", {}).get("list", [])
+        rows = []
+        start_ms = int(start_time.timestamp() * 1000)
+        end_ms = int(end_time.timestamp() * 1000)
+        while len(rows) < limit:
+            params = kline_params(symbol, start_ms, end_ms, limit - len(rows))
+            data = request_scheduler.get_json(http_session, BASE_URL_KLINE, params, "kline")
+            page = data.get("result", {}).get("list", [])
+            rows.extend(page)
+            if len(page) < params["limit"]:
+                break
+            # list は新しい順 → 最古の足の直前までを次のページに
+            end_ms = int(page[-1][0]) - 1
+        return rows
     except Exception as e:
         print(f"Error fetching Kline data for {symbol}: {e}")
         return []
 
 # --------------------------------------------------------------------
-# 3. Open Interest (15分足相当)
+# 3. Open Interest (5分足相当。nextPageCursor でページング)
 # --------------------------------------------------------------------
+def oi_params(symbol, start_ms, end_ms, cursor=None, interval=OI_INTERVAL):
+    params = {
+        "category": "linear",
+        "symbol": symbol,
+        "intervalTime": interval,  # "5min"
+        "start": start_ms,
+        "end": end_ms,
+        "limit": LIMIT_OI            # up to 200
+    }
+    if cursor:
+        params["cursor"] = cursor
+    return params
+
 def get_open_interest_history(symbol, start_time, end_time):
     try:
-        params = {
-            "category": "linear",
-            "symbol": symbol,
-            "intervalTime": OI_INTERVAL,  # "15min"
-            "start": int(start_time.timestamp() * 1000),
-            "end": int(end_time.timestamp() * 1000),
-            "limit": LIMIT_OI            # up to 20
-        }
-        resp = requests.get(BASE_URL_OI, params=params, headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        rows = data.get("result", {}).get("list", [])
-        if not rows:
-            return None
-
-        df = pd.DataFrame(rows)
-        # timestamp ms → s
-        df["timestamp"] = pd.to_numeric(df["timestamp"], errors="coerce") // 1000
-        df["timestamp"] = pd.to_datetime(df["timestamp"], unit='s', utc=True).dt.tz_convert("Asia/Tokyo")
-        df["openInterest"] = pd.to_numeric(df["openInterest"], errors='coerce')
-        return df
+        rows = []
+        cursor = None
+        start_ms = int(start_time.timestamp() * 1000)
+        end_ms = int(end_time.timestamp() * 1000)
+        while True:
+            params = oi_params(symbol, start_ms, end_ms, cursor)
+            data = request_scheduler.get_json(http_session, BASE_URL_OI, params, "open-interest")
+            result = data.get("result", {})
+            page = result.get("list", [])
+            rows.extend(page)
+            cursor = result.get("nextPageCursor")
+            if not page or not cursor:
+                break
+        return parse_oi(rows)
     except Exception as e:
         print(f"Error fetching OI for {symbol}: {e}")
         return None
@@ -118,144 +305,641 @@ def get_funding_rate(symbol):
         params = {
             "category": "linear",
             "symbol": symbol,
-            "intervalTime": "8h",
             "start": int(start_time.timestamp() * 1000),
             "end": int(end_time.timestamp() * 1000),
-            "limit": 200
+            "limit": 1,  # 新しい順なので最新の精算1本だけ
         }
-        resp = requests.get(BASE_URL_FUNDING_HISTORY, params=params, headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        flist = data.get("result", {}).get("list", [])
-        if not flist:
-            return 0.0
-        return float(flist[-1].get("fundingRate", "0.0"))
+        data = request_scheduler.get_json(http_session, BASE_URL_FUNDING_HISTORY, params, "funding-history")
+        return latest_funding_rate(data.get("result", {}).get("list", []))
     except Exception as e:
         print(f"Error fetching funding rate for {symbol}: {e}")
-        return 0.0
+        return None
+
+def latest_funding_rate(flist):
+    # 取得できなかったときに 0.0 を入れると実データと区別できない (Funding フィルタの境界をまたぐ) ので None
+    # funding/history は新しい順だが、並びに頼らず精算時刻が最大の行を使う
+    if not flist:
+        return None
+    try:
+        latest = max(flist, key=lambda r: int(r.get("fundingRateTimestamp") or 0))
+        return float(latest["fundingRate"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+def fallback_funding_rate(symbol, rate):
+    """個別取得に失敗したら最後に取得できた値。それも無ければ None (この更新ではその銘柄を除く)"""
+    if rate is None:
+        rate = funding_cache.last(symbol)
+        if rate is None:
+            print(f"No funding rate for {symbol}, skipping this refresh")
+    return rate
+
+# --------------------------------------------------------------------
+# 4b. Funding Rate 一括取得 (tickers 1回で全銘柄) + 精算スケジュールキャッシュ
+# --------------------------------------------------------------------
+def fetch_tickers(category="linear"):
+    try:
+        params = {"category": category}
+        data = request_scheduler.get_json(http_session, BASE_URL_TICKERS, params, "tickers")
+        return data.get("result", {}).get("list", [])
+    except Exception as e:
+        print(f"Error fetching tickers: {e}")
+        return []
+
+def get_funding_rates(symbols):
+    # キャッシュ切れ (次回精算時刻を過ぎた) 銘柄があれば tickers で一括更新
+    if funding_cache.missing(symbols):
+        funding_cache.update_from_tickers(fetch_tickers())
+    return funding_cache.lookup(symbols)
 
 # --------------------------------------------------------------------
 # 5. 1銘柄の取得
 # --------------------------------------------------------------------
-def fetch_data_for_symbol(symbol):
+def fetch_data_for_symbol(symbol, funding_rate=None):
     try:
-        # 15分足4本 → 過去60分で十分(余裕をみて75分でもOK)
+        # 15分足4本 → 過去60分で十分。バーストアにある足以降だけを取得
         end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(minutes=MINUTES_FOR_15M)
+        start_time, limit = incremental_window(symbol, end_time)
 
         # Kline
-        kline_data = get_kline_data(symbol, start_time, end_time)
+        kline_data = get_kline_data(symbol, start_time, end_time, limit)
         if not kline_data:
             return None
 
         # OI
         oi_data = get_open_interest_history(symbol, start_time, end_time)
-        # Funding
-        funding_rate = get_funding_rate(symbol)
-
-        # Kline DF
-        kline_df = pd.DataFrame([
-            {
-                "symbol": symbol,
-                "timestamp": datetime.fromtimestamp(int(e[0]) / 1000, tz=timezone.utc).astimezone(pytz_timezone("Asia/Tokyo")),
-                "open": float(e[1]),
-                "high": float(e[2]),
-                "low":  float(e[3]),
-                "close": float(e[4]),
-                "volume": float(e[5]),
-                "fundingRate": funding_rate
-            }
-            for e in kline_data
-        ])
-
-        if oi_data is not None and not oi_data.empty:
-            merged = pd.merge(kline_df, oi_data, on="timestamp", how="left").fillna(0)
-            return merged
-        return kline_df
+        # Funding (一括取得で取れなかった銘柄のみ個別に取得)
+        if funding_rate is None:
+            funding_rate = fallback_funding_rate(symbol, get_funding_rate(symbol))
+        if funding_rate is None:
+            put_symbol_bars(symbol, kline_data, oi_data)
+            return None
+
+        return store_symbol_bars(symbol, kline_data, oi_data, funding_rate)
     except Exception as e:
         print(f"Error fetch_data_for_symbol: {symbol}, {e}")
         return None
 
+def incremental_window(symbol, end_time):
+    """
+    取得範囲と本数を返す。ストアの最新足が最長時間足 SUMMARY_WINDOW 本分の範囲内ならその足
+    (確定前の足) から、そうでなければ最長時間足 SUMMARY_WINDOW 本分をまとめて取得する
+    """
+    end_ms = int(end_time.timestamp() * 1000)
+    full_start_ms = window_start_ms(end_ms, LONGEST_TIMEFRAME, SUMMARY_WINDOW)
+    last_ms = bar_store.last_timestamp(symbol)
+    start_ms = last_ms if last_ms >= full_start_ms else full_start_ms
+    n_bars = int((end_ms - start_ms) // BAR_MS) + 1
+    return datetime.fromtimestamp(start_ms / 1000, tz=timezone.utc), n_bars
+
+def store_symbol_bars(symbol, kline_data, oi_data, funding_rate):
+    put_symbol_bars(symbol, kline_data, oi_data)
+    return timeframe_frame([symbol], DEFAULT_TIMEFRAME, {symbol: funding_rate})
+
+def put_symbol_bars(symbol, kline_data, oi_data):
+    # 生の list を int64 ts + float64 配列にし、OI は同じ ts の足に突き合わせる
+    ts, bars = parse_klines(kline_data)
+    if oi_data is not None:
+        merge_oi(ts, bars, *oi_data)
+    bar_store.upsert_bars(symbol, ts, bars)
+
+def timeframe_frame(symbols, tf, funding_rates, now_ms=None):
+    """
+    バーストアの基準足を tf に再集計し、fetch_data_parallel と同じ形式で返す
+    """
+    now_ms = now_ms or int(time.time() * 1000)
+    bars = bar_store.bars_since(window_start_ms(now_ms, tf, SUMMARY_WINDOW), symbols)
+    return to_summary_input(resample_bars(bars, tf), funding_rates)
+
 # --------------------------------------------------------------------
 # 6. 並列取得
 # --------------------------------------------------------------------
-def fetch_data_parallel(symbols):
+def fetch_data_parallel(symbols, progress=None):
     all_data = []
+    funding_rates = get_funding_rates(symbols)
     with ThreadPoolExecutor(max_workers=10) as exe:
-        future_map = {exe.submit(fetch_data_for_symbol, s): s for s in symbols}
-        for f in as_completed(future_map):
+        future_map = {exe.submit(fetch_data_for_symbol, s, funding_rates.get(s)): s for s in symbols}
+        for done, f in enumerate(as_completed(future_map), 1):
             try:
                 df = f.result()
                 if df is not None and not df.empty:
                     all_data.append(df)
             except Exception as e:
                 print(f"Error in symbol={future_map[f]}: {e}")
+            if progress:
+                progress(done, len(symbols))
     if all_data:
         return pd.concat(all_data, ignore_index=True)
     return pd.DataFrame()
 
 # --------------------------------------------------------------------
-# 7. サマリ (4本) + 出来高スパイク
+# 6b. 非同期並列取得 (aiohttp / keep-alive接続プール)
+#     1銘柄あたり Kline・OI・Funding の3リクエストを同時に発行する
 # --------------------------------------------------------------------
-def summarize_data_4bars(data):
+async def get_kline_data_async(session, symbol, start_time, end_time, limit=SUMMARY_BARS, interval=KLINE_INTERVAL):
+    try:
+        rows = []
+        start_ms = int(start_time.timestamp() * 1000)
+        end_ms = int(end_time.timestamp() * 1000)
+        while len(rows) < limit:
+            params = kline_params(symbol, start_ms, end_ms, limit - len(rows), interval)
+            data = await request_scheduler.get_json_async(session, BASE_URL_KLINE, params, "kline")
+            page = data.get("result", {}).get("list", [])
+            rows.extend(page)
+            if len(page) < params["limit"]:
+                break
+            end_ms = int(page[-1][0]) - 1
+        return rows
+    except Exception as e:
+        print(f"Error fetching Kline data for {symbol}: {e}")
+        return []
+
+async def get_open_interest_history_async(session, symbol, start_time, end_time, interval=OI_INTERVAL):
+    try:
+        rows = []
+        cursor = None
+        start_ms = int(start_time.timestamp() * 1000)
+        end_ms = int(end_time.timestamp() * 1000)
+        while True:
+            params = oi_params(symbol, start_ms, end_ms, cursor, interval)
+            data = await request_scheduler.get_json_async(session, BASE_URL_OI, params, "open-interest")
+            result = data.get("result", {})
+            page = result.get("list", [])
+            rows.extend(page)
+            cursor = result.get("nextPageCursor")
+            if not page or not cursor:
+                break
+        return parse_oi(rows)
+    except Exception as e:
+        print(f"Error fetching OI for {symbol}: {e}")
+        return None
+
+async def get_funding_rate_async(session, symbol):
+    try:
+        end_time = datetime.now(timezone.utc)
+        start_time = end_time - timedelta(hours=48)
+        params = {
+            "category": "linear",
+            "symbol": symbol,
+            "start": int(start_time.timestamp() * 1000),
+            "end": int(end_time.timestamp() * 1000),
+            "limit": 1,  # 新しい順なので最新の精算1本だけ
+        }
+        data = await request_scheduler.get_json_async(session, BASE_URL_FUNDING_HISTORY, params, "funding-history")
+        return latest_funding_rate(data.get("result", {}).get("list", []))
+    except Exception as e:
+        print(f"Error fetching funding rate for {symbol}: {e}")
+        return None
+
+async def fetch_tickers_async(session, category="linear"):
+    try:
+        params = {"category": category}
+        data = await request_scheduler.get_json_async(session, BASE_URL_TICKERS, params, "tickers")
+        return data.get("result", {}).get("list", [])
+    except Exception as e:
+        print(f"Error fetching tickers: {e}")
+        return []
+
+async def get_funding_rates_async(session, symbols):
+    if funding_cache.missing(symbols):
+        funding_cache.update_from_tickers(await fetch_tickers_async(session))
+    return funding_cache.lookup(symbols)
+
+async def _cached_value(value):
+    return value
+
+async def fetch_data_for_symbol_async(session, semaphore, symbol, funding_rate=None):
+    funding_rate = await fetch_symbol_bars_async(session, semaphore, symbol, funding_rate)
+    if funding_rate is None:
+        return None
+    return timeframe_frame([symbol], DEFAULT_TIMEFRAME, {symbol: funding_rate})
+
+async def fetch_symbol_bars_async(session, semaphore, symbol, funding_rate=None):
+    """バーストアを更新し、Funding Rate を返す (足か Funding が取得できなければ None)"""
+    async with semaphore:
+        try:
+            end_time = datetime.now(timezone.utc)
+            start_time, limit = incremental_window(symbol, end_time)
+
+            if funding_rate is None:
+                funding_call = get_funding_rate_async(session, symbol)
+            else:
+                funding_call = _cached_value(funding_rate)
+            kline_data, oi_data, funding_rate = await asyncio.gather(
+                get_kline_data_async(session, symbol, start_time, end_time, limit),
+                get_open_interest_history_async(session, symbol, start_time, end_time),
+                funding_call,
+            )
+            if not kline_data:
+                return None
+            put_symbol_bars(symbol, kline_data, oi_data)
+            return fallback_funding_rate(symbol, funding_rate)
+        except Exception as e:
+            print(f"Error fetch_data_for_symbol: {symbol}, {e}")
+            return None
+
+async def fetch_bars_async(symbols, concurrency=None, progress=None, on_symbol=None):
     """
-    4本分の変化率を計算:
+    全銘柄のバーを取得してバーストアへ入れる。銘柄が届く度に on_symbol(symbol, funding_rate)
+    を呼ぶ。取得できた銘柄の {symbol: funding_rate} を返す
+    """
+    concurrency = concurrency or ASYNC_CONCURRENCY
+    # semaphoreは銘柄単位、接続数は3リクエスト分を見込んで確保
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency * 3, keepalive_timeout=60, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=ASYNC_TIMEOUT_SEC)
+
+    fetched = {}
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS) as session:
+        funding_rates = await get_funding_rates_async(session, symbols)
+
+        async def fetch_one(symbol):
+            return symbol, await fetch_symbol_bars_async(session, semaphore, symbol, funding_rates.get(symbol))
+
+        for done, task in enumerate(asyncio.as_completed([fetch_one(s) for s in symbols]), 1):
+            try:
+                symbol, funding_rate = await task
+                if funding_rate is not None:
+                    fetched[symbol] = funding_rate
+                    if on_symbol:
+                        on_symbol(symbol, funding_rate)
+            except Exception as e:
+                print(f"Error in async fetch: {e}")
+            if progress:
+                progress(done, len(symbols))
+    return fetched
+
+async def fetch_data_parallel_async(symbols, concurrency=None, progress=None):
+    all_data = []
+    def collect(symbol, funding_rate):
+        all_data.append(timeframe_frame([symbol], DEFAULT_TIMEFRAME, {symbol: funding_rate}))
+    await fetch_bars_async(symbols, concurrency, progress, collect)
+    all_data = [df for df in all_data if not df.empty]
+    if all_data:
+        return pd.concat(all_data, ignore_index=True)
+    return pd.DataFrame()
+
+def fetch_data_async(symbols, concurrency=None, progress=None):
+    """
+    fetch_data_parallel と同じ結合済みDataFrameを返す同期ラッパー。
+    Flaskのスレッド / FastAPIの同期ハンドラからそのまま呼べる。
+    """
+    return asyncio.run(fetch_data_parallel_async(symbols, concurrency, progress))
+
+# --------------------------------------------------------------------
+# 6d. ストリーミング集計
+#     届いた銘柄から順に各時間足のサマリ行へ畳み込む
+#     (銘柄毎の DataFrame → concat → groupby を経由しない)
+# --------------------------------------------------------------------
+def new_summary_builds(capacity, timeframes=None):
+    return {
+        tf: SummaryAccumulator(tf, capacity, SUMMARY_BARS, SMALL_PRICE_THRESHOLD, VOLUME_SPIKE_RATIO)
+        for tf in (timeframes or ENABLED_TIMEFRAMES)
+    }
+
+def reduce_symbol(builds, symbol, funding_rate, now_ms):
+    """バーストアの1銘柄分を各時間足に再集計し、ローリング統計とサマリ行に追加"""
+    starts = {tf: rolling_start_ms(symbol, tf, now_ms) for tf in builds}
+    for tf, tf_ts, tf_bars in symbol_timeframes(symbol, starts):
+        feed_rolling(symbol, tf, tf_ts, tf_bars)
+        builds[tf].add(symbol, tf_ts, tf_bars, funding_rate)
+
+def symbol_timeframes(symbol, starts):
+    """バーストアの1銘柄分を starts (時間足 → 先頭 ms) の各時間足に再集計して (tf, ts, bars) を返す"""
+    ts, values = bar_store.symbol_bars(symbol, min(starts.values()))
+    for tf, start in starts.items():
+        mask = ts >= start
+        yield (tf, *resample_arrays(ts[mask], values[mask], tf))
+
+def rolling_start_ms(symbol, tf, now_ms):
+    """サマリの SUMMARY_WINDOW 本と、ローリング統計にまだ入れていない確定足を含む範囲の先頭"""
+    last_ms = rolling_stats[tf].last_timestamp(symbol)
+    if not last_ms:
+        return window_start_ms(now_ms, tf, max(SUMMARY_LOOKBACKS) + 1)
+    return min(window_start_ms(now_ms, tf, SUMMARY_WINDOW), last_ms + timeframe_ms(tf))
+
+def feed_rolling(symbol, tf, tf_ts, tf_bars):
+    # 最新の足 (確定前) を除き、前回より新しい足だけをローリング統計へ
+    # (tickers だけで始めた synthetic な足を含む時間足の足は REST で取り直すまで入れない)
+    tf_ms = timeframe_ms(tf)
+    n = len(tf_ts) - 1
+    first_synthetic = bar_store.first_synthetic(symbol)
+    if first_synthetic:
+        n = min(n, int(np.searchsorted(tf_ts + tf_ms, first_synthetic, side="right")))
+    if n > 0:
+        rolling_stats[tf].push_bars(symbol, tf_ts[:n], tf_bars[:n], tf_ms)
+
+def feed_rolling_all(symbols, now_ms):
+    """DataFrame で集計する経路 (snapshot / stream) 用。新しく確定した足がある時間足だけ再集計する"""
+    for symbol in symbols:
+        bucket_ms = bar_store.last_timestamp(symbol)
+        starts = {}
+        for tf, stats in rolling_stats.items():
+            tf_ms = timeframe_ms(tf)
+            last_ms = stats.last_timestamp(symbol)
+            if not last_ms or bucket_ms // tf_ms * tf_ms > last_ms + tf_ms:
+                starts[tf] = rolling_start_ms(symbol, tf, now_ms)
+        if starts:
+            for tf, tf_ts, tf_bars in symbol_timeframes(symbol, starts):
+                feed_rolling(symbol, tf, tf_ts, tf_bars)
+
+def with_rolling(tf, summary_df):
+    """サマリの最新の足にローリング統計の列 (ROLLING_COLUMNS) を付ける。本数が足りない銘柄は 0"""
+    if summary_df.empty:
+        return summary_df
+    features = rolling_stats[tf].features(
+        summary_df["symbol"].values, summary_df["close"].values,
+        summary_df["volume"].values, summary_df["openInterest"].values,
+    )
+    df = summary_df.copy()
+    for col in ROLLING_COLUMNS:
+        df[col] = np.round(np.nan_to_num(features[col]), 3)
+    return df
+
+def fetch_summaries_async(symbols, builds, concurrency=None, progress=None, now_ms=None):
+    """
+    取得と集計を重ねて実行する同期ラッパー。builds (時間足 → SummaryAccumulator) に
+    結果を溜め、取得できた銘柄の {symbol: funding_rate} を返す
+    """
+    now_ms = now_ms or int(time.time() * 1000)
+    on_symbol = lambda symbol, funding_rate: reduce_symbol(builds, symbol, funding_rate, now_ms)
+    return asyncio.run(fetch_bars_async(symbols, concurrency, progress, on_symbol))
+
+# --------------------------------------------------------------------
+# 6c. スナップショット取得 (tickers 1回 + 2本以上遅れている銘柄だけ個別取得)
+#     close / openInterest / fundingRate は tickers の最新値でバーストアの
+#     確定前の足を上書きする。前の足まで持っている銘柄は、足が切り替わっても
+#     tickers の値で現在の足を始め (synthetic)、確定した足は Kline / OI だけを
+#     まとめて取り直す (出来高は tickers に足単位の値が無いため)。取り直せなかった
+#     synthetic な足は次回また取り直し、それまで履歴とローリング統計には入れない
+# --------------------------------------------------------------------
+def current_bar_start_ms(now=None):
+    now_ms = int((now or datetime.now(timezone.utc)).timestamp() * 1000)
+    return now_ms // BAR_MS * BAR_MS
+
+def apply_tickers_to_store(tickers):
+    for t in tickers:
+        close = pd.to_numeric(t.get("lastPrice"), errors="coerce")
+        oi = pd.to_numeric(t.get("openInterest"), errors="coerce")
+        bar_store.update_latest(t.get("symbol"), close, oi)
+
+async def refetch_symbol_bars_async(session, semaphore, symbol, start_ms, now_ms):
+    start_time = datetime.fromtimestamp(start_ms / 1000, tz=timezone.utc)
+    end_time = datetime.fromtimestamp(now_ms / 1000, tz=timezone.utc)
+    n_bars = int((now_ms - start_ms) // BAR_MS) + 1
+    async with semaphore:
+        kline_data, oi_data = await asyncio.gather(
+            get_kline_data_async(session, symbol, start_time, end_time, n_bars),
+            get_open_interest_history_async(session, symbol, start_time, end_time),
+        )
+    if not kline_data:
+        return False
+    put_symbol_bars(symbol, kline_data, oi_data)
+    return True
+
+async def refetch_bars_async(starts, concurrency=None, now_ms=None):
+    """
+    starts (symbol → 先頭 ms) 以降の Kline / OI を取り直してバーストアへ入れる (Funding は取らない)。
+    取り直せなかった銘柄のリストを返す
+    """
+    concurrency = concurrency or ASYNC_CONCURRENCY
+    now_ms = now_ms or int(time.time() * 1000)
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency * 2, keepalive_timeout=60, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=ASYNC_TIMEOUT_SEC)
+    symbols = list(starts)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS) as session:
+        results = await asyncio.gather(
+            *(refetch_symbol_bars_async(session, semaphore, s, starts[s], now_ms) for s in symbols),
+            return_exceptions=True,
+        )
+    failed = []
+    for symbol, result in zip(symbols, results):
+        if isinstance(result, Exception):
+            print(f"Error refetching bars: {symbol}, {result}")
+        if result is not True:
+            failed.append(symbol)
+    return failed
+
+def fetch_data_snapshot(symbols, concurrency=None, progress=None, roll_bars=True):
+    """
+    fetch_data_parallel と同じ形式のDataFrameを返す。
+    バーストアが前の足まで追いついている銘柄は HTTP を使わず、
+    tickers の一括レスポンスだけで最新バーを更新する。
+    roll_bars=False なら現在の足が無い銘柄は全て取得する (確定した足の値を REST で取り直すとき)
+    """
+    tickers = fetch_tickers()
+    funding_cache.update_from_tickers(tickers)
+
+    bar_start = current_bar_start_ms()
+    listed = {t.get("symbol") for t in tickers}
+    last_ts = {s: bar_store.last_timestamp(s) for s in symbols}
+    # 前の足まである銘柄は tickers で現在の足を始める (足の切り替わり毎に全銘柄を取り直さない)
+    rolled = {s for s in symbols if roll_bars and s in listed and last_ts[s] == bar_start - BAR_MS}
+    stale = [s for s in symbols if last_ts[s] < bar_start and s not in rolled]
+    if stale:
+        print(f"Snapshot: fetching bars for {len(stale)} symbols")
+        asyncio.run(fetch_bars_async(stale, concurrency, progress))
+    for s in rolled:
+        bar_store.start_bar(s, bar_start)
+    # 確定した足 (と前回取り直せなかった synthetic な足) の Kline / OI を取り直す
+    refetch = {}
+    for s in symbols:
+        first_synthetic = bar_store.first_synthetic(s)
+        if s in rolled or first_synthetic:
+            refetch[s] = min(bar_start - BAR_MS, first_synthetic or bar_start)
+    if refetch:
+        failed = asyncio.run(refetch_bars_async(refetch, concurrency))
+        if failed:
+            print(f"Snapshot: failed to refetch closed bars for {len(failed)} symbols")
+
+    wanted = set(symbols)
+    apply_tickers_to_store([t for t in tickers if t.get("symbol") in wanted])
+    # tickers が取れなかったときは前回の値。一度も取れていない銘柄は今回は除く
+    funding_rates = funding_cache.latest(symbols)
+    return timeframe_frame(list(funding_rates), DEFAULT_TIMEFRAME, funding_rates)
+
+# --------------------------------------------------------------------
+# 6e. ローリング統計の初期値
+#     バーストアの基準足だけでは max(ルックバック) + 1 本に届かない時間足 (4h / 1d の長い窓など) は、
+#     まだ溜まっていない銘柄だけ時間足そのものの Kline / OI を1回ずつ取得して埋める
+# --------------------------------------------------------------------
+def rolling_seed_timeframes():
+    n_bars = max(SUMMARY_LOOKBACKS) + 1
+    return [tf for tf in rolling_stats if BAR_STORE_CAPACITY * BAR_MS // timeframe_ms(tf) < n_bars]
+
+async def seed_symbol_rolling_async(session, semaphore, symbol, tf, now_ms):
+    tf_ms = timeframe_ms(tf)
+    n_bars = max(SUMMARY_LOOKBACKS) + 1
+    start_time = datetime.fromtimestamp(window_start_ms(now_ms, tf, n_bars) / 1000, tz=timezone.utc)
+    end_time = datetime.fromtimestamp(now_ms / 1000, tz=timezone.utc)
+    async with semaphore:
+        kline_data, oi_data = await asyncio.gather(
+            get_kline_data_async(session, symbol, start_time, end_time, n_bars, BYBIT_KLINE_INTERVALS[tf]),
+            get_open_interest_history_async(session, symbol, start_time, end_time, BYBIT_OI_INTERVALS[tf]),
+        )
+    if not kline_data:
+        return False
+    ts, bars = parse_klines(kline_data)
+    if oi_data is not None:
+        merge_oi(ts, bars, *oi_data)
+    closed = ts < now_ms // tf_ms * tf_ms
+    rolling_stats[tf].seed(symbol, ts[closed], bars[closed], tf_ms)
+    return True
+
+async def seed_rolling_async(jobs, now_ms, concurrency=None):
+    concurrency = concurrency or ASYNC_CONCURRENCY
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency * 2, keepalive_timeout=60, ttl_dns_cache=300)
+    timeout = aiohttp.ClientTimeout(total=ASYNC_TIMEOUT_SEC)
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout, headers=HEADERS) as session:
+        results = await asyncio.gather(
+            *(seed_symbol_rolling_async(session, semaphore, s, tf, now_ms) for s, tf in jobs),
+            return_exceptions=True,
+        )
+    for (symbol, tf), result in zip(jobs, results):
+        if isinstance(result, Exception):
+            print(f"Error seeding rolling stats: {symbol} {tf}, {result}")
+    return sum(result is True for result in results)
+
+def seed_rolling(symbols, concurrency=None, now_ms=None):
+    """まだ溜まっていない (銘柄, 時間足) のローリング統計を埋め、埋めた数を返す"""
+    timeframes = rolling_seed_timeframes() if ROLLING_SEED else []
+    if not timeframes:
+        return 0
+    now_ms = now_ms or int(time.time() * 1000)
+    jobs = []
+    for tf in timeframes:
+        bucket_ms = now_ms // timeframe_ms(tf) * timeframe_ms(tf)
+        for symbol in symbols:
+            if rolling_seeded.get((symbol, tf)) != bucket_ms and not rolling_stats[tf].warm(symbol):
+                rolling_seeded[(symbol, tf)] = bucket_ms
+                jobs.append((symbol, tf))
+    if not jobs:
+        return 0
+    print(f"Seeding rolling stats for {len(jobs)} symbol/timeframes")
+    try:
+        return asyncio.run(seed_rolling_async(jobs, now_ms, concurrency))
+    except Exception as e:
+        print(f"Error seeding rolling stats: {e}")
+        return 0
+
+# 最後にバーの状態を保存した時点の足と、その後に保存を見送った更新があるか
+_bar_state_saved_bar = 0
+_bar_state_pending = False
+# 保存したバーの状態を読み込み済みか (load_bar_state)
+_bar_state_loaded = False
+_bar_state_load_lock = threading.Lock()
+
+def load_bar_state():
+    """
+    保存したバーストアとローリング統計を読み込み、終了時の保存を登録する。
+    取得・集計を始めるプロセスが起動時に1度だけ呼ぶ (import しただけでは data/ を読み書きしない)
+    """
+    global _bar_state_loaded
+    with _bar_state_load_lock:
+        if _bar_state_loaded:
+            return
+        _bar_state_loaded = True
+        bar_store.load()
+        for tf, stats in rolling_stats.items():
+            stats.load(rolling_stats_path(tf))
+        # Web ワーカー (RUN_ROLE=web) はバーストアを更新しないので書かない
+        if RUN_ROLE != "web":
+            atexit.register(save_pending_bar_state)
+
+def save_bar_state(force=False):
+    """
+    バーストアとローリング統計 (差分取得・O(1) 更新の起点) を保存。
+    全銘柄分 (数十MB) を書き直すので、前回の保存から足が確定していなければ見送る
+    (見送った分は次の足か終了時に書く)。保存したら True
+    """
+    global _bar_state_saved_bar, _bar_state_pending
+    bar_start = current_bar_start_ms()
+    if not force and bar_start <= _bar_state_saved_bar:
+        _bar_state_pending = True
+        return False
+    bar_store.save()
+    for tf, stats in rolling_stats.items():
+        try:
+            stats.save(rolling_stats_path(tf))
+        except OSError as e:
+            print(f"Error saving rolling stats ({tf}): {e}")
+    _bar_state_saved_bar, _bar_state_pending = bar_start, False
+    return True
+
+def save_pending_bar_state():
+    # 終了時: 見送っていた更新があれば書く
+    if _bar_state_pending:
+        save_bar_state(force=True)
+
+# --------------------------------------------------------------------
+# 7. サマリ (N本前との比較) + 出来高スパイク
+# --------------------------------------------------------------------
+SMALL_PRICE_THRESHOLD = 0.5  # 価格変動率の閾値（適宜調整）
+VOLUME_SPIKE_RATIO = 2.0
+
+def _change_rate(new, old):
+    # 変化率計算: (最新 - N本前) / N本前 * 100 (N本前が0なら0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(old != 0, (new - old) / old * 100, 0.0)
+
+def summarize_data_4bars(data, n_bars=None):
+    """
+    最新の足と N 本前 (既定は SUMMARY_BARS = 4) の変化率を全銘柄まとめて (ベクトル演算で) 計算:
       - price_change_rate
       - volume_change_rate
       - oi_change_rate
-    出来高スパイク: 最新バーが直近4本平均の2倍以上
+    出来高スパイク: 最新バーが直前 N 本 (最新を含まない) の平均の2倍以上
     """
+    n_bars = n_bars or SUMMARY_BARS
     try:
-        summary = []
-        grouped = data.groupby("symbol")
+        if data.empty:
+            return pd.DataFrame()
+        df = data.sort_values(["symbol", "timestamp"], kind="mergesort").reset_index(drop=True)
+        if "openInterest" not in df.columns:
+            df["openInterest"] = 0.0
+        if "fundingRate" not in df.columns:
+            df["fundingRate"] = 0.0
 
-        for symbol, group in grouped:
-            group = group.sort_values("timestamp")
-            if len(group) < 4:
-                continue
+        # 銘柄毎に「後ろから何本目か」と本数を求め、N+1 本未満の銘柄は除外
+        grouped = df.groupby("symbol", sort=False)
+        from_end = grouped.cumcount(ascending=False).values
+        size = grouped["symbol"].transform("size").values
+        enough = size > n_bars
+
+        latest = df[enough & (from_end == 0)].reset_index(drop=True)
+        oldest = df[enough & (from_end == n_bars)].reset_index(drop=True)
+        window = df[enough & (from_end >= 1) & (from_end <= n_bars)]
+        vol_ma = window.groupby("symbol", sort=False)["volume"].mean().reindex(latest["symbol"]).values
+
+        price_chg = _change_rate(latest["close"].values, oldest["close"].values)
+        vol_chg = _change_rate(latest["volume"].values, oldest["volume"].values)
+        oi_chg = _change_rate(latest["openInterest"].values, oldest["openInterest"].values)
 
-            latest = group.iloc[-1]
-
-            # 変化率計算: (最新 - 4本前) / 4本前 * 100
-            def calc_rate(df, col):
-                val_new = df[col].iloc[-1]
-                val_old = df[col].iloc[-4]
-                if val_old != 0:
-                    return (val_new - val_old) / val_old * 100
-                return 0.0
-
-            price_chg = calc_rate(group, "close")
-            vol_chg   = calc_rate(group, "volume")
-            oi_chg    = calc_rate(group, "openInterest")
-
-            # 出来高スパイク判定
-            vol_latest = group["volume"].iloc[-1]
-            vol_ma_4    = group["volume"].tail(4).mean()
-            volume_spike_flag = (vol_ma_4 > 0 and vol_latest >= 2.0 * vol_ma_4)
-
-            # Small Price Move Flag の追加（例: 価格変動が一定以下）
-            SMALL_PRICE_THRESHOLD = 0.5  # 価格変動率の閾値（適宜調整）
-            small_price_move_flag = abs(price_chg) <= SMALL_PRICE_THRESHOLD
-
-            summary.append({
-                "symbol":       symbol,
-                "timestamp":    latest["timestamp"].strftime('%Y-%m-%d %H:%M:%S'),
-                "open":         latest["open"],
-                "high":         latest["high"],
-                "low":          latest["low"],
-                "close":        latest["close"],
-                "volume":       latest["volume"],
-                "openInterest": latest.get("openInterest", 0),
-                "funding_rate": round(latest.get("fundingRate", 0), 6),
-
-                "price_change_rate":  round(price_chg, 3),
-                "volume_change_rate": round(vol_chg, 3),
-                "oi_change_rate":     round(oi_chg, 3),
-
-                "volume_spike_flag": small_price_move_flag,
-                "small_price_move_flag": small_price_move_flag
-            })
-        return pd.DataFrame(summary).fillna(0)
+        vol_latest = latest["volume"].values
+        volume_spike_flag = (vol_ma > 0) & (vol_latest >= VOLUME_SPIKE_RATIO * vol_ma)
+        small_price_move_flag = np.abs(price_chg) <= SMALL_PRICE_THRESHOLD
+
+        summary = pd.DataFrame({
+            "symbol":       latest["symbol"].values,
+            "timestamp":    pd.to_datetime(latest["timestamp"]).dt.strftime('%Y-%m-%d %H:%M:%S').values,
+            "open":         latest["open"].values,
+            "high":         latest["high"].values,
+            "low":          latest["low"].values,
+            "close":        latest["close"].values,
+            "volume":       vol_latest,
+            "openInterest": latest["openInterest"].values,
+            "funding_rate": np.round(latest["fundingRate"].values.astype(float), 6),
+
+            "price_change_rate":  np.round(price_chg, 3),
+            "volume_change_rate": np.round(vol_chg, 3),
+            "oi_change_rate":     np.round(oi_chg, 3),
+
+            "volume_spike_flag":     volume_spike_flag,
+            "small_price_move_flag": small_price_move_flag,
+        })
+        return summary.fillna(0)
     except Exception as e:
         print(f"Error summarizing data(4bars): {e}")
         return pd.DataFrame()
@@ -264,64 +948,340 @@ def summarize_data_4bars(data):
 # 8. データ更新関数
 # --------------------------------------------------------------------
 def update_data():
-    with data_update_lock:
+    # 同じホストの他のプロセス (gunicorn の別ワーカー等) が更新中なら重ねて実行しない
+    with data_update_lock, host_lock(REFRESH_LOCK_PATH) as acquired:
+        if not acquired:
+            print("Data update is running in another process, skipping.")
+            return False
         print(f"Data update started at {datetime.now()}")
+        t0 = time.perf_counter()
+        try:
+            ok = _update_data()
+        except Exception as e:
+            print(f"Error updating data: {e}")
+            ok = False
+        finally:
+            partial_summaries.clear()
+        elapsed = time.perf_counter() - t0
+        refresh_seconds.observe(elapsed, mode=FETCH_MODE)
+        refresh_total.inc(mode=FETCH_MODE, result="success" if ok else "failure")
+        refresh_last_duration.set(round(elapsed, 3))
+        if ok:
+            refresh_last_success.set(round(time.time(), 3))
+        event_broker.progress("done" if ok else "failed", force=True)
+        print(f"Data update finished in {elapsed:.1f}s (ok={ok})")
+        return ok
+
+def _update_data():
+    event_broker.progress("symbols", force=True)
+    with refresh_stage_seconds.time(stage="symbols"):
         symbols = fetch_all_symbols()
-        if not symbols:
-            print("No symbols retrieved.")
-            return False
-        print(f"Total symbols: {len(symbols)}")
+    refresh_symbols.set(len(symbols), state="listed")
+    if not symbols:
+        print("No symbols retrieved.")
+        return False
+    print(f"Total symbols: {len(symbols)}")
 
-        df_all = fetch_data_parallel(symbols)
-        if df_all.empty:
-            print("No data fetched.")
-            return False
+    request_scheduler.reset_stats()
+    progress = lambda done, total: event_broker.progress("fetch", done, total)
+    carried = []
+    with refresh_stage_seconds.time(stage="fetch"):
+        if FETCH_MODE == "snapshot":
+            event_broker.progress("fetch", 0, len(symbols), force=True)
+            df_all = fetch_data_snapshot(symbols, progress=progress)
+            fetched = df_all["symbol"].unique().tolist() if not df_all.empty else []
         else:
-            summary_df = summarize_data_4bars(df_all)
-            if summary_df.empty:
-                print("Summary is empty.")
-                return False
-            else:
-                summary_df.to_csv(CSV_PATH, index=False, encoding="utf-8")
-                print(f"Saved {len(summary_df)} rows to {CSV_PATH}")
-                return True
+            due, carried = plan_refresh(symbols)
+            event_broker.progress("fetch", 0, len(due), force=True)
+            # 届いた銘柄から順にサマリ行へ畳み込む (途中結果は /api/data?partial=1)
+            builds = new_summary_builds(len(due))
+            partial_summaries.clear()
+            partial_summaries.update(builds)
+            fetched = fetch_summaries_async(due, builds, progress=progress)
+        # 長いルックバックの初期値 (溜まっていない銘柄のみ)
+        seed_rolling(fetched)
+    tier_planner.mark_fetched(fetched)
+    refresh_symbols.set(len(fetched), state="fetched")
+    refresh_symbols.set(len(carried), state="carried")
+    print(f"Request stats: {request_scheduler.stats()}")
+    if not fetched:
+        print("No data fetched.")
+        save_bar_state()
+        return False
+
+    # 取得した基準足から全時間足のサマリを作成 (追加のAPI呼び出しなし)
+    event_broker.progress("summarize", force=True)
+    with refresh_stage_seconds.time(stage="summarize"):
+        if FETCH_MODE == "snapshot":
+            funding_rates = df_all.groupby("symbol")["fundingRate"].last().to_dict()
+            frames = build_summaries(fetched, funding_rates)
+        else:
+            frames = {tf: with_rolling(tf, acc.frame()) for tf, acc in builds.items()}
+            if carried:
+                frames = carry_summaries(frames, carried)
+        for summary_df in frames.values():
+            tier_planner.note_flags(summary_df)
+
+    # CSV / キャッシュ / 履歴 / バーストアの保存
+    event_broker.progress("persist", force=True)
+    with refresh_stage_seconds.time(stage="persist"):
+        saved = publish_summaries(frames)
+        save_bar_state()
+        if HISTORY_ENABLED:
+            archive_closed_bars()
+    return saved > 0
+
+def plan_refresh(symbols):
+    """
+    ティア別更新が有効なら (今回取得する銘柄, 前回の値を使う銘柄) に分ける。
+    売買代金のランキング用に tickers を1回取得し、Funding のキャッシュも更新する
+    """
+    if not tier_planner.enabled:
+        return symbols, []
+    tickers = fetch_tickers()
+    tier_planner.update_turnover(tickers)
+    funding_cache.update_from_tickers(tickers)
+    due, carried = tier_planner.plan(symbols)
+    tiers = ", ".join(f"every {k}: {v}" for k, v in sorted(tier_planner.tier_counts(symbols).items()))
+    print(f"Tiered refresh: fetching {len(due)}, carrying {len(carried)} ({tiers})")
+    return due, carried
+
+def carry_summaries(frames, carried):
+    """今回取得しなかった銘柄は前回のサマリ行をそのまま使う"""
+    keep = set(carried)
+    merged = {}
+    for tf, summary_df in frames.items():
+        previous = summary_cache.get(tf)
+        if previous is None or previous.frame.empty:
+            merged[tf] = summary_df
+            continue
+        old = previous.frame[previous.frame["symbol"].isin(keep)]
+        merged[tf] = (
+            pd.concat([summary_df, old], ignore_index=True)
+            .sort_values("symbol", kind="mergesort")
+            .reset_index(drop=True)
+        )
+    return merged
+
+def with_fetched_at(summary_df):
+    """各行に最後に取得した時刻 (fetched_at) を付ける。ティア別更新で前回の値を使った行の鮮度"""
+    fetched = pd.Series(summary_df["symbol"].map(tier_planner.fetched_at), dtype="float64")
+    stamps = pd.to_datetime(fetched, unit="s", utc=True).dt.tz_convert("Asia/Tokyo")
+    df = summary_df.copy()
+    df["fetched_at"] = stamps.dt.strftime('%Y-%m-%d %H:%M:%S').fillna("").values
+    return df
+
+def build_summaries(symbols, funding_rates, now_ms=None):
+    """バーストアから全時間足のサマリをまとめて作成 (時間足 → DataFrame)"""
+    now_ms = now_ms or int(time.time() * 1000)
+    feed_rolling_all(symbols, now_ms)
+    return {
+        tf: with_rolling(tf, summarize_data_4bars(timeframe_frame(symbols, tf, funding_rates, now_ms)))
+        for tf in ENABLED_TIMEFRAMES
+    }
+
+def publish_summaries(frames, history=True, verbose=True):
+    """時間足毎のサマリを CSV / キャッシュ / SSE / 履歴へ反映。反映した時間足の数を返す"""
+    snapshot_ms = int(time.time() * 1000)
+    saved = 0
+    for tf, summary_df in frames.items():
+        if summary_df.empty:
+            print(f"Summary is empty ({tf}).")
+            continue
+        summary_df = with_fetched_at(summary_df)
+        # 一時ファイル → rename で差し替え (読み手が書きかけのファイルを読むことはない)
+        path = summary_csv_path(tf)
+        try:
+            write_frame(summary_df, path)
+            if path != summary_snapshot_path(tf):
+                write_frame(summary_df, summary_snapshot_path(tf))
+        except OSError as e:
+            print(f"Error writing summary snapshot ({tf}): {e}")
+            continue
+        previous = summary_cache.get(tf)
+        entry = summary_cache.publish(tf, summary_df, summary_snapshot_path(tf))
+        try:
+            shared_writer.publish(tf, entry.body, entry.etag, entry.rows, snapshot_ms, entry.gzipped())
+        except OSError as e:
+            print(f"Error writing shared summary ({tf}): {e}")
+        # 購読中のダッシュボードへは変わった行だけを送る
+        try:
+            event_broker.publish("delta", delta_payload(
+                tf, entry.etag, previous.frame if previous is not None else None, summary_df))
+        except Exception as e:
+            print(f"Error publishing delta ({tf}): {e}")
+        if verbose:
+            print(f"Saved {len(summary_df)} rows to {path}")
+        saved += 1
+        evaluate_alerts(tf, summary_df, snapshot_ms)
+        if history and HISTORY_ENABLED:
+            try:
+                history_store.append_summary(summary_df.drop(columns="fetched_at"), tf, snapshot_ms)
+            except Exception as e:
+                print(f"Error appending summary history ({tf}): {e}")
+    return saved
+
+_alert_rules_mtime = None
+
+def reload_alert_rules():
+    """ルールファイルが変わっていれば読み直す (読めなければ前のルールのまま)"""
+    global _alert_rules_mtime
+    try:
+        mtime = os.stat(ALERT_RULES_PATH).st_mtime_ns
+    except OSError:
+        mtime = None
+    if mtime == _alert_rules_mtime:
+        return
+    try:
+        rules = load_rules(ALERT_RULES_PATH) if mtime is not None else []
+    except (OSError, ValueError) as e:
+        print(f"Error loading alert rules {ALERT_RULES_PATH}: {e}")
+        return
+    _alert_rules_mtime = mtime
+    alert_engine.set_rules(rules)
+    if mtime is not None:
+        print(f"Loaded {len(rules)} alert rules from {ALERT_RULES_PATH}")
+
+def evaluate_alerts(tf, summary_df, snapshot_ms):
+    try:
+        reload_alert_rules()
+        events = alert_engine.evaluate(tf, summary_df, snapshot_ms)
+    except Exception as e:
+        print(f"Error evaluating alerts ({tf}): {e}")
+        return
+    if events:
+        alert_notifier.notify(events)
+        event_broker.publish("alert", {"tf": tf, "events": events})
+
+def archive_closed_bars():
+    base_tf = f"{KLINE_INTERVAL}m"
+    try:
+        # watermark は銘柄毎 (ティア別更新で後から届いた銘柄 / 取得に失敗した銘柄の足も漏らさない)
+        closed_before = current_bar_start_ms()
+        bars = bar_store.bars_after(history_store.watermarks(base_tf), closed_before)
+        written = history_store.append_bars(bars, base_tf, closed_before)
+        if written:
+            print(f"Archived {written} closed bars to {HISTORY_DIR}")
+    except Exception as e:
+        print(f"Error archiving bars: {e}")
+    try:
+        # 日付が変わったら前日までの更新毎のファイルを1つにまとめる
+        compacted = history_store.compact_if_due()
+        if compacted:
+            print(f"Compacted {compacted} history partitions")
+    except Exception as e:
+        print(f"Error compacting history: {e}")
+
+# 同時に何度呼ばれても実行中の更新は1つだけ
+refresh_scheduler = RefreshScheduler(
+    update_data, REFRESH_FRESHNESS_SEC, REFRESH_CADENCE_MIN * 60, REFRESH_OFFSET_SEC
+)
 
 # --------------------------------------------------------------------
-# 9. Flask ルート定義
+# 8b. WebSocket 取り込み (FETCH_MODE=stream)
+#     kline で基準足、tickers で OI / Funding を更新し、数秒毎にサマリを作り直す
 # --------------------------------------------------------------------
-@app.route("/")
-def index():
-    # データ更新をバックグラウンドで実行
-    threading.Thread(target=update_data).start()
-    return render_template("index.html")
-
-@app.route("/api/data")
-def get_data():
-    tf = request.args.get('tf', '15m')
-    if tf != '15m':
-        return jsonify({"error": "Unsupported timeframe"}), 400
+def apply_ws_klines(symbol, bars):
+    rows = [[b["start"], b["open"], b["high"], b["low"], b["close"], b["volume"]] for b in bars]
+    bar_store.upsert_klines(symbol, rows)
+    tier_planner.mark_fetched([symbol])
+    # 新しく始まった足の OI は直近の tickers の値で埋める
+    oi = pd.to_numeric(stream_ingestor.tickers.get(symbol, {}).get("openInterest"), errors="coerce")
+    bar_store.update_latest(symbol, None, oi)
 
-    if not os.path.exists(CSV_PATH):
-        return jsonify({"error": "Data not found"}), 404
+def apply_ws_ticker(symbol, ticker):
+    oi = pd.to_numeric(ticker.get("openInterest"), errors="coerce")
+    bar_store.update_latest(symbol, None, oi)
+    funding_cache.update_from_tickers([ticker])
 
+def resync_stream(symbols):
+    # 切断中に確定した足を REST で埋める (追いついている銘柄は tickers のみ)
     try:
-        df = pd.read_csv(CSV_PATH)
-        data = df.to_dict(orient='records')
-        return jsonify(data)
+        fetch_data_snapshot(symbols, roll_bars=False)
+        seed_rolling(symbols)
     except Exception as e:
-        print(f"Error reading CSV: {e}")
-        return jsonify({"error": "Failed to read data"}), 500
+        print(f"Error resyncing stream: {e}")
 
-@app.route("/api/fetch", methods=['POST'])
-def fetch_data_endpoint():
-    success = update_data()
-    if success:
-        return jsonify({"message": "Data updated successfully"}), 200
-    else:
-        return jsonify({"error": "Data update failed"}), 500
+def publish_stream_summaries(closed):
+    # REST の更新中はそちらに任せる
+    if not data_update_lock.acquire(blocking=False):
+        return
+    try:
+        funding_rates = funding_cache.latest(stream_ingestor.symbols)
+        frames = build_summaries(list(funding_rates), funding_rates)
+        publish_summaries(frames, history=closed, verbose=False)
+        if closed:
+            save_bar_state()
+            if HISTORY_ENABLED:
+                archive_closed_bars()
+    finally:
+        data_update_lock.release()
+
+stream_ingestor = WebSocketIngestor(
+    apply_ws_klines, apply_ws_ticker, resync_stream, publish_stream_summaries, KLINE_INTERVAL
+)
 
 # --------------------------------------------------------------------
-# 10. アプリケーションの実行
+# 8c. 集計プロセスとの分担 (RUN_ROLE=collector / web)
+#     collector.py が取得・集計して共有サマリを書き、Web ワーカーはそれを読むだけ。
+#     更新要求と状態は小さな JSON ファイルでやり取りする
 # --------------------------------------------------------------------
-if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+def refresh_status():
+    status = refresh_scheduler.status()
+    if FETCH_MODE == "stream":
+        status["stream"] = dict(stream_ingestor.stats, symbols=len(stream_ingestor.symbols))
+    return status
+
+def request_refresh(trigger, force=False):
+    """
+    (job, started) を返す (refresh_scheduler.request と同じ)。
+    Web ワーカーは集計プロセスへ要求を書くだけなので job は None
+    """
+    if RUN_ROLE == "web":
+        try:
+            write_json_atomic(COLLECTOR_REQUEST_PATH, {"trigger": trigger, "requested_at": time.time()})
+        except OSError as e:
+            print(f"Error requesting refresh: {e}")
+        return None, False
+    return refresh_scheduler.request(trigger=trigger, force=force)
+
+def alert_status():
+    # Web ワーカーは集計プロセスが保存した状態を読む
+    if RUN_ROLE == "web":
+        return read_json(ALERT_STATE_PATH, {"rules": [], "matches": {}, "recent": []})
+    reload_alert_rules()
+    return dict(alert_engine.status(), notifier=alert_notifier.stats)
+
+def current_summary(tf):
+    if RUN_ROLE == "web":
+        return summary_cache.get_shared(tf, shared_reader.get(tf))
+    return summary_cache.get(tf, summary_snapshot_path(tf))
+
+def watch_summaries():
+    # 共有サマリ (web) / スナップショット (standalone) が他のプロセスで更新されたら
+    # このプロセスのキャッシュを差し替え、SSE 購読者へ差分を送る
+    while True:
+        for tf in ENABLED_TIMEFRAMES:
+            previous = summary_cache.get(tf)
+            entry = current_summary(tf)
+            if entry is None or entry is previous:
+                continue
+            try:
+                event_broker.publish("delta", delta_payload(
+                    tf, entry.etag, previous.frame if previous is not None else None, entry.frame))
+            except Exception as e:
+                print(f"Error publishing shared delta ({tf}): {e}")
+        time.sleep(SHARED_POLL_SEC)
+
+_summary_watcher = None
+_summary_watcher_lock = threading.Lock()
+
+def start_summary_watcher():
+    global _summary_watcher
+    if _summary_watcher is not None:
+        return
+    with _summary_watcher_lock:
+        if _summary_watcher is not None:
+            return
+        _summary_watcher = threading.Thread(target=watch_summaries, daemon=True)
+    _summary_watcher.start()
@@ -1,327 +1,174 @@
 import os
-import threading
-import time
-from flask import Flask, render_template, jsonify, request
 import pandas as pd
-import requests
-from datetime import datetime, timedelta, timezone
-from pytz import timezone as pytz_timezone
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from flask import Flask, Response, render_template, jsonify, request, stream_with_context
+from summary_cache import etag_matches, serialize_records
+from summary_query import QueryError, has_query, parse_query_args, query_etag
+from history_store import KINDS as HISTORY_KINDS, MAX_QUERY_ROWS as HISTORY_MAX_ROWS
+from live_events import RETRY_AFTER_SEC as SSE_RETRY_AFTER_SEC
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from shared_summary import read_json
+from wire_format import MEDIA_TYPES, FormatError, choose_encoding, choose_format, compress, encode_frame, \
+    should_compress, variant_etag
+
+# 取得・集計は fetch_data (main.py の FastAPI 版と共通)。ここは Flask のルートだけ
+from fetch_data import (
+    COLLECTOR_STATUS_PATH, DEFAULT_TIMEFRAME, ENABLED_TIMEFRAMES, FETCH_MODE, KLINE_INTERVAL, ROLLING_COLUMNS,
+    RUN_ROLE,
+    alert_status, current_summary, event_broker, fetch_all_symbols, history_store, load_bar_state, metrics_registry,
+    partial_summaries, refresh_scheduler, refresh_status, request_refresh, start_summary_watcher, stream_ingestor,
+    summary_snapshot_path,
+)
 
 app = Flask(__name__)
 
-# Bybit API endpoints
-BASE_URL_KLINE = "https://api.bybit.com/v5/market/kline"
-BASE_URL_OI = "https://api.bybit.com/v5/market/open-interest"
-BASE_URL_SYMBOLS = "https://api.bybit.com/v5/market/instruments-info"
-BASE_URL_FUNDING_HISTORY = "https://api.bybit.com/v5/market/funding/history"
-
-HEADERS = {
-    "User-Agent": "my-simple-script/1.0"
-}
-
-# 15分足固定 & 4本取得
-KLINE_INTERVAL = "15"       # Bybitの "15" → 15分足
-OI_INTERVAL = "15min"
-LIMIT_KLINE = 4             # Klineは4本
-LIMIT_OI = 20               # OIはstart/endを絞って最大20などにしておく
-
-# 過去60分にすれば理論上4本の15分足を取得
-MINUTES_FOR_15M = 60
-
-# データ保存ディレクトリ
-DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
-os.makedirs(DATA_DIR, exist_ok=True)
-CSV_PATH = os.path.join(DATA_DIR, "latest_summary_15m.csv")
-
-# ロックを使用してデータ更新の競合を防ぐ
-data_update_lock = threading.Lock()
-
-# --------------------------------------------------------------------
-# 1. シンボル一覧 (USDT建て・先物)
-# --------------------------------------------------------------------
-def fetch_all_symbols(category="linear"):
-    try:
-        params = {"category": category}
-        resp = requests.get(BASE_URL_SYMBOLS, params=params, headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        print("HTTPステータスコード:", resp.status_code)
-
-        symbols = [
-            item["symbol"] for item in data.get("result", {}).get("list", [])
-            if item.get("symbol", "").endswith("USDT")
-        ]
-        return symbols
-    except Exception as e:
-        print(f"Error fetching symbols: {e}")
-        return []
-
 # --------------------------------------------------------------------
-# 2. Kline (15分足 × 4本)
+# Flask ルート定義
 # --------------------------------------------------------------------
-def get_kline_data(symbol, start_time, end_time):
-    try:
-        params = {
-            "category": "linear",
-            "symbol": symbol,
-            "interval": KLINE_INTERVAL,  # "15"
-            "start": int(start_time.timestamp() * 1000),
-            "end": int(end_time.timestamp() * 1000),
-            "limit": LIMIT_KLINE        # 4
-        }
-        resp = requests.get(BASE_URL_KLINE, params=params, headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        return data.get("result", {}).get("list", [])
-    except Exception as e:
-        print(f"Error fetching Kline data for {symbol}: {e}")
-        return []
-
-# --------------------------------------------------------------------
-# 3. Open Interest (15分足相当)
-# --------------------------------------------------------------------
-def get_open_interest_history(symbol, start_time, end_time):
-    try:
-        params = {
-            "category": "linear",
-            "symbol": symbol,
-            "intervalTime": OI_INTERVAL,  # "15min"
-            "start": int(start_time.timestamp() * 1000),
-            "end": int(end_time.timestamp() * 1000),
-            "limit": LIMIT_OI            # up to 20
-        }
-        resp = requests.get(BASE_URL_OI, params=params, headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        rows = data.get("result", {}).get("list", [])
-        if not rows:
-            return None
-
-        df = pd.DataFrame(rows)
-        # timestamp ms → s
-        df["timestamp"] = pd.to_numeric(df["timestamp"], errors="coerce") // 1000
-        df["timestamp"] = pd.to_datetime(df["timestamp"], unit='s', utc=True).dt.tz_convert("Asia/Tokyo")
-        df["openInterest"] = pd.to_numeric(df["openInterest"], errors='coerce')
-        return df
-    except Exception as e:
-        print(f"Error fetching OI for {symbol}: {e}")
-        return None
-
-# --------------------------------------------------------------------
-# 4. Funding Rate (最新1本)
-# --------------------------------------------------------------------
-def get_funding_rate(symbol):
-    try:
-        end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(hours=48)  # 2日分
-        params = {
-            "category": "linear",
-            "symbol": symbol,
-            "intervalTime": "8h",
-            "start": int(start_time.timestamp() * 1000),
-            "end": int(end_time.timestamp() * 1000),
-            "limit": 200
-        }
-        resp = requests.get(BASE_URL_FUNDING_HISTORY, params=params, headers=HEADERS)
-        resp.raise_for_status()
-        data = resp.json()
-        flist = data.get("result", {}).get("list", [])
-        if not flist:
-            return 0.0
-        return float(flist[-1].get("fundingRate", "0.0"))
-    except Exception as e:
-        print(f"Error fetching funding rate for {symbol}: {e}")
-        return 0.0
-
-# --------------------------------------------------------------------
-# 5. 1銘柄の取得
-# --------------------------------------------------------------------
-def fetch_data_for_symbol(symbol):
-    try:
-        # 15分足4本 → 過去60分で十分(余裕をみて75分でもOK)
-        end_time = datetime.now(timezone.utc)
-        start_time = end_time - timedelta(minutes=MINUTES_FOR_15M)
-
-        # Kline
-        kline_data = get_kline_data(symbol, start_time, end_time)
-        if not kline_data:
-            return None
-
-        # OI
-        oi_data = get_open_interest_history(symbol, start_time, end_time)
-        # Funding
-        funding_rate = get_funding_rate(symbol)
-
-        # Kline DF
-        kline_df = pd.DataFrame([
-            {
-                "symbol": symbol,
-                "timestamp": datetime.fromtimestamp(int(e[0]) / 1000, tz=timezone.utc).astimezone(pytz_timezone("Asia/Tokyo")),
-                "open": float(e[1]),
-                "high": float(e[2]),
-                "low":  float(e[3]),
-                "close": float(e[4]),
-                "volume": float(e[5]),
-                "fundingRate": funding_rate
-            }
-            for e in kline_data
-        ])
-
-        if oi_data is not None and not oi_data.empty:
-            merged = pd.merge(kline_df, oi_data, on="timestamp", how="left").fillna(0)
-            return merged
-        return kline_df
-    except Exception as e:
-        print(f"Error fetch_data_for_symbol: {symbol}, {e}")
-        return None
-
-# --------------------------------------------------------------------
-# 6. 並列取得
-# --------------------------------------------------------------------
-def fetch_data_parallel(symbols):
-    all_data = []
-    with ThreadPoolExecutor(max_workers=10) as exe:
-        future_map = {exe.submit(fetch_data_for_symbol, s): s for s in symbols}
-        for f in as_completed(future_map):
-            try:
-                df = f.result()
-                if df is not None and not df.empty:
-                    all_data.append(df)
-            except Exception as e:
-                print(f"Error in symbol={future_map[f]}: {e}")
-    if all_data:
-        return pd.concat(all_data, ignore_index=True)
-    return pd.DataFrame()
-
-# --------------------------------------------------------------------
-# 7. サマリ (4本) + 出来高スパイク
-# --------------------------------------------------------------------
-def summarize_data_4bars(data):
-    """
-    4本分の変化率を計算:
-      - price_change_rate
-      - volume_change_rate
-      - oi_change_rate
-    出来高スパイク: 最新バーが直近4本平均の2倍以上
-    """
-    try:
-        summary = []
-        grouped = data.groupby("symbol")
-
-        for symbol, group in grouped:
-            group = group.sort_values("timestamp")
-            if len(group) < 4:
-                continue
-
-            latest = group.iloc[-1]
-
-            # 変化率計算: (最新 - 4本前) / 4本前 * 100
-            def calc_rate(df, col):
-                val_new = df[col].iloc[-1]
-                val_old = df[col].iloc[-4]
-                if val_old != 0:
-                    return (val_new - val_old) / val_old * 100
-                return 0.0
-
-            price_chg = calc_rate(group, "close")
-            vol_chg   = calc_rate(group, "volume")
-            oi_chg    = calc_rate(group, "openInterest")
-
-            # 出来高スパイク判定
-            vol_latest = group["volume"].iloc[-1]
-            vol_ma_4    = group["volume"].tail(4).mean()
-            volume_spike_flag = (vol_ma_4 > 0 and vol_latest >= 2.0 * vol_ma_4)
-
-            # Small Price Move Flag の追加（例: 価格変動が一定以下）
-            SMALL_PRICE_THRESHOLD = 0.5  # 価格変動率の閾値（適宜調整）
-            small_price_move_flag = abs(price_chg) <= SMALL_PRICE_THRESHOLD
-
-            summary.append({
-                "symbol":       symbol,
-                "timestamp":    latest["timestamp"].strftime('%Y-%m-%d %H:%M:%S'),
-                "open":         latest["open"],
-                "high":         latest["high"],
-                "low":          latest["low"],
-                "close":        latest["close"],
-                "volume":       latest["volume"],
-                "openInterest": latest.get("openInterest", 0),
-                "funding_rate": round(latest.get("fundingRate", 0), 6),
-
-                "price_change_rate":  round(price_chg, 3),
-                "volume_change_rate": round(vol_chg, 3),
-                "oi_change_rate":     round(oi_chg, 3),
-
-                "volume_spike_flag": small_price_move_flag,
-                "small_price_move_flag": small_price_move_flag
-            })
-        return pd.DataFrame(summary).fillna(0)
-    except Exception as e:
-        print(f"Error summarizing data(4bars): {e}")
-        return pd.DataFrame()
-
-# --------------------------------------------------------------------
-# 8. データ更新関数
-# --------------------------------------------------------------------
-def update_data():
-    with data_update_lock:
-        print(f"Data update started at {datetime.now()}")
-        symbols = fetch_all_symbols()
-        if not symbols:
-            print("No symbols retrieved.")
-            return False
-        print(f"Total symbols: {len(symbols)}")
-
-        df_all = fetch_data_parallel(symbols)
-        if df_all.empty:
-            print("No data fetched.")
-            return False
-        else:
-            summary_df = summarize_data_4bars(df_all)
-            if summary_df.empty:
-                print("Summary is empty.")
-                return False
-            else:
-                summary_df.to_csv(CSV_PATH, index=False, encoding="utf-8")
-                print(f"Saved {len(summary_df)} rows to {CSV_PATH}")
-                return True
+@app.before_request
+def start_background_refresh():
+    # 足の確定に合わせた定期更新 / WebSocket 取り込み (初回リクエスト時に1度だけ起動)
+    # サマリの監視は常に動かす (standalone でも更新を持たないワーカーは他のワーカーが書いた
+    # スナップショットを拾い、SSE へ差分を送る)。Web ワーカー (RUN_ROLE=web) は監視だけ
+    start_summary_watcher()
+    if RUN_ROLE == "web":
+        return
+    load_bar_state()
+    if FETCH_MODE == "stream":
+        stream_ingestor.start(fetch_all_symbols)
+    else:
+        refresh_scheduler.start_background()
 
-# --------------------------------------------------------------------
-# 9. Flask ルート定義
-# --------------------------------------------------------------------
 @app.route("/")
 def index():
-    # データ更新をバックグラウンドで実行
-    threading.Thread(target=update_data).start()
-    return render_template("index.html")
+    # 更新中なら合流、データが新しければスキップ (stream モードは常時更新なので不要)
+    if FETCH_MODE != "stream":
+        request_refresh("page")
+    return render_template("index.html", rolling_columns=list(ROLLING_COLUMNS.items()))
 
 @app.route("/api/data")
 def get_data():
-    tf = request.args.get('tf', '15m')
-    if tf != '15m':
+    tf = request.args.get('tf', DEFAULT_TIMEFRAME)
+    if tf not in ENABLED_TIMEFRAMES:
         return jsonify({"error": "Unsupported timeframe"}), 400
+    # レスポンス形式 (?format= / Accept) と圧縮 (Accept-Encoding)
+    try:
+        fmt = choose_format(request.args.get('format'), request.headers.get('Accept'))
+    except FormatError as e:
+        return jsonify({"error": str(e)}), 406
+    encoding = choose_encoding(request.headers.get('Accept-Encoding'))
+
+    # 更新中の途中結果 (届いた銘柄の分だけ)
+    build = partial_summaries.get(tf)
+    if request.args.get('partial') == '1' and build is not None:
+        headers = {"X-Partial": f"{len(build)}", "Cache-Control": "no-store"}
+        return app.response_class(serialize_records(build.frame()), mimetype="application/json", headers=headers)
+
+    path = summary_snapshot_path(tf)
+    entry = current_summary(tf)
+    if entry is None:
+        if RUN_ROLE == "web" or not os.path.exists(path):
+            return jsonify({"error": "Data not found"}), 404
+        return jsonify({"error": "Failed to read data"}), 500
 
-    if not os.path.exists(CSV_PATH):
-        return jsonify({"error": "Data not found"}), 404
+    if not has_query(request.args):
+        # 全件: シリアライズ済みの bytes (圧縮を受け付けるなら圧縮済みのもの) をそのまま返す
+        body, etag = entry.encoded(fmt, encoding)
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+        if etag_matches(request.headers.get("If-None-Match"), etag):
+            return "", 304, headers
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        # 共有サマリの本文は mmap 上の memoryview (gunicorn は bytes しか書けないのでここで1回だけコピー)
+        body = body if isinstance(body, bytes) else bytes(body)
+        return app.response_class(body, mimetype=MEDIA_TYPES[fmt], headers=headers)
+
+    # フィルタ / ソート / 列指定 / ページング
+    try:
+        query = parse_query_args(request.args)
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    etag = variant_etag(query_etag(entry.etag, request.query_string), fmt, encoding)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    if etag_matches(request.headers.get("If-None-Match"), etag):
+        return "", 304, headers
+    try:
+        meta, page = entry.index().query_frame(**query)
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    body = encode_frame(fmt, page, meta)
+    if should_compress(body, encoding):
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return app.response_class(body, mimetype=MEDIA_TYPES[fmt], headers=headers)
+
+def parse_time_ms(value):
+    # epoch ms / ISO 日時 (タイムゾーン無しは日本時間として扱う)
+    if value is None or value == "":
+        return None
+    if value.isdigit():
+        return int(value)
+    ts = pd.Timestamp(value)
+    if ts.tzinfo is None:
+        ts = ts.tz_localize("Asia/Tokyo")
+    return int(ts.timestamp() * 1000)
+
+@app.route("/api/history")
+def get_history():
+    kind = request.args.get('kind', 'summary')
+    tf = request.args.get('tf', DEFAULT_TIMEFRAME if kind == 'summary' else f"{KLINE_INTERVAL}m")
+    if kind not in HISTORY_KINDS:
+        return jsonify({"error": "Unsupported kind"}), 400
+    try:
+        start_ms = parse_time_ms(request.args.get('from'))
+        end_ms = parse_time_ms(request.args.get('to'))
+        limit = int(request.args.get('limit', 10000))
+    except ValueError:
+        return jsonify({"error": "Invalid from/to/limit"}), 400
+    if limit <= 0:
+        return jsonify({"error": "limit must be positive"}), 400
+    limit = min(limit, HISTORY_MAX_ROWS)
+    columns = [c for c in request.args.get('columns', '').split(',') if c]
 
     try:
-        df = pd.read_csv(CSV_PATH)
-        data = df.to_dict(orient='records')
-        return jsonify(data)
+        df = history_store.query(kind, tf, request.args.get('symbol'), start_ms, end_ms, columns or None, limit)
     except Exception as e:
-        print(f"Error reading CSV: {e}")
-        return jsonify({"error": "Failed to read data"}), 500
+        print(f"Error querying history: {e}")
+        return jsonify({"error": "Failed to read history"}), 500
+    return app.response_class(df.to_json(orient="records"), mimetype="application/json")
 
-@app.route("/api/fetch", methods=['POST'])
+@app.route("/api/fetch", methods=['GET', 'POST'])
 def fetch_data_endpoint():
-    success = update_data()
-    if success:
-        return jsonify({"message": "Data updated successfully"}), 200
+    # POST: 更新を要求 (実行中ならそのジョブに合流)。GET: 状態のみ
+    if request.method == 'POST':
+        request_refresh("manual")
+    if RUN_ROLE == "web":
+        status = read_json(COLLECTOR_STATUS_PATH) or {"state": "unknown", "job": None}
     else:
-        return jsonify({"error": "Data update failed"}), 500
-
-# --------------------------------------------------------------------
-# 10. アプリケーションの実行
+        status = refresh_status()
+    return jsonify(status), (202 if status["state"] == "running" else 200)
+
+@app.route("/api/alerts")
+def get_alerts():
+    # ルール名, 時間足 → ルール → 一致中の銘柄, 最近の enter / leave イベント
+    return jsonify(alert_status())
+
+@app.route("/metrics")
+def metrics():
+    # Prometheus テキスト形式
+    return Response(metrics_registry.render(), content_type=METRICS_CONTENT_TYPE)
+
+@app.route("/api/stream")
+def stream_events():
+    # Server-Sent Events: progress / delta / resync を配信
+    q = event_broker.subscribe()
+    if q is None:
+        # 同時接続数の上限 (SSE_MAX_CLIENTS)。スレッドを使い切らないよう断る
+        return jsonify({"error": "Too many stream clients"}), 503, {"Retry-After": str(SSE_RETRY_AFTER_SEC)}
+    headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    return Response(stream_with_context(event_broker.stream(q)), mimetype="text/event-stream", headers=headers)
+
+# --------------------------------------------------------------------
+# アプリケーションの実行
 # --------------------------------------------------------------------
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5000, debug=True)
@@ -0,0 +1,79 @@
+import threading
+import time
+
+# --------------------------------------------------------------------
+# Funding Rate キャッシュ
+#   Funding は 8時間毎 (銘柄によっては 4h / 1h) の精算時にしか変わらないため、
+#   次回精算時刻 (nextFundingTime) まではキャッシュした値を使い回す
+# --------------------------------------------------------------------
+
+FUNDING_INTERVAL_MS = 8 * 60 * 60 * 1000
+
+
+def next_settlement_ms(now_ms, interval_ms=FUNDING_INTERVAL_MS):
+    # 00:00 / 08:00 / 16:00 UTC 区切り
+    return (now_ms // interval_ms + 1) * interval_ms
+
+
+def now_ms():
+    return int(time.time() * 1000)
+
+
+class FundingRateCache:
+    def __init__(self):
+        self.rates = {}
+        self.expires_at = {}
+        self.lock = threading.Lock()
+
+    def get(self, symbol, now=None):
+        now = now_ms() if now is None else now
+        with self.lock:
+            if self.expires_at.get(symbol, 0) > now:
+                return self.rates[symbol]
+            return None
+
+    def missing(self, symbols, now=None):
+        now = now_ms() if now is None else now
+        with self.lock:
+            return [s for s in symbols if self.expires_at.get(s, 0) <= now]
+
+    def lookup(self, symbols, now=None):
+        now = now_ms() if now is None else now
+        with self.lock:
+            return {s: self.rates[s] for s in symbols if self.expires_at.get(s, 0) > now}
+
+    def last(self, symbol):
+        """期限切れでも最後に取得できた値 (個別取得に失敗したときの代わり)。無ければ None"""
+        with self.lock:
+            return self.rates.get(symbol)
+
+    def latest(self, symbols):
+        """lookup と同じだが期限切れの値も返す。一度も取得できていない銘柄は含まない"""
+        with self.lock:
+            return {s: self.rates[s] for s in symbols if s in self.rates}
+
+    def put(self, symbol, rate, next_funding_ms=None, now=None):
+        now = now_ms() if now is None else now
+        if not next_funding_ms or next_funding_ms <= now:
+            next_funding_ms = next_settlement_ms(now)
+        with self.lock:
+            self.rates[symbol] = rate
+            self.expires_at[symbol] = next_funding_ms
+
+    def update_from_tickers(self, tickers, now=None):
+        """
+        /v5/market/tickers?category=linear の list をまとめて取り込む。
+        取り込んだ銘柄数を返す
+        """
+        count = 0
+        for t in tickers:
+            rate = t.get("fundingRate")
+            if rate in (None, ""):
+                continue
+            try:
+                next_ms = int(t.get("nextFundingTime") or 0)
+                self.put(t["symbol"], float(rate), next_ms, now)
+                count += 1
+            except (KeyError, ValueError):
+                continue
+        return count
@@ -0,0 +1,258 @@
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs as pafs
+import pyarrow.parquet as pq
+
+# --------------------------------------------------------------------
+# サマリ / 基準足の履歴ストア (Parquet, 追記のみ)
+#   {root}/summary/tf=15m/date=2025-01-19/part-<ms>.parquet
+#   {root}/bars/tf=5m/date=2025-01-19/part-<ms>.parquet
+#   - ts 列 (epoch ms, UTC) で期間指定、date パーティションで枝刈り
+#   - symbol, ts 順に書くので行グループ統計で symbol / ts の絞り込みも効く
+#   - 読み込みは mmap
+#   - 足の書き込み済み位置 (watermark) は銘柄毎 (ティア別更新 / 取得失敗で遅れて届いた足も書く)
+#   - 列はファイル毎に増えることがある (ルックバック / 時間足の変更) ので、スキーマは読むファイルを合わせたもの
+#   - 読み込みは範囲内の date パーティションだけを古い順に読み、limit 行に達したら止める
+#   - 追記は更新毎に1ファイルなので、前日までの date は compact-<最後の part の ms>.parquet に
+#     まとめる (それ以前の part は読まない。消し終わる前に読まれても重複しない)
+# --------------------------------------------------------------------
+
+KINDS = ("summary", "bars")
+ROW_GROUP_SIZE = 64 * 1024
+MAX_QUERY_ROWS = 100000
+# 起動時に銘柄毎の watermark を求めるのに読む日数 (それより古い足しか無い銘柄は重複して書くことがあるが、
+# 読み込み時に同じ足は1つにする)
+WATERMARK_SCAN_DAYS = 7
+
+
+
+def utc_date(ms):
+    return datetime.fromtimestamp(ms / 1000, tz=timezone.utc).strftime("%Y-%m-%d")
+
+
+def _stamp(name):
+    # part-<ms>.parquet / compact-<ms>.parquet → ms
+    return int(name.split("-", 1)[1].split(".", 1)[0])
+
+
+class HistoryStore:
+    def __init__(self, root):
+        self.root = root
+        self.fs = pafs.LocalFileSystem(use_mmap=True)
+        # tf → {symbol: 書き込み済みの最新の足 (epoch ms)}
+        self.bars_watermark = {}
+        # ファイル → スキーマ (ファイルは書き換えないのでキャッシュできる)
+        self.file_schemas = {}
+        # 最後に前日までをまとめた日 (UTC)
+        self.compacted_date = None
+        self.lock = threading.Lock()
+
+    def _dir(self, kind, tf, date):
+        return os.path.join(self.root, kind, f"tf={tf}", f"date={date}")
+
+    def _write(self, kind, tf, df):
+        """ts の日付毎にファイルを分けて書き込む (一時ファイル → rename)"""
+        if df.empty:
+            return 0
+        df = df.sort_values(["symbol", "ts"], kind="mergesort")
+        dates = pd.to_datetime(df["ts"], unit="ms", utc=True).dt.strftime("%Y-%m-%d")
+        stamp = int(time.time() * 1000)
+        for date, part in df.groupby(dates.values, sort=True):
+            out_dir = self._dir(kind, tf, date)
+            os.makedirs(out_dir, exist_ok=True)
+            path = os.path.join(out_dir, f"part-{stamp}.parquet")
+            while os.path.exists(path):
+                # 同じ ms に2度書いた (まとめは ms の順に頼るので上書きせずずらす)
+                stamp += 1
+                path = os.path.join(out_dir, f"part-{stamp}.parquet")
+            # "." 始まりのファイルはデータセット走査の対象外 (書き込み途中を読ませない)
+            tmp = os.path.join(out_dir, f".part-{stamp}.parquet.tmp")
+            table = pa.Table.from_pandas(part, preserve_index=False)
+            pq.write_table(table, tmp, row_group_size=ROW_GROUP_SIZE, compression="zstd")
+            os.replace(tmp, path)
+        return len(df)
+
+    # ---------------- 書き込み ----------------
+    def append_summary(self, summary_df, tf, snapshot_ms):
+        df = summary_df.copy()
+        df.insert(1, "ts", pd.Series(snapshot_ms, index=df.index, dtype="int64"))
+        return self._write("summary", tf, df)
+
+    def append_bars(self, bars_df, tf, closed_before_ms):
+        """
+        確定済み (ts < closed_before_ms) で、まだ書いていない足だけを追記する
+        bars_df: symbol, ts, open, high, low, close, volume, openInterest
+        """
+        with self.lock:
+            marks = self._watermarks(tf)
+            last = bars_df["symbol"].map(marks).fillna(0).to_numpy()
+            new = bars_df[(bars_df["ts"].to_numpy() > last) & (bars_df["ts"] < closed_before_ms)]
+            written = self._write("bars", tf, new)
+            if written:
+                marks.update({s: int(t) for s, t in new.groupby("symbol")["ts"].max().items()})
+            return written
+
+    def watermarks(self, tf):
+        """銘柄毎の書き込み済みの最新の足 {symbol: epoch ms} (無い銘柄は未書き込み)"""
+        with self.lock:
+            return dict(self._watermarks(tf))
+
+    def _watermarks(self, tf):
+        if tf not in self.bars_watermark:
+            self.bars_watermark[tf] = self._max_ts_by_symbol("bars", tf)
+        return self.bars_watermark[tf]
+
+    def _max_ts_by_symbol(self, kind, tf):
+        # 直近 WATERMARK_SCAN_DAYS 日分のファイルの symbol, ts 列だけを読む
+        dates = self._dates(kind, tf)[-WATERMARK_SCAN_DAYS:]
+        paths = [p for date in dates for p in self._files(kind, tf, date)]
+        if not paths:
+            return {}
+        table = ds.dataset(paths, format="parquet", filesystem=self.fs).to_table(columns=["symbol", "ts"])
+        maxes = table.group_by("symbol").aggregate([("ts", "max")])
+        return dict(zip(maxes["symbol"].to_pylist(), maxes["ts_max"].to_pylist()))
+
+    # ---------------- ファイル一覧 ----------------
+    def _dates(self, kind, tf):
+        try:
+            names = os.listdir(os.path.join(self.root, kind, f"tf={tf}"))
+        except FileNotFoundError:
+            return []
+        return sorted(n[len("date="):] for n in names if n.startswith("date="))
+
+    def _files(self, kind, tf, date):
+        """読み込み対象のファイル: 最新の compact と、それより後に追記した part (古い順)"""
+        out_dir = self._dir(kind, tf, date)
+        try:
+            names = [n for n in os.listdir(out_dir) if n.endswith(".parquet") and not n.startswith(".")]
+        except FileNotFoundError:
+            return []
+        compacts = [n for n in names if n.startswith("compact-")]
+        covered = max((_stamp(n) for n in compacts), default=-1)
+        files = [f"compact-{covered}.parquet"] if compacts else []
+        files += sorted((n for n in names if n.startswith("part-") and _stamp(n) > covered), key=_stamp)
+        return [os.path.join(out_dir, n) for n in files]
+
+    def _schema(self, paths):
+        schemas = []
+        with self.lock:
+            for path in paths:
+                schema = self.file_schemas.get(path)
+                if schema is None:
+                    schema = self.file_schemas[path] = pq.read_schema(path)
+                schemas.append(schema)
+        return pa.unify_schemas(schemas, promote_options="permissive")
+
+    # ---------------- 読み込み ----------------
+    def query(self, kind, tf, symbol=None, start_ms=None, end_ms=None, columns=None, limit=MAX_QUERY_ROWS):
+        if kind not in KINDS:
+            return pd.DataFrame()
+        lo = utc_date(start_ms) if start_ms is not None else ""
+        hi = utc_date(end_ms) if end_ms is not None else "9999"
+        dates = [d for d in self._dates(kind, tf) if lo <= d <= hi]
+        if not dates:
+            return pd.DataFrame()
+
+        expr = None
+        for cond in ((ds.field("ts") >= start_ms) if start_ms is not None else None,
+                     (ds.field("ts") <= end_ms) if end_ms is not None else None,
+                     (ds.field("symbol") == symbol) if symbol else None):
+            if cond is not None:
+                expr = cond if expr is None else expr & cond
+        if columns:
+            columns = [c for c in ("symbol", "ts") if c not in columns] + list(columns)
+
+        # date は ts の日付なので日をまたいで ts の範囲は重ならない。古い日から読み、limit 行に達したら止める
+        tables, rows = [], 0
+        for date in dates:
+            table = self._read_date(kind, tf, date, columns, expr)
+            if table is None or table.num_rows == 0:
+                continue
+            tables.append(table)
+            rows += table.num_rows
+            if rows >= limit:
+                break
+        if not tables:
+            return pd.DataFrame(columns=columns or [])
+        # 日によって列が違うことがある (無い列は null)
+        table = pa.concat_tables(tables, promote_options="permissive")
+        table = table.take(pc.sort_indices(table, [("ts", "ascending"), ("symbol", "ascending")]))
+        df = table.slice(0, limit).to_pandas()
+        if kind == "bars":
+            # 遅れて届いた足を重ねて書いた場合は最後のものを残す
+            df = df.drop_duplicates(["symbol", "ts"], keep="last")
+        return df.reset_index(drop=True)
+
+    def _read_date(self, kind, tf, date, columns, expr):
+        for attempt in range(2):
+            paths = self._files(kind, tf, date)
+            if not paths:
+                return None
+            try:
+                schema = self._schema(paths)
+                names = [c for c in columns if c in schema.names] if columns else schema.names
+                dataset = ds.dataset(paths, schema=schema, format="parquet", filesystem=self.fs)
+                return dataset.to_table(columns=names, filter=expr)
+            except FileNotFoundError:
+                # 読んでいる間に他のプロセスがまとめた (元の part が消えた)。一覧から取り直す
+                if attempt:
+                    raise
+
+    # ---------------- まとめ (compaction) ----------------
+    def compact_if_due(self, now_ms=None):
+        """日付 (UTC) が変わって最初の呼び出しで前日までをまとめる。まとめたパーティション数"""
+        today = utc_date(now_ms or int(time.time() * 1000))
+        if self.compacted_date == today:
+            return 0
+        self.compacted_date = today
+        return self.compact(before_date=today)
+
+    def compact(self, before_date):
+        """before_date より前の date パーティションで、ファイルが複数あるものを1ファイルにまとめる"""
+        done = 0
+        for kind in KINDS:
+            try:
+                tfs = [n[len("tf="):] for n in os.listdir(os.path.join(self.root, kind)) if n.startswith("tf=")]
+            except FileNotFoundError:
+                continue
+            for tf in tfs:
+                for date in self._dates(kind, tf):
+                    if date < before_date and self._compact_date(kind, tf, date):
+                        done += 1
+        return done
+
+    def _compact_date(self, kind, tf, date):
+        with self.lock:
+            paths = self._files(kind, tf, date)
+            if len(paths) <= 1:
+                return False
+        schema = self._schema(paths)
+        table = ds.dataset(paths, schema=schema, format="parquet", filesystem=self.fs).to_table()
+        df = table.to_pandas()
+        if kind == "bars":
+            df = df.drop_duplicates(["symbol", "ts"], keep="last")
+        df = df.sort_values(["symbol", "ts"], kind="mergesort")
+        out_dir = self._dir(kind, tf, date)
+        stamp = max(_stamp(os.path.basename(p)) for p in paths)
+        path = os.path.join(out_dir, f"compact-{stamp}.parquet")
+        tmp = os.path.join(out_dir, f".compact-{stamp}.parquet.{os.getpid()}.tmp")
+        pq.write_table(pa.Table.from_pandas(df, schema=schema, preserve_index=False), tmp,
+                       row_group_size=ROW_GROUP_SIZE, compression="zstd")
+        os.replace(tmp, path)
+        # 読み込みは compact より前の part を見ないので、この後で消す
+        with self.lock:
+            for old in paths:
+                self.file_schemas.pop(old, None)
+                if old != path:
+                    try:
+                        os.remove(old)
+                    except FileNotFoundError:
+                        pass
+        return True
@@ -0,0 +1,126 @@
+import json
+import queue
+import threading
+import time
+
+# --------------------------------------------------------------------
+# Server-Sent Events によるライブ更新
+#   - progress: 更新ジョブの進捗 (stage / done / total)
+#   - delta:    更新完了時、値が変わった行 (upserts) と消えた銘柄 (removed) だけを送る
+#   - resync:   キューが溢れた購読者には全件の再取得を促す
+# 購読者1人につき (gthread の) ワーカースレッドを1つ占有し続けるので、max_subscribers で上限を設ける
+# --------------------------------------------------------------------
+
+SUBSCRIBER_QUEUE_SIZE = 256
+HEARTBEAT_SEC = 15
+PROGRESS_MIN_INTERVAL_SEC = 0.5
+# 上限で断った接続に返す Retry-After
+RETRY_AFTER_SEC = 30
+# 差分の判定に使わない列 (取り直す度に変わるメタデータ。値が変わった行には含めて送る)
+VOLATILE_COLUMNS = ("fetched_at",)
+
+
+class EventBroker:
+    def __init__(self, max_subscribers=None):
+        self.max_subscribers = max_subscribers
+        self.subscribers = set()
+        self.lock = threading.Lock()
+        self.event_id = 0
+        self._last_progress = 0.0
+
+    def subscribe(self):
+        """購読者のキューを返す。上限に達していれば None"""
+        q = queue.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        with self.lock:
+            if self.max_subscribers is not None and len(self.subscribers) >= self.max_subscribers:
+                return None
+            self.subscribers.add(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            self.subscribers.discard(q)
+
+    def publish(self, event, data):
+        with self.lock:
+            self.event_id += 1
+            message = format_sse(event, data, self.event_id)
+            subscribers = list(self.subscribers)
+        for q in subscribers:
+            try:
+                q.put_nowait(message)
+            except queue.Full:
+                # 読み切れていない購読者は差分を取りこぼしているので全件取り直させる
+                _drain(q)
+                q.put_nowait(format_sse("resync", {}, self.event_id))
+
+    def progress(self, stage, done=None, total=None, force=False):
+        """進捗は間引いて送る (stage の切り替わりと完了時は必ず送る)"""
+        now = time.monotonic()
+        if not force and done is not None and done != total and now - self._last_progress < PROGRESS_MIN_INTERVAL_SEC:
+            return
+        self._last_progress = now
+        self.publish("progress", {"stage": stage, "done": done, "total": total})
+
+    def stream(self, q, heartbeat_sec=HEARTBEAT_SEC):
+        """Flask の Response に渡すジェネレータ"""
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    yield q.get(timeout=heartbeat_sec)
+                except queue.Empty:
+                    yield ": ping\n\n"
+        finally:
+            self.unsubscribe(q)
+
+
+def format_sse(event, data, event_id=None):
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append("data: " + json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+    return "\n".join(lines) + "\n\n"
+
+
+def _drain(q):
+    try:
+        while True:
+            q.get_nowait()
+    except queue.Empty:
+        pass
+
+
+def diff_summaries(old, new, key="symbol", ignore=VOLATILE_COLUMNS):
+    """
+    旧サマリと新サマリを銘柄単位で比較し、
+    (値が変わった行 + 新規行のレコード, 消えた銘柄のリスト) を返す。ignore の列だけの変化は無視する
+    """
+    if new is None or new.empty:
+        return [], ([] if old is None or old.empty else old[key].tolist())
+    if old is None or old.empty:
+        return new.to_dict(orient="records"), []
+
+    o = old.drop_duplicates(key).set_index(key)
+    n = new.drop_duplicates(key).set_index(key)
+    cols = [c for c in n.columns if c in o.columns and c not in ignore]
+    common = n.index.intersection(o.index)
+    nv, ov = n.loc[common, cols], o.loc[common, cols]
+    same = ((nv == ov) | (nv.isna() & ov.isna())).all(axis=1)
+    changed = common[~same.values]
+    added = n.index.difference(o.index)
+    upserts = n.loc[changed.append(added)].reset_index()
+    removed = o.index.difference(n.index).tolist()
+    return upserts.to_dict(orient="records"), removed
+
+
+def delta_payload(tf, etag, old, new):
+    upserts, removed = diff_summaries(old, new)
+    return {
+        "tf": tf,
+        "etag": etag,
+        "rows": 0 if new is None else len(new),
+        "upserts": upserts,
+        "removed": removed,
+    }
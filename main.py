@@ -1,37 +1,145 @@
-from fastapi import FastAPI
+import asyncio
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request, Response
 from fastapi.responses import JSONResponse
-import pandas as pd
-import os
-from fetch_data import fetch_all_symbols, fetch_data_parallel, summarize_data_with_latest
 
-app = FastAPI()
+from summary_cache import etag_matches
+from summary_query import QueryError, has_query, parse_query_args, query_etag
+from metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from shared_summary import read_json
+from wire_format import MEDIA_TYPES, FormatError, choose_encoding, choose_format, compress, encode_frame, \
+    should_compress, variant_etag
+
+# 取得・集計は fetch_data (Flask の frontend.py と共通)。ここは FastAPI のルートだけ
+import fetch_data as engine
+
+# --------------------------------------------------------------------
+# FastAPI 版 (uvicorn main:app)
+#   - 更新はバックグラウンドのジョブ (POST /refresh → 202, GET /jobs/{id})
+#   - 読み出しはメモリ上のサマリ (SummaryCache) だけを使い、イベントループでファイルを読まない。
+#     他プロセスが書いたスナップショット / 共有サマリは監視スレッドがキャッシュへ取り込む
+# --------------------------------------------------------------------
+
+
+@asynccontextmanager
+async def lifespan(app):
+    # 起動時に既存のスナップショットを読み込んでおく (ファイル I/O はスレッドで)
+    await asyncio.gather(*(asyncio.to_thread(engine.current_summary, tf) for tf in engine.ENABLED_TIMEFRAMES))
+    if engine.RUN_ROLE != "web":
+        engine.load_bar_state()
+        if engine.FETCH_MODE == "stream":
+            engine.stream_ingestor.start(engine.fetch_all_symbols)
+        else:
+            engine.refresh_scheduler.start_background()
+    engine.start_summary_watcher()
+    yield
+    if engine.FETCH_MODE == "stream":
+        engine.stream_ingestor.stop()
+
+
+app = FastAPI(lifespan=lifespan)
+
+
+def job_response(job, started):
+    if job is None:
+        # Web ワーカー: 集計プロセスへ要求済み。状態は /status で確認
+        return JSONResponse({"state": "requested"}, status_code=202)
+    headers = {"Location": f"/jobs/{job.id}"}
+    status_code = 202 if job.running else 200
+    return JSONResponse(dict(job.to_dict(), started=started), status_code=status_code, headers=headers)
 
-DATA_FILE = "data/latest_summary.csv"
 
 @app.get("/")
-def home():
-    return {"message": "Welcome to the Crypto Data API"}
+async def home():
+    return {"message": "Welcome to the Crypto Data API", "timeframes": engine.ENABLED_TIMEFRAMES}
 
-@app.get("/fetch-data")
-def fetch_data():
+
+@app.post("/refresh")
+async def refresh(force: bool = False):
+    # 実行中なら実行中のジョブ、データが新しければ最後に成功したジョブを返す
+    job, started = engine.request_refresh("api", force=force)
+    return job_response(job, started)
+
+
+@app.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = engine.refresh_scheduler.get_job(job_id)
+    if job is None:
+        return JSONResponse({"error": "Job not found"}, status_code=404)
+    return job.to_dict()
+
+
+@app.get("/status")
+async def status():
+    if engine.RUN_ROLE == "web":
+        # 集計プロセスの状態ファイル (読み込みはスレッドで)
+        return await asyncio.to_thread(read_json, engine.COLLECTOR_STATUS_PATH, {"state": "unknown", "job": None})
+    return engine.refresh_status()
+
+
+@app.get("/alerts")
+async def alerts():
+    # Web ワーカーではファイルを読むのでスレッドで
+    return await asyncio.to_thread(engine.alert_status)
+
+
+@app.get("/data")
+async def get_data(request: Request, tf: str = engine.DEFAULT_TIMEFRAME):
+    if tf not in engine.ENABLED_TIMEFRAMES:
+        return JSONResponse({"error": "Unsupported timeframe"}, status_code=400)
+    entry = engine.summary_cache.get(tf)
+    if entry is None:
+        return JSONResponse({"error": "Data not found"}, status_code=404)
+    # レスポンス形式 (?format= / Accept) と圧縮 (Accept-Encoding)
+    try:
+        fmt = choose_format(request.query_params.get("format"), request.headers.get("accept"))
+    except FormatError as e:
+        return JSONResponse({"error": str(e)}, status_code=406)
+    encoding = choose_encoding(request.headers.get("accept-encoding"))
+
+    if not has_query(request.query_params):
+        body, etag = entry.encoded(fmt, encoding)
+        headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+        if etag_matches(request.headers.get("if-none-match"), etag):
+            return Response(status_code=304, headers=headers)
+        if encoding:
+            headers["Content-Encoding"] = encoding
+        return Response(content=bytes(body), media_type=MEDIA_TYPES[fmt], headers=headers)
+
+    # フィルタ / ソート / 列指定 / ページング
     try:
-        symbols = fetch_all_symbols()
-        if not symbols:
-            return {"error": "No symbols available"}
-        data = fetch_data_parallel(symbols, interval="15")
-        summary = summarize_data_with_latest(data)
-        os.makedirs("data", exist_ok=True)  # ディレクトリがなければ作成
-        summary.to_csv(DATA_FILE, index=False)
-        return {"message": "Data fetched and saved successfully"}
-    except Exception as e:
-        return {"error": str(e)}
+        query = parse_query_args(request.query_params)
+    except QueryError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    etag = variant_etag(query_etag(entry.etag, request.url.query), fmt, encoding)
+    headers = {"ETag": etag, "Cache-Control": "no-cache", "Vary": "Accept, Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    try:
+        meta, page = entry.index().query_frame(**query)
+    except QueryError as e:
+        return JSONResponse({"error": str(e)}, status_code=400)
+    body = encode_frame(fmt, page, meta)
+    if should_compress(body, encoding):
+        body = compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=MEDIA_TYPES[fmt], headers=headers)
+
+
+# 旧エンドポイント (互換のため残す)
+@app.get("/fetch-data")
+async def fetch_data():
+    job, started = engine.request_refresh("api")
+    return job_response(job, started)
+
 
 @app.get("/get-latest-summary")
-def get_latest_summary():
-    if os.path.exists(DATA_FILE):
-        try:
-            data = pd.read_csv(DATA_FILE)
-            return JSONResponse(content=data.to_dict(orient="records"))
-        except Exception as e:
-            return {"error": f"Failed to read CSV: {e}"}
-    return {"error": "CSV file not found"}
+async def get_latest_summary(request: Request):
+    return await get_data(request, engine.DEFAULT_TIMEFRAME)
+
+
+@app.get("/metrics")
+async def metrics():
+    # Prometheus テキスト形式 (fetch_data の更新処理・Bybit リクエストのメトリクス)
+    return Response(content=engine.metrics_registry.render(), media_type=METRICS_CONTENT_TYPE)
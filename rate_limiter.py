@@ -0,0 +1,284 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+import aiohttp
+import requests
+
+# --------------------------------------------------------------------
+# Bybit API 共通リクエストスケジューラ
+#   - エンドポイント毎のトークンバケット + IP全体のバケット
+#   - レスポンスヘッダ (X-Bapi-Limit*) による自動調整
+#   - 429 / retCode=10006 等はジッター付き指数バックオフで再試行
+# --------------------------------------------------------------------
+
+# Bybit の IP制限は 600回 / 5秒。少し余裕を持たせる
+IP_RATE_PER_SEC = 110
+# エンドポイント毎の初期レート (ヘッダで上書きされる)
+DEFAULT_ENDPOINT_RATE = 50
+MIN_ENDPOINT_RATE = 2
+
+MAX_RETRIES = 4
+BACKOFF_BASE_SEC = 0.5
+BACKOFF_CAP_SEC = 8.0
+REQUEST_TIMEOUT_SEC = 15
+
+# レート制限系 retCode (10006: Too many visits, 10018: IP制限超過)
+THROTTLE_RET_CODES = {10006, 10018}
+# 一時的なサーバ側エラー (10000: タイムアウト, 10016: サーバエラー)
+RETRYABLE_RET_CODES = {10000, 10016}
+
+
+class BybitAPIError(Exception):
+    pass
+
+
+class TokenBucket:
+    """
+    予約方式のトークンバケット。reserve() は待つべき秒数を返すので
+    スレッド (time.sleep) と asyncio (asyncio.sleep) の両方から使える。
+    スロットリングを受けたらレートを半減し、成功が続けば上限まで戻す (AIMD)。
+    """
+
+    def __init__(self, rate, capacity=None, min_rate=MIN_ENDPOINT_RATE):
+        self.max_rate = float(rate)
+        self.rate = float(rate)
+        self.min_rate = float(min_rate)
+        self.capacity = float(capacity or rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.tokens -= 1
+            wait = 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+            return max(wait, self.blocked_until - now)
+
+    def penalize(self, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+
+    def reward(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + self.max_rate * 0.05)
+
+    def apply_limit(self, limit, remaining, reset_ms):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            if limit:
+                self.max_rate = float(limit)
+                self.capacity = float(limit)
+                self.rate = min(self.rate, self.max_rate)
+                self.tokens = min(self.tokens, self.capacity)
+            if remaining is not None and remaining <= 0 and reset_ms:
+                until = now + max(0.0, reset_ms / 1000 - time.time())
+                self.blocked_until = max(self.blocked_until, until)
+
+
+class RequestScheduler:
+    def __init__(self, endpoint_rate=DEFAULT_ENDPOINT_RATE, ip_rate=IP_RATE_PER_SEC,
+                 max_retries=MAX_RETRIES, backoff_base=BACKOFF_BASE_SEC,
+                 backoff_cap=BACKOFF_CAP_SEC, timeout=REQUEST_TIMEOUT_SEC, registry=None):
+        self.endpoint_rate = endpoint_rate
+        self.ip_bucket = TokenBucket(ip_rate)
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+        self.timeout = timeout
+        self.buckets = {}
+        self._lock = threading.Lock()
+        self._stats = _empty_stats()
+        # registry (metrics.MetricsRegistry) があればエンドポイント別のメトリクスも記録
+        self._metrics = None
+        if registry is not None:
+            self._metrics = {
+                "latency": registry.histogram(
+                    "bybit_request_duration_seconds", "Bybit API request latency per attempt.", ("endpoint",)),
+                "requests": registry.counter(
+                    "bybit_requests_total", "Bybit API request attempts by outcome.", ("endpoint", "outcome")),
+                "retries": registry.counter(
+                    "bybit_request_retries_total", "Bybit API request retries.", ("endpoint",)),
+                "failures": registry.counter(
+                    "bybit_request_failures_total", "Bybit API requests given up after retries.", ("endpoint",)),
+                "bytes": registry.counter(
+                    "bybit_response_bytes_total", "Bybit API response body bytes.", ("endpoint",)),
+            }
+
+    # ---------------- バケット / 統計 ----------------
+    def bucket(self, endpoint):
+        with self._lock:
+            if endpoint not in self.buckets:
+                self.buckets[endpoint] = TokenBucket(self.endpoint_rate)
+            return self.buckets[endpoint]
+
+    def _count(self, key, n=1):
+        with self._lock:
+            self._stats[key] += n
+
+    def _observe(self, endpoint, seconds, outcome, nbytes=0):
+        if self._metrics is None:
+            return
+        self._metrics["latency"].observe(seconds, endpoint=endpoint)
+        self._metrics["requests"].inc(endpoint=endpoint, outcome=outcome)
+        if nbytes:
+            self._metrics["bytes"].inc(nbytes, endpoint=endpoint)
+
+    def _retry(self, endpoint):
+        self._count("retried")
+        if self._metrics is not None:
+            self._metrics["retries"].inc(endpoint=endpoint)
+
+    def reset_stats(self):
+        with self._lock:
+            self._stats = _empty_stats()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    # ---------------- 判定 ----------------
+    def _reserve(self, endpoint):
+        return max(self.bucket(endpoint).reserve(), self.ip_bucket.reserve())
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+        return max(delay, retry_after or 0.0)
+
+    def _handle_response(self, endpoint, status, headers, payload):
+        """
+        レスポンスを "ok" / "throttled" / "retry" / "fail" に分類し、
+        あわせて待機秒数 (Retry-After 等) を返す
+        """
+        bucket = self.bucket(endpoint)
+        bucket.apply_limit(
+            _int_header(headers, "X-Bapi-Limit"),
+            _int_header(headers, "X-Bapi-Limit-Status"),
+            _int_header(headers, "X-Bapi-Limit-Reset-Timestamp"),
+        )
+        retry_after = _int_header(headers, "Retry-After")
+        ret_code = payload.get("retCode", 0) if payload is not None else 0
+
+        if status in (403, 429) or ret_code in THROTTLE_RET_CODES:
+            self._count("throttled")
+            bucket.penalize(retry_after or 1.0)
+            return "throttled", retry_after
+        if status >= 500 or ret_code in RETRYABLE_RET_CODES:
+            return "retry", retry_after
+        if payload is None and status < 400:
+            # 途中で切れた本文やプロキシの HTML 等。空の成功として扱わず取り直す
+            return "retry", retry_after
+        if status >= 400 or ret_code != 0:
+            return "fail", None
+        bucket.reward()
+        return "ok", None
+
+    def _give_up(self, endpoint, url, reason, attempt):
+        self._count("failed")
+        if self._metrics is not None:
+            self._metrics["failures"].inc(endpoint=endpoint)
+        return BybitAPIError(f"{endpoint} request failed (retries={attempt}): {reason} ({url})")
+
+    # ---------------- 同期 (requests.Session) ----------------
+    def get_json(self, session, url, params, endpoint):
+        attempt = 0
+        while True:
+            wait = self._reserve(endpoint)
+            if wait > 0:
+                time.sleep(wait)
+            self._count("requests")
+            retry_after = None
+            t0 = time.perf_counter()
+            try:
+                resp = session.get(url, params=params, timeout=self.timeout)
+                body = resp.content
+                self._count("bytes", len(body))
+                payload = _safe_json(body)
+                outcome, retry_after = self._handle_response(endpoint, resp.status_code, resp.headers, payload)
+                reason = _reason(resp.status_code, payload)
+                self._observe(endpoint, time.perf_counter() - t0, outcome, len(body))
+            except requests.RequestException as e:
+                outcome, reason = "retry", str(e)
+                self._observe(endpoint, time.perf_counter() - t0, "error")
+
+            if outcome == "ok":
+                return payload
+            if outcome == "fail" or attempt >= self.max_retries:
+                raise self._give_up(endpoint, url, reason, attempt)
+            self._retry(endpoint)
+            time.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+    # ---------------- 非同期 (aiohttp.ClientSession) ----------------
+    async def get_json_async(self, session, url, params, endpoint):
+        attempt = 0
+        while True:
+            wait = self._reserve(endpoint)
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._count("requests")
+            retry_after = None
+            t0 = time.perf_counter()
+            try:
+                async with session.get(url, params=params) as resp:
+                    body = await resp.read()
+                    self._count("bytes", len(body))
+                    payload = _safe_json(body)
+                    outcome, retry_after = self._handle_response(endpoint, resp.status, resp.headers, payload)
+                    reason = _reason(resp.status, payload)
+                self._observe(endpoint, time.perf_counter() - t0, outcome, len(body))
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                outcome, reason = "retry", repr(e)
+                self._observe(endpoint, time.perf_counter() - t0, "error")
+
+            if outcome == "ok":
+                return payload
+            if outcome == "fail" or attempt >= self.max_retries:
+                raise self._give_up(endpoint, url, reason, attempt)
+            self._retry(endpoint)
+            await asyncio.sleep(self._backoff(attempt, retry_after))
+            attempt += 1
+
+
+def _empty_stats():
+    return {"requests": 0, "throttled": 0, "retried": 0, "failed": 0, "bytes": 0}
+
+
+def _int_header(headers, name):
+    value = headers.get(name) if headers is not None else None
+    if value is None:
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return None
+
+
+def _safe_json(body):
+    """JSON のオブジェクトなら dict、読めない / オブジェクトでなければ None"""
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return None
+    return data if isinstance(data, dict) else None
+
+
+def _reason(status, payload):
+    if payload is None:
+        return f"HTTP {status} (body is not a JSON object)"
+    return f"HTTP {status} retCode={payload.get('retCode')} {payload.get('retMsg', '')}"
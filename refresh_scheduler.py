@@ -0,0 +1,124 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+# --------------------------------------------------------------------
+# データ更新のシングルフライト・スケジューラ
+#   - 更新中に来たリクエストは実行中のジョブに合流する (新しく起動しない)
+#   - 最後の成功から freshness_sec 以内ならスキップ
+#   - 足の確定 (cadence_sec 区切り + offset) に合わせてバックグラウンド更新
+# --------------------------------------------------------------------
+
+MAX_JOB_HISTORY = 50
+
+
+class RefreshJob:
+    __slots__ = ("id", "trigger", "state", "started_at", "finished_at", "done")
+
+    def __init__(self, trigger):
+        self.id = uuid.uuid4().hex[:12]
+        self.trigger = trigger
+        self.state = "running"
+        self.started_at = time.time()
+        self.finished_at = None
+        self.done = threading.Event()
+
+    @property
+    def running(self):
+        return self.state == "running"
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "trigger": self.trigger,
+            "state": self.state,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "duration_sec": round((self.finished_at or time.time()) - self.started_at, 3),
+        }
+
+
+class RefreshScheduler:
+    def __init__(self, refresh_fn, freshness_sec=60, cadence_sec=900, cadence_offset_sec=5):
+        self.refresh_fn = refresh_fn
+        self.freshness_sec = freshness_sec
+        self.cadence_sec = cadence_sec
+        self.cadence_offset_sec = cadence_offset_sec
+        self.current = None
+        self.last_success = None
+        self.jobs = OrderedDict()
+        self._lock = threading.Lock()
+        self._background = None
+
+    def request(self, trigger="manual", force=False):
+        """
+        (job, started) を返す。実行中なら実行中のジョブ、
+        データが新しければ最後に成功したジョブを返し、新規には起動しない
+        """
+        with self._lock:
+            if self.current is not None and self.current.running:
+                return self.current, False
+            if not force and self.is_fresh():
+                return self.last_success, False
+            job = RefreshJob(trigger)
+            self.current = job
+            self.jobs[job.id] = job
+            while len(self.jobs) > MAX_JOB_HISTORY:
+                self.jobs.popitem(last=False)
+        threading.Thread(target=self._run, args=(job,), daemon=True).start()
+        return job, True
+
+    def is_fresh(self, now=None):
+        if self.last_success is None:
+            return False
+        now = now or time.time()
+        return now - self.last_success.finished_at < self.freshness_sec
+
+    def get_job(self, job_id):
+        return self.jobs.get(job_id)
+
+    def _run(self, job):
+        try:
+            ok = bool(self.refresh_fn())
+        except Exception as e:
+            print(f"Error in refresh job {job.id}: {e}")
+            ok = False
+        with self._lock:
+            job.state = "succeeded" if ok else "failed"
+            job.finished_at = time.time()
+            if ok:
+                self.last_success = job
+        job.done.set()
+
+    def status(self):
+        current = self.current
+        return {
+            "state": "running" if current is not None and current.running else "idle",
+            "job": current.to_dict() if current is not None else None,
+            "last_success": self.last_success.to_dict() if self.last_success is not None else None,
+            "fresh": self.is_fresh(),
+            "next_scheduled_at": self.next_slot() if self._background is not None else None,
+        }
+
+    # ---------------- 足の確定に合わせたバックグラウンド更新 ----------------
+    def next_slot(self, now=None):
+        now = now or time.time()
+        slot = (now - self.cadence_offset_sec) // self.cadence_sec * self.cadence_sec
+        return slot + self.cadence_sec + self.cadence_offset_sec
+
+    def start_background(self):
+        if self._background is not None:
+            return
+        with self._lock:
+            if self._background is not None:
+                return
+            self._background = threading.Thread(target=self._background_loop, daemon=True)
+        self._background.start()
+
+    def _background_loop(self):
+        while True:
+            time.sleep(max(0.0, self.next_slot() - time.time()))
+            # 足が確定した直後なので鮮度判定は無視 (実行中なら合流)
+            job, _ = self.request(trigger="schedule", force=True)
+            job.done.wait()
@@ -0,0 +1,125 @@
+import threading
+import time
+
+# --------------------------------------------------------------------
+# 銘柄の優先度別 (ティア) 更新
+#   - 直近でシグナル (出来高スパイク) が出た銘柄を最優先、残りは24h売買代金順に並べ、
+#     上位から順にティアへ割り当てる
+#   - ティア毎に「何回の更新サイクルに1回取得するか」を持ち、間隔が来た銘柄だけ取得する
+#   - 取得しなかった銘柄は前回のサマリ行をそのまま使い、fetched_at で鮮度を示す
+#
+# ティアの指定は "件数:間隔,..." (件数 0 は残り全部)
+#   例) "50:1,150:3,0:6" → 上位50は毎回、次の150は3回に1回、残りは6回に1回
+# --------------------------------------------------------------------
+
+# シグナルが出てから何サイクルの間、最上位ティアに置くか
+FLAG_HOLD_CYCLES = 4
+
+
+def parse_tiers(spec):
+    """"50:1,150:3,0:6" → [(50, 1), (150, 3), (0, 6)]。空文字なら [] (ティア更新なし)"""
+    tiers = []
+    for part in (spec or "").split(","):
+        part = part.strip()
+        if not part:
+            continue
+        size, _, every = part.partition(":")
+        tiers.append((max(int(size), 0), max(int(every or 1), 1)))
+    if tiers and tiers[-1][0] != 0:
+        # 割り当てから漏れた銘柄は最後のティアの間隔で更新
+        tiers.append((0, tiers[-1][1]))
+    return tiers
+
+
+def _float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class TierPlanner:
+    def __init__(self, tiers, cycle_sec):
+        self.tiers = tiers
+        self.cycle_sec = cycle_sec
+        self.turnover = {}
+        self.flagged_at = {}
+        self.fetched_at = {}
+        self.lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.tiers)
+
+    # ---------------- ランキングの材料 ----------------
+    def update_turnover(self, tickers):
+        with self.lock:
+            for t in tickers:
+                if t.get("symbol"):
+                    self.turnover[t["symbol"]] = _float(t.get("turnover24h"))
+
+    def note_flags(self, summary_df, now=None):
+        """サマリで出来高スパイクが立った銘柄を記録 (小さい値動きとの同時発生も含む)"""
+        if summary_df is None or summary_df.empty or "volume_spike_flag" not in summary_df.columns:
+            return
+        now = now or time.time()
+        flagged = summary_df.loc[summary_df["volume_spike_flag"].astype(bool), "symbol"]
+        with self.lock:
+            for symbol in flagged:
+                self.flagged_at[symbol] = now
+
+    def mark_fetched(self, symbols, now=None):
+        now = now or time.time()
+        with self.lock:
+            for symbol in symbols:
+                self.fetched_at[symbol] = now
+
+    # ---------------- 計画 ----------------
+    def rank(self, symbols, now=None):
+        now = now or time.time()
+        hold = FLAG_HOLD_CYCLES * self.cycle_sec
+        with self.lock:
+            def key(symbol):
+                hot = now - self.flagged_at.get(symbol, 0) <= hold
+                return (not hot, -self.turnover.get(symbol, 0.0), symbol)
+            return sorted(symbols, key=key)
+
+    def assign(self, symbols, now=None):
+        """{symbol: 更新間隔 (サイクル数)} をランキング順に割り当て"""
+        ranked = self.rank(symbols, now)
+        every = {}
+        i = 0
+        for size, cycles in self.tiers:
+            chunk = ranked[i:] if size == 0 else ranked[i:i + size]
+            for symbol in chunk:
+                every[symbol] = cycles
+            i += len(chunk)
+            if i >= len(ranked):
+                break
+        return every
+
+    def plan(self, symbols, now=None):
+        """
+        (今回取得する銘柄, 前回の値を使う銘柄) を返す。
+        取得したことが無い銘柄と、間隔 (半サイクル分の余裕を見る) が経過した銘柄を取得する
+        """
+        if not self.enabled:
+            return list(symbols), []
+        now = now or time.time()
+        every = self.assign(symbols, now)
+        due, carried = [], []
+        with self.lock:
+            for symbol in symbols:
+                last = self.fetched_at.get(symbol)
+                interval = every[symbol] * self.cycle_sec - self.cycle_sec / 2
+                if last is None or now - last >= interval:
+                    due.append(symbol)
+                else:
+                    carried.append(symbol)
+        return due, carried
+
+    def tier_counts(self, symbols, now=None):
+        counts = {}
+        for cycles in self.assign(symbols, now).values():
+            counts[cycles] = counts.get(cycles, 0) + 1
+        return counts
@@ -0,0 +1,218 @@
+import os
+import threading
+
+import numpy as np
+
+# --------------------------------------------------------------------
+# 銘柄毎のローリング統計 (時間足毎に1つ)
+#   - 確定足が1本届く度に、各ルックバック N の出来高 / OI の合計と二乗和、
+#     EWMA の平均と分散を O(1) で更新する (DataFrame から再計算しない)
+#   - 直近 max(N) 本の close / volume / OI をリングバッファに持ち、窓から外れる値を引く
+#   - 浮動小数の誤差が溜まらないよう、リングが1周する度にバッファから合計を計算し直す
+#   - 最新の足 (確定前) は含めず、その手前の N 本を基準に変化率・z スコアを出す
+#   - npz に保存してプロセス再起動後も引き継ぐ
+# --------------------------------------------------------------------
+
+# リングバッファの列
+FIELDS = ("close", "volume", "openInterest")
+# 合計・EWMA を持つ列 (volume, openInterest)
+STAT_COLS = slice(1, 3)
+N_STATS = 2
+
+
+def parse_lookbacks(spec):
+    """"4,20,96" → [4, 20, 96] (先頭がサマリの基本の本数)。不正な値は無視"""
+    lookbacks = []
+    for part in (spec or "").split(","):
+        try:
+            n = int(part)
+        except ValueError:
+            continue
+        if n > 0 and n not in lookbacks:
+            lookbacks.append(n)
+    return lookbacks or [4]
+
+
+class RollingStats:
+    def __init__(self, lookbacks, ewma_span=20, capacity=16):
+        self.lookbacks = np.array(lookbacks, dtype=np.int64)
+        self.size = int(self.lookbacks.max())
+        self.alpha = 2.0 / (ewma_span + 1)
+        self.index = {}
+        self.ring = np.full((capacity, self.size, len(FIELDS)), np.nan)
+        self.head = np.zeros(capacity, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.last_ts = np.zeros(capacity, dtype=np.int64)
+        self.sums = np.zeros((capacity, len(lookbacks), N_STATS))
+        self.sumsq = np.zeros((capacity, len(lookbacks), N_STATS))
+        self.ewm_mean = np.zeros((capacity, N_STATS))
+        self.ewm_var = np.zeros((capacity, N_STATS))
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.index)
+
+    def _grow(self):
+        n = len(self.head) * 2 or 16
+        for name in ("ring", "head", "count", "last_ts", "sums", "sumsq", "ewm_mean", "ewm_var"):
+            old = getattr(self, name)
+            fill = np.nan if name == "ring" else 0
+            new = np.full((n, *old.shape[1:]), fill, dtype=old.dtype)
+            new[:len(old)] = old
+            setattr(self, name, new)
+
+    def _row(self, symbol):
+        i = self.index.get(symbol)
+        if i is None:
+            i = len(self.index)
+            if i == len(self.head):
+                self._grow()
+            self.index[symbol] = i
+            self._reset(i)
+        return i
+
+    def _reset(self, i):
+        self.ring[i] = np.nan
+        self.head[i] = self.count[i] = self.last_ts[i] = 0
+        self.sums[i] = self.sumsq[i] = 0.0
+        self.ewm_mean[i] = self.ewm_var[i] = 0.0
+
+    def _recompute(self, i):
+        # リングの中身から合計を計算し直す (誤差のリセット)
+        for k, n in enumerate(self.lookbacks):
+            if self.count[i] < n:
+                continue
+            idx = (self.head[i] - 1 - np.arange(n)) % self.size
+            window = self.ring[i, idx, STAT_COLS]
+            self.sums[i, k] = window.sum(axis=0)
+            self.sumsq[i, k] = (window * window).sum(axis=0)
+
+    def _push(self, i, t, close, volume, oi):
+        x = np.array([volume, oi])
+        head, count = self.head[i], self.count[i]
+        # 各ルックバックの窓から外れる値 (N 本前) を引いて、新しい値を足す
+        full = count >= self.lookbacks
+        leaving = self.ring[i, (head - self.lookbacks) % self.size, STAT_COLS]
+        leaving = np.where(full[:, None], leaving, 0.0)
+        self.sums[i] += x - leaving
+        self.sumsq[i] += x * x - leaving * leaving
+        if count == 0:
+            self.ewm_mean[i] = x
+            self.ewm_var[i] = 0.0
+        else:
+            diff = x - self.ewm_mean[i]
+            incr = self.alpha * diff
+            self.ewm_mean[i] += incr
+            self.ewm_var[i] = (1 - self.alpha) * (self.ewm_var[i] + diff * incr)
+        self.ring[i, head] = (close, volume, oi)
+        self.head[i] = (head + 1) % self.size
+        self.count[i] = min(count + 1, self.size)
+        self.last_ts[i] = t
+        if self.head[i] == 0:
+            self._recompute(i)
+
+    def push_bars(self, symbol, ts, bars, bar_ms):
+        """
+        確定足 (ts 昇順, 列は open, high, low, close, volume, openInterest) のうち
+        前回より新しいものを取り込む。足が飛んでいたら (取りこぼし) 最初から溜め直す。
+        取り込んだ本数を返す
+        """
+        with self.lock:
+            i = self._row(symbol)
+            new = ts > self.last_ts[i]
+            if not new.any():
+                return 0
+            ts, bars = ts[new], bars[new]
+            if self.count[i] and ts[0] - self.last_ts[i] > bar_ms:
+                self._reset(i)
+            for t, row in zip(ts, bars):
+                self._push(i, int(t), row[3], np.nan_to_num(row[4]), np.nan_to_num(row[5]))
+            return len(ts)
+
+    def seed(self, symbol, ts, bars, bar_ms):
+        """確定足だけで溜め直す (起動直後 / 取りこぼしの後に時間足そのものの足で埋める)"""
+        with self.lock:
+            self._reset(self._row(symbol))
+        return self.push_bars(symbol, ts, bars, bar_ms)
+
+    def warm(self, symbol):
+        """最長のルックバック分が溜まっているか"""
+        with self.lock:
+            i = self.index.get(symbol)
+            return i is not None and self.count[i] >= self.size
+
+    def last_timestamp(self, symbol):
+        with self.lock:
+            i = self.index.get(symbol)
+            return int(self.last_ts[i]) if i is not None else 0
+
+    def features(self, symbols, close, volume, oi):
+        """
+        最新の足 (close / volume / OI の配列, symbols と同じ順) について、
+        直前の N 本を基準にした列を返す {列名: 配列}。本数が足りない銘柄は NaN
+          price_change_rate_N: N 本前の close からの変化率 [%]
+          volume_z_N / oi_z_N: 直前 N 本の平均・標準偏差に対する z スコア
+          volume_ewma_z:       EWMA の平均・分散に対する出来高の z スコア
+        """
+        latest = np.column_stack([volume, oi]).astype(float)
+        with self.lock:
+            idx = np.array([self.index.get(s, -1) for s in symbols], dtype=np.int64)
+            known = idx >= 0
+            rows = np.where(known, idx, 0)
+            count = np.where(known, self.count[rows], 0)
+            head = self.head[rows]
+            sums, sumsq = self.sums[rows], self.sumsq[rows]
+            ewm_mean, ewm_var = self.ewm_mean[rows], self.ewm_var[rows]
+            old_close = self.ring[rows[:, None], (head[:, None] - self.lookbacks) % self.size, 0]
+
+        out = {}
+        with np.errstate(divide="ignore", invalid="ignore"):
+            for k, n in enumerate(self.lookbacks):
+                ready = count >= n
+                mean = sums[:, k] / n
+                std = np.sqrt(np.maximum(sumsq[:, k] / n - mean * mean, 0.0))
+                z = np.where(std > 0, (latest - mean) / std, 0.0)
+                z[~ready] = np.nan
+                chg = np.where(old_close[:, k] != 0, (close - old_close[:, k]) / old_close[:, k] * 100, 0.0)
+                out[f"price_change_rate_{n}"] = np.where(ready, chg, np.nan)
+                out[f"volume_z_{n}"] = z[:, 0]
+                out[f"oi_z_{n}"] = z[:, 1]
+            std = np.sqrt(ewm_var[:, 0])
+            ewma_z = np.where(std > 0, (latest[:, 0] - ewm_mean[:, 0]) / std, 0.0)
+            out["volume_ewma_z"] = np.where(count > 0, ewma_z, np.nan)
+        return out
+
+    # ---------------- 永続化 ----------------
+    def save(self, path):
+        if not path:
+            return
+        with self.lock:
+            n = len(self.index)
+            symbols = np.array(sorted(self.index, key=self.index.get), dtype=str)
+            arrays = {name: getattr(self, name)[:n].copy()
+                      for name in ("ring", "head", "count", "last_ts", "sums", "sumsq", "ewm_mean", "ewm_var")}
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(f, symbols=symbols, lookbacks=self.lookbacks, alpha=np.array(self.alpha), **arrays)
+        os.replace(tmp, path)
+
+    def load(self, path):
+        if not path or not os.path.exists(path):
+            return 0
+        try:
+            with np.load(path, allow_pickle=False) as z:
+                data = {name: z[name] for name in z.files}
+        except Exception as e:
+            print(f"Error loading rolling stats {path}: {e}")
+            return 0
+        if not np.array_equal(data["lookbacks"], self.lookbacks) or float(data["alpha"]) != self.alpha:
+            print(f"Rolling lookbacks changed, ignoring {path}")
+            return 0
+        n = len(data["symbols"])
+        with self.lock:
+            self.index = {str(s): i for i, s in enumerate(data["symbols"])}
+            while len(self.head) < n:
+                self._grow()
+            for name in ("ring", "head", "count", "last_ts", "sums", "sumsq", "ewm_mean", "ewm_var"):
+                getattr(self, name)[:n] = data[name]
+        return n
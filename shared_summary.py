@@ -0,0 +1,164 @@
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# --------------------------------------------------------------------
+# プロセス間で共有するサマリ (集計プロセス → Web ワーカー)
+#   - 時間足毎に1ファイル: 固定長ヘッダ + シリアライズ済み JSON + その gzip
+#   - 書き手は一時ファイルに書いてから rename で差し替える (読み手が書きかけを見ることはない)
+#   - 読み手は mmap して本文をコピーせずに返す。ファイルが差し替わるまで同じ mmap を使い回し、
+#     差し替え後も古い mmap は (unlink 済みの inode として) 参照中のレスポンスが終わるまで有効
+#
+# ヘッダ (little endian, HEADER_SIZE バイト):
+#   magic 8s / format u32 / reserved u32 / version u64 / generated_ms u64 / rows u64 / body_len u64 / etag 48s
+#   / gzip_len u64 (0 なら gzip なし)
+#   version は時間足毎に publish の度に1ずつ増える
+# --------------------------------------------------------------------
+
+MAGIC = b"BYSUMSHM"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<8sIIQQQQ48sQ")
+HEADER_SIZE = 128
+
+
+class SharedSnapshot:
+    __slots__ = ("version", "generated_ms", "rows", "etag", "body", "gzip_body", "_mm")
+
+    def __init__(self, mm):
+        magic, fmt, _, version, generated_ms, rows, body_len, etag, gzip_len = HEADER.unpack_from(mm, 0)
+        if magic != MAGIC or fmt != FORMAT_VERSION:
+            raise ValueError("not a shared summary file")
+        if HEADER_SIZE + body_len + gzip_len > len(mm):
+            raise ValueError("truncated shared summary file")
+        self.version = version
+        self.generated_ms = generated_ms
+        self.rows = rows
+        self.etag = etag.rstrip(b"\0").decode("ascii")
+        self.body = memoryview(mm)[HEADER_SIZE:HEADER_SIZE + body_len]
+        end = HEADER_SIZE + body_len + gzip_len
+        self.gzip_body = memoryview(mm)[HEADER_SIZE + body_len:end] if gzip_len else None
+        self._mm = mm
+
+
+def read_header(path):
+    try:
+        with open(path, "rb") as f:
+            raw = f.read(HEADER.size)
+        magic, fmt, _, version = HEADER.unpack(raw)[:4]
+        if magic == MAGIC and fmt == FORMAT_VERSION:
+            return version
+    except (OSError, struct.error):
+        pass
+    return 0
+
+
+class SharedSummaryWriter:
+    def __init__(self, root):
+        self.root = root
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, key):
+        return os.path.join(self.root, f"summary_{key}.bin")
+
+    def publish(self, key, body, etag, rows, generated_ms=None, gzip_body=b""):
+        path = self.path(key)
+        generated_ms = generated_ms or int(time.time() * 1000)
+        with self.lock:
+            # 他のプロセスが書いた分も数えるため、毎回ファイルのヘッダから続ける
+            version = read_header(path) + 1
+            header = HEADER.pack(
+                MAGIC, FORMAT_VERSION, 0, version, generated_ms, rows, len(body), etag.encode("ascii")[:48],
+                len(gzip_body),
+            ).ljust(HEADER_SIZE, b"\0")
+            tmp = os.path.join(self.root, f".summary_{key}.{os.getpid()}.tmp")
+            with open(tmp, "wb") as f:
+                f.write(header)
+                f.write(body)
+                f.write(gzip_body)
+            os.replace(tmp, path)
+        return version
+
+
+class SharedSummaryReader:
+    def __init__(self, root):
+        self.root = root
+        self.snapshots = {}
+        self._stats = {}
+        self.lock = threading.Lock()
+
+    def path(self, key):
+        return os.path.join(self.root, f"summary_{key}.bin")
+
+    def get(self, key):
+        """最新の SharedSnapshot (無ければ None)。ファイルが変わっていなければ stat 1回だけ"""
+        path = self.path(key)
+        try:
+            st = os.stat(path)
+        except OSError:
+            return self.snapshots.get(key)
+        sig = (st.st_ino, st.st_mtime_ns, st.st_size)
+        if self._stats.get(key) == sig:
+            return self.snapshots.get(key)
+        with self.lock:
+            if self._stats.get(key) == sig:
+                return self.snapshots.get(key)
+            try:
+                with open(path, "rb") as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                snapshot = SharedSnapshot(mm)
+            except (OSError, ValueError, struct.error) as e:
+                print(f"Error mapping shared summary {path}: {e}")
+                return self.snapshots.get(key)
+            # 古い mmap は close しない (返したレスポンスが本文を参照している可能性がある)
+            self.snapshots[key] = snapshot
+            self._stats[key] = sig
+            return snapshot
+
+
+# --------------------------------------------------------------------
+# 集計プロセスとの小さなやり取り (状態 JSON / 更新要求) とホスト単位のロック
+# --------------------------------------------------------------------
+def write_json_atomic(path, obj):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(obj, f)
+    os.replace(tmp, path)
+
+
+def read_json(path, default=None):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+@contextmanager
+def host_lock(path):
+    """
+    同じホストの全プロセスで1つだけ取れるロック (flock)。待たずに取れたかどうかを返す
+        with host_lock(path) as acquired: ...
+    """
+    if fcntl is None:
+        yield True
+        return
+    with open(path, "a") as f:
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
@@ -0,0 +1,66 @@
+import gzip
+import io
+import os
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+
+# --------------------------------------------------------------------
+# サマリのスナップショットファイル
+#   - 一時ファイルに書いて fsync → rename → ディレクトリを fsync
+#     (読み手は常に古いか新しいかのどちらか完全なファイルを見る / 電源断でも壊れない)
+#   - 形式は拡張子で決める: .csv / .feather (Arrow IPC, zstd 圧縮)
+#   - JSON の gzip は mtime=0 で作る (同じ内容なら同じバイト列)
+# --------------------------------------------------------------------
+
+FEATHER_COMPRESSION = "zstd"
+GZIP_LEVEL = 6
+
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return  # Windows などディレクトリを開けない環境
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path, data):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    _fsync_dir(path)
+
+
+def frame_bytes(df, path):
+    """拡張子に合わせて DataFrame をシリアライズ"""
+    if path.endswith(".feather"):
+        sink = pa.BufferOutputStream()
+        feather.write_feather(df, sink, compression=FEATHER_COMPRESSION)
+        return sink.getvalue().to_pybytes()
+    buf = io.StringIO()
+    df.to_csv(buf, index=False)
+    return buf.getvalue().encode("utf-8")
+
+
+def write_frame(df, path):
+    atomic_write_bytes(path, frame_bytes(df, path))
+
+
+def read_frame(path):
+    if path.endswith(".feather"):
+        return feather.read_feather(path)
+    return pd.read_csv(path)
+
+
+def gzip_bytes(body):
+    return gzip.compress(bytes(body), compresslevel=GZIP_LEVEL, mtime=0)
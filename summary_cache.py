@@ -0,0 +1,162 @@
+import hashlib
+import json
+import os
+import threading
+import time
+
+import pandas as pd
+
+from snapshot_files import gzip_bytes, read_frame
+from summary_query import SummaryIndex
+from wire_format import compress, encode_frame, variant_etag
+
+# --------------------------------------------------------------------
+# サマリのインメモリキャッシュ
+#   - JSON をシリアライズ済みの bytes で保持し、ETag (内容のハッシュ) を付与
+#   - update_data() 完了時にエントリごと差し替える (読み手はロック不要)
+#   - gzip 済みの本文も1度だけ作って保持 (Accept-Encoding: gzip にそのまま返す)
+#   - スナップショット (CSV / Feather) の更新時刻が新しければ読み直す (他プロセス / 再起動後の初回アクセス)
+#   - 集計プロセスがある構成では共有サマリ (mmap) の本文をそのまま使う
+#   - 列指向 / MessagePack / Arrow の本文 (と圧縮済みのもの) も最初の要求時に作って保持
+# --------------------------------------------------------------------
+
+
+class SummaryEntry:
+    __slots__ = ("body", "etag", "rows", "mtime", "updated_at", "version", "_frame", "_index", "_gzip", "_encoded")
+
+    def __init__(self, frame, mtime=0.0):
+        self._frame = frame
+        self.body = serialize_records(frame)
+        self.etag = '"' + hashlib.sha1(self.body).hexdigest()[:20] + '"'
+        self.rows = len(frame)
+        self.mtime = mtime
+        self.updated_at = time.time()
+        self.version = 0
+        self._index = None
+        self._gzip = None
+        self._encoded = {}
+
+    @classmethod
+    def from_shared(cls, snapshot):
+        """共有サマリ (shared_summary.SharedSnapshot) の本文をコピーせずに使う。DataFrame は必要になってから作る"""
+        entry = cls.__new__(cls)
+        entry._frame = None
+        entry.body = snapshot.body
+        entry.etag = snapshot.etag
+        entry.rows = snapshot.rows
+        entry.mtime = 0.0
+        entry.updated_at = snapshot.generated_ms / 1000
+        entry.version = snapshot.version
+        entry._index = None
+        entry._gzip = snapshot.gzip_body
+        entry._encoded = {}
+        return entry
+
+    @property
+    def frame(self):
+        if self._frame is None:
+            self._frame = pd.DataFrame(json.loads(bytes(self.body)))
+        return self._frame
+
+    @property
+    def gzip_etag(self):
+        return self.etag[:-1] + '-gz"'
+
+    def gzipped(self):
+        if self._gzip is None:
+            self._gzip = gzip_bytes(self.body)
+        return self._gzip
+
+    def encoded(self, fmt, encoding=None):
+        """全件を fmt の形式 (wire_format) で。(本文, ETag) を返す"""
+        if fmt == "json" and encoding in (None, "gzip"):
+            return (self.gzipped(), self.gzip_etag) if encoding else (self.body, self.etag)
+        key = (fmt, encoding)
+        cached = self._encoded.get(key)
+        if cached is None:
+            if encoding:
+                body = compress(self.encoded(fmt)[0], encoding)
+            else:
+                body = encode_frame(fmt, self.frame)
+            cached = self._encoded[key] = (body, variant_etag(self.etag, fmt, encoding))
+        return cached
+
+    def index(self):
+        # フィルタ / ソート用のインデックスは最初のクエリ時に作成
+        if self._index is None:
+            self._index = SummaryIndex(self.frame)
+        return self._index
+
+
+def serialize_records(df):
+    return json.dumps(df.to_dict(orient="records"), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+def etag_matches(if_none_match, etag):
+    """If-None-Match ヘッダ (カンマ区切り / W/ 付き / *) と ETag を比較"""
+    if not if_none_match:
+        return False
+    for tag in if_none_match.split(","):
+        tag = tag.strip()
+        if tag.startswith("W/"):
+            tag = tag[2:]
+        if tag == "*" or tag == etag:
+            return True
+    return False
+
+
+class SummaryCache:
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def publish(self, key, df, path=None):
+        mtime = _mtime(path) if path else 0.0
+        entry = SummaryEntry(df, mtime)
+        with self._lock:
+            self._entries[key] = entry
+        return entry
+
+    def get(self, key, path=None):
+        entry = self._entries.get(key)
+        if path is None:
+            return entry
+        mtime = _mtime(path)
+        if mtime == 0.0:
+            return entry
+        if entry is None or mtime > entry.mtime:
+            return self._reload(key, path, mtime)
+        return entry
+
+    def get_shared(self, key, snapshot):
+        """共有サマリの version が変わっていればエントリを差し替える"""
+        entry = self._entries.get(key)
+        if snapshot is None:
+            return entry
+        if entry is None or entry.version != snapshot.version:
+            with self._lock:
+                entry = self._entries.get(key)
+                if entry is None or entry.version != snapshot.version:
+                    entry = self._entries[key] = SummaryEntry.from_shared(snapshot)
+        return entry
+
+    def _reload(self, key, path, mtime):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.mtime >= mtime:
+                return entry
+            try:
+                df = read_frame(path)
+            except Exception as e:
+                print(f"Error reading snapshot {path}: {e}")
+                return entry
+            entry = SummaryEntry(df, mtime)
+            self._entries[key] = entry
+            return entry
+
+
+def _mtime(path):
+    try:
+        return os.path.getmtime(path)
+    except OSError:
+        return 0.0
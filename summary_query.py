@@ -0,0 +1,152 @@
+import hashlib
+import operator
+import re
+
+import numpy as np
+
+# --------------------------------------------------------------------
+# /api/data のサーバ側フィルタ・ソート・ページング
+#   ?filter=price_change_rate>=0,volume_spike_flag==true
+#   &q=btc                 (シンボル部分一致, 大文字小文字無視)
+#   &sort=-volume_change_rate,symbol   (- は降順)
+#   &columns=symbol,close,price_change_rate
+#   &limit=100&offset=0
+# 列毎のソート済みインデックスは公開時に1度だけ作り、リクエスト毎には
+# マスクを掛けるだけにする
+# --------------------------------------------------------------------
+
+QUERY_PARAMS = ("filter", "q", "sort", "columns", "limit", "offset")
+MAX_LIMIT = 5000
+
+FILTER_RE = re.compile(r"^\s*([A-Za-z_][A-Za-z0-9_]*)\s*(>=|<=|==|!=|>|<)\s*(.+?)\s*$")
+OPS = {
+    ">=": operator.ge,
+    "<=": operator.le,
+    ">": operator.gt,
+    "<": operator.lt,
+    "==": operator.eq,
+    "!=": operator.ne,
+}
+
+
+class QueryError(ValueError):
+    pass
+
+
+class SummaryIndex:
+    def __init__(self, df):
+        self.df = df.reset_index(drop=True)
+        self.columns = {c: self.df[c].to_numpy() for c in self.df.columns}
+        # 列毎のソート済み行番号 (昇順, 安定ソート)
+        self.sorted = {c: np.argsort(v, kind="stable") for c, v in self.columns.items()}
+        self.symbol_lower = np.char.lower(self.df["symbol"].to_numpy().astype(str)) \
+            if "symbol" in self.df.columns else None
+
+    def __len__(self):
+        return len(self.df)
+
+    def _coerce(self, col, raw):
+        values = self.columns[col]
+        if values.dtype.kind == "b":
+            if raw.lower() in ("true", "1", "yes"):
+                return True
+            if raw.lower() in ("false", "0", "no"):
+                return False
+            raise QueryError(f"Invalid boolean for {col}: {raw}")
+        if values.dtype.kind in "iuf":
+            try:
+                return float(raw)
+            except ValueError:
+                raise QueryError(f"Invalid number for {col}: {raw}")
+        return raw
+
+    def query(self, filters=(), search=None, sort=(), columns=None, limit=None, offset=0):
+        meta, page = self.query_frame(filters, search, sort, columns, limit, offset)
+        return {**meta, "rows": page.to_dict(orient="records")}
+
+    def query_frame(self, filters=(), search=None, sort=(), columns=None, limit=None, offset=0):
+        """query() と同じ絞り込みで、件数等の dict と該当ページの DataFrame を返す (列指向の形式用)"""
+        n = len(self.df)
+        mask = np.ones(n, dtype=bool)
+        for col, op, raw in filters:
+            if col not in self.columns:
+                raise QueryError(f"Unknown column: {col}")
+            mask &= OPS[op](self.columns[col], self._coerce(col, raw))
+        if search and self.symbol_lower is not None:
+            mask &= np.char.find(self.symbol_lower, search.lower()) >= 0
+
+        for col, _ in sort:
+            if col not in self.columns:
+                raise QueryError(f"Unknown sort column: {col}")
+        if len(sort) == 1:
+            col, desc = sort[0]
+            order = self.sorted[col][::-1] if desc else self.sorted[col]
+        elif sort:
+            # np.lexsort は最後のキーが第1キー
+            keys = []
+            for col, desc in reversed(sort):
+                values = self.columns[col]
+                if values.dtype.kind not in "iufb":
+                    values = np.unique(values, return_inverse=True)[1]
+                values = values.astype(float)
+                keys.append(-values if desc else values)
+            order = np.lexsort(keys)
+        else:
+            order = np.arange(n)
+        order = order[mask[order]]
+
+        if columns:
+            unknown = [c for c in columns if c not in self.columns]
+            if unknown:
+                raise QueryError(f"Unknown columns: {','.join(unknown)}")
+        else:
+            columns = list(self.df.columns)
+        page = order[offset:offset + limit] if limit is not None else order[offset:]
+        meta = {"total": n, "matched": int(len(order)), "offset": offset, "limit": limit}
+        return meta, self.df.iloc[page][columns]
+
+
+def has_query(args):
+    return any(p in args for p in QUERY_PARAMS)
+
+
+def _split(values):
+    out = []
+    for v in values:
+        out.extend(x for x in re.split(r"[,;]", v) if x.strip())
+    return out
+
+
+def parse_query_args(args):
+    """Flask の request.args (MultiDict) / dict からクエリを組み立てる"""
+    getlist = args.getlist if hasattr(args, "getlist") else (lambda k: [args[k]] if k in args else [])
+    filters = []
+    for expr in _split(getlist("filter")):
+        m = FILTER_RE.match(expr)
+        if not m:
+            raise QueryError(f"Invalid filter: {expr}")
+        filters.append(m.groups())
+    sort = [(k.strip().lstrip("-"), k.strip().startswith("-")) for k in _split(getlist("sort"))]
+    columns = [c.strip() for c in _split(getlist("columns"))] or None
+    try:
+        limit = int(args.get("limit")) if args.get("limit") not in (None, "") else None
+        offset = int(args.get("offset") or 0)
+    except ValueError:
+        raise QueryError("limit/offset must be integers")
+    if limit is not None:
+        limit = max(0, min(limit, MAX_LIMIT))
+    return {
+        "filters": filters,
+        "search": (args.get("q") or "").strip() or None,
+        "sort": sort,
+        "columns": columns,
+        "limit": limit,
+        "offset": max(0, offset),
+    }
+
+
+def query_etag(base_etag, query_string):
+    if isinstance(query_string, str):
+        query_string = query_string.encode("utf-8")
+    return '"' + hashlib.sha1(base_etag.encode("utf-8") + b"?" + query_string).hexdigest()[:20] + '"'
+
@@ -0,0 +1,111 @@
+import threading
+
+import numpy as np
+import pandas as pd
+
+# --------------------------------------------------------------------
+# 銘柄毎に届いた順でサマリ行へ畳み込むアキュムレータ
+#   - 銘柄毎の DataFrame / pd.concat / groupby を使わず、確保済みの
+#     NumPy 配列の1行に最新足・N本前の足・直前N本の出来高平均だけを書く
+#   - 更新の途中でも frame() でそこまでの結果を取り出せる
+#   - frame() の列と値は summarize_data_4bars と同じ
+# --------------------------------------------------------------------
+
+# values 列: 最新足の OHLCV / OI, funding, N本前の close / volume / OI, 直前N本 (最新を含まない) の出来高平均
+COLUMNS = (
+    "open", "high", "low", "close", "volume", "openInterest", "funding_rate",
+    "old_close", "old_volume", "old_oi", "vol_ma",
+)
+COL = {c: i for i, c in enumerate(COLUMNS)}
+
+
+class SummaryAccumulator:
+    def __init__(self, tf, capacity, n_bars=4, small_price_threshold=0.5, volume_spike_ratio=2.0):
+        self.tf = tf
+        self.n_bars = n_bars
+        self.small_price_threshold = small_price_threshold
+        self.volume_spike_ratio = volume_spike_ratio
+        self.symbols = []
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.values = np.zeros((capacity, len(COLUMNS)))
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def _grow(self):
+        n = len(self.ts) * 2 or 16
+        ts = np.zeros(n, dtype=np.int64)
+        values = np.zeros((n, len(COLUMNS)))
+        ts[:len(self.ts)] = self.ts
+        values[:len(self.values)] = self.values
+        self.ts, self.values = ts, values
+
+    def add(self, symbol, ts, bars, funding_rate=0.0):
+        """
+        再集計済みの足 (ts 昇順, 列は open, high, low, close, volume, openInterest) から
+        1行を書き込む。足が n_bars + 1 本 (最新 + N本前まで) に満たなければ何もしない
+        """
+        if len(ts) <= self.n_bars:
+            return False
+        latest, oldest = bars[-1], bars[-self.n_bars - 1]
+        oi_latest, oi_oldest = np.nan_to_num(latest[5]), np.nan_to_num(oldest[5])
+        with self.lock:
+            i = len(self.symbols)
+            if i == len(self.ts):
+                self._grow()
+            row = self.values[i]
+            row[:5] = latest[:5]
+            row[COL["openInterest"]] = oi_latest
+            row[COL["funding_rate"]] = funding_rate or 0.0
+            row[COL["old_close"]] = oldest[3]
+            row[COL["old_volume"]] = oldest[4]
+            row[COL["old_oi"]] = oi_oldest
+            row[COL["vol_ma"]] = bars[-self.n_bars - 1:-1, 4].mean()
+            self.ts[i] = ts[-1]
+            self.symbols.append(symbol)
+        return True
+
+    def frame(self):
+        """ここまでに畳み込んだ銘柄のサマリ (symbol 昇順)"""
+        with self.lock:
+            n = len(self.symbols)
+            symbols = np.array(self.symbols, dtype=object)
+            ts = self.ts[:n].copy()
+            v = self.values[:n].copy()
+        if n == 0:
+            return pd.DataFrame()
+        order = np.argsort(symbols, kind="stable")
+        symbols, ts, v = symbols[order], ts[order], v[order]
+
+        price_chg = _change_rate(v[:, COL["close"]], v[:, COL["old_close"]])
+        vol_chg = _change_rate(v[:, COL["volume"]], v[:, COL["old_volume"]])
+        oi_chg = _change_rate(v[:, COL["openInterest"]], v[:, COL["old_oi"]])
+        vol_latest = v[:, COL["volume"]]
+        vol_ma = v[:, COL["vol_ma"]]
+
+        summary = pd.DataFrame({
+            "symbol":       symbols,
+            "timestamp":    pd.to_datetime(ts, unit="ms", utc=True).tz_convert("Asia/Tokyo")
+                              .strftime('%Y-%m-%d %H:%M:%S').values,
+            "open":         v[:, COL["open"]],
+            "high":         v[:, COL["high"]],
+            "low":          v[:, COL["low"]],
+            "close":        v[:, COL["close"]],
+            "volume":       vol_latest,
+            "openInterest": v[:, COL["openInterest"]],
+            "funding_rate": np.round(v[:, COL["funding_rate"]], 6),
+
+            "price_change_rate":  np.round(price_chg, 3),
+            "volume_change_rate": np.round(vol_chg, 3),
+            "oi_change_rate":     np.round(oi_chg, 3),
+
+            "volume_spike_flag":     (vol_ma > 0) & (vol_latest >= self.volume_spike_ratio * vol_ma),
+            "small_price_move_flag": np.abs(price_chg) <= self.small_price_threshold,
+        })
+        return summary.fillna(0)
+
+
+def _change_rate(new, old):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(old != 0, (new - old) / old * 100, 0.0)
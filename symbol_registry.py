@@ -0,0 +1,147 @@
+import json
+import os
+import threading
+import time
+
+# --------------------------------------------------------------------
+# 銘柄ユニバースのキャッシュ (instruments-info)
+#   - nextPageCursor で全ページを取得 (1ページ目だけでは取りこぼす)
+#   - TTL (既定1時間) の間は再取得しない。取得に失敗したら前回の一覧を使う
+#   - 前回との差分で新規上場 / 上場廃止を検出
+#   - ステータス・上場日時・tick size 等を保持し、取引中でない銘柄
+#     (PreLaunch / Delivering / Closed) は個別取得の対象から外す
+# --------------------------------------------------------------------
+
+INSTRUMENTS_PAGE_LIMIT = 1000
+DEFAULT_TTL_SEC = 3600
+TRADING_STATUS = "Trading"
+
+# 保持するメタデータ (instruments-info の list の項目)
+META_FIELDS = ("status", "contractType", "baseCoin", "quoteCoin", "launchTime", "deliveryTime", "fundingInterval")
+
+
+def instrument_meta(item):
+    meta = {k: item.get(k) for k in META_FIELDS}
+    meta["tickSize"] = (item.get("priceFilter") or {}).get("tickSize")
+    meta["qtyStep"] = (item.get("lotSizeFilter") or {}).get("qtyStep")
+    for k in ("launchTime", "deliveryTime", "fundingInterval"):
+        try:
+            meta[k] = int(meta[k] or 0)
+        except (TypeError, ValueError):
+            meta[k] = 0
+    return meta
+
+
+class SymbolRegistry:
+    def __init__(self, fetch_page, ttl_sec=DEFAULT_TTL_SEC, path=None, symbol_filter=None):
+        """
+        fetch_page(cursor) : instruments-info のレスポンス (dict) を返す関数
+        symbol_filter(symbol, meta) : 対象にする銘柄なら True (既定は全て)
+        """
+        self.fetch_page = fetch_page
+        self.ttl_sec = ttl_sec
+        self.path = path
+        self.symbol_filter = symbol_filter or (lambda symbol, meta: True)
+        self.instruments = {}
+        self.fetched_at = 0.0
+        self.last_delta = {"listed": [], "delisted": [], "status_changed": []}
+        self.lock = threading.Lock()
+        self._load()
+
+    # ---------------- 取得 ----------------
+    def fetch_all(self):
+        instruments = {}
+        cursor = None
+        while True:
+            data = self.fetch_page(cursor)
+            result = data.get("result", {})
+            for item in result.get("list", []):
+                symbol = item.get("symbol", "")
+                meta = instrument_meta(item)
+                if symbol and self.symbol_filter(symbol, meta):
+                    instruments[symbol] = meta
+            cursor = result.get("nextPageCursor")
+            if not cursor or not result.get("list"):
+                break
+        return instruments
+
+    def is_stale(self, now=None):
+        now = now or time.time()
+        return not self.instruments or now - self.fetched_at >= self.ttl_sec
+
+    def refresh(self, force=False):
+        """TTL 切れ (または force) なら取得し直し、差分を返す。取得しなければ None"""
+        if not force and not self.is_stale():
+            return None
+        with self.lock:
+            if not force and not self.is_stale():
+                return None
+            try:
+                instruments = self.fetch_all()
+            except Exception as e:
+                print(f"Error fetching instruments: {e}")
+                return None
+            if not instruments:
+                print("Instruments list is empty, keeping previous list.")
+                return None
+            delta = self._diff(self.instruments, instruments) if self.instruments else None
+            self.instruments = instruments
+            self.fetched_at = time.time()
+            if delta is not None:
+                self.last_delta = delta
+                if any(delta.values()):
+                    print(f"Symbol universe changed: listed={delta['listed']} "
+                          f"delisted={delta['delisted']} status_changed={delta['status_changed']}")
+            self._save()
+            return delta
+
+    @staticmethod
+    def _diff(old, new):
+        return {
+            "listed": sorted(set(new) - set(old)),
+            "delisted": sorted(set(old) - set(new)),
+            "status_changed": sorted(
+                s for s in set(old) & set(new) if old[s].get("status") != new[s].get("status")
+            ),
+        }
+
+    # ---------------- 参照 ----------------
+    def active_symbols(self, now_ms=None):
+        """取引中かつ上場済みの銘柄 (個別取得の対象)"""
+        now_ms = now_ms or int(time.time() * 1000)
+        return [
+            s for s, meta in sorted(self.instruments.items())
+            if meta.get("status") == TRADING_STATUS and meta.get("launchTime", 0) <= now_ms
+        ]
+
+    def get(self, symbol):
+        return self.instruments.get(symbol)
+
+    def status_counts(self):
+        counts = {}
+        for meta in self.instruments.values():
+            counts[meta.get("status")] = counts.get(meta.get("status"), 0) + 1
+        return counts
+
+    # ---------------- 永続化 ----------------
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            tmp = self.path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump({"fetched_at": self.fetched_at, "instruments": self.instruments}, f)
+            os.replace(tmp, self.path)
+        except OSError as e:
+            print(f"Error saving instruments {self.path}: {e}")
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+            self.instruments = data.get("instruments", {})
+            self.fetched_at = float(data.get("fetched_at", 0.0))
+        except (OSError, ValueError) as e:
+            print(f"Error loading instruments {self.path}: {e}")
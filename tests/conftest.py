@@ -0,0 +1,74 @@
+import os
+import sys
+
+import pytest
+
+# リポジトリ直下のモジュール (rate_limiter, ws_ingest, ...) を import できるように
+# (tests/ のモック mock_bybit / mock_bybit_ws は pytest がテストと同じディレクトリから読む)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def engine(tmp_path, monkeypatch):
+    """
+    fetch_data の状態 (バーストア・ローリング統計・保存先など) を tmp_path の空のものに差し替える。
+    テストの後は monkeypatch が元に戻すので、テストの順序や data/ の中身に左右されない
+    """
+    import fetch_data as fd
+    from alerts import AlertEngine
+    from bar_store import BarStore
+    from funding_cache import FundingRateCache
+    from history_store import HistoryStore
+    from rolling_stats import RollingStats
+    from shared_summary import SharedSummaryReader, SharedSummaryWriter
+    from summary_cache import SummaryCache
+
+    tmp = str(tmp_path)
+    shared = os.path.join(tmp, "shared")
+    monkeypatch.setattr(fd, "DATA_DIR", tmp)
+    monkeypatch.setattr(fd, "SHARED_DIR", shared)
+    monkeypatch.setattr(fd, "REFRESH_LOCK_PATH", os.path.join(shared, "refresh.lock"))
+    monkeypatch.setattr(fd, "HISTORY_ENABLED", False)
+    monkeypatch.setattr(fd, "history_store", HistoryStore(os.path.join(tmp, "history")))
+    monkeypatch.setattr(fd, "shared_writer", SharedSummaryWriter(shared))
+    monkeypatch.setattr(fd, "shared_reader", SharedSummaryReader(shared))
+    monkeypatch.setattr(fd, "bar_store", BarStore(None, fd.BAR_STORE_CAPACITY))
+    monkeypatch.setattr(fd, "rolling_stats", {
+        tf: RollingStats(fd.SUMMARY_LOOKBACKS, fd.ROLLING_EWMA_SPAN) for tf in fd.ENABLED_TIMEFRAMES
+    })
+    monkeypatch.setattr(fd, "rolling_seeded", {})
+    monkeypatch.setattr(fd, "funding_cache", FundingRateCache())
+    monkeypatch.setattr(fd, "summary_cache", SummaryCache())
+    monkeypatch.setattr(fd, "alert_engine", AlertEngine(state_path=os.path.join(shared, "alerts.json")))
+    monkeypatch.setattr(fd.symbol_registry, "path", None)
+    monkeypatch.setattr(fd.symbol_registry, "instruments", {})
+    monkeypatch.setattr(fd.symbol_registry, "fetched_at", 0.0)
+    monkeypatch.setattr(fd, "_bar_state_saved_bar", 0)
+    monkeypatch.setattr(fd, "_bar_state_pending", False)
+    # 読み込み済みとして扱い、保存済みのバーの状態を読まない / atexit を登録しない
+    monkeypatch.setattr(fd, "_bar_state_loaded", True)
+    return fd
+
+
+@pytest.fixture
+def bybit(engine, monkeypatch):
+    """
+    ローカルのモック Bybit (tests/mock_bybit.py) を起動して fetch_data の URL を向ける。
+    bybit(n_symbols) で起動したモックを返し、テストの後に止める
+    """
+    from mock_bybit import URL_VARS, MockBybit
+
+    mocks = []
+
+    def start(n_symbols=5):
+        mock = MockBybit(n_symbols=n_symbols)
+        base_url = mock.start(0)
+        mocks.append(mock)
+        for var, endpoint in URL_VARS.items():
+            monkeypatch.setattr(engine, var, base_url + endpoint)
+        return mock
+
+    yield start
+    for mock in mocks:
+        mock.stop()
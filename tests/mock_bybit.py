@@ -0,0 +1,427 @@
+"""
+Bybit v5 (market) のローカル・モックサーバ。テスト / ベンチマーク / 動作確認用 (ネットワーク不要)
+
+    python tests/mock_bybit.py serve [--port 18080] [--symbols 450] [--latency-ms 30] [--jitter-ms 10]
+                                          [--error-rate 0.01] [--throttle-rate 0.0]
+                                          [--throttle-kind retcode|http|mixed] [--replay DIR]
+    python tests/mock_bybit.py record DIR [--symbols 5]
+
+serve:  instruments-info / kline / open-interest / funding/history / tickers を返す。
+        既定は銘柄毎に決まった値 (再現可能) を合成し、--replay を指定すると record で保存した
+        実際の応答を現在時刻にずらして銘柄に割り当てる (instruments-info は記録した銘柄一覧を先頭に使う)。
+        --error-rate の割合で HTTP 500、--throttle-rate の割合でスロットリングを返す
+        (--throttle-kind: retcode = retCode=10006, http = HTTP 429 + Retry-After, mixed = 半々)。
+        GET /__stats でエンドポイント別のリクエスト数、GET /__reset で 0 に戻す
+record: 本番 Bybit から instruments-info (全ページ) と、売買代金上位の銘柄の kline / open-interest /
+        funding/history の応答を DIR に保存する
+"""
+import argparse
+import json
+import math
+import os
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BYBIT_URL = "https://api.bybit.com/v5/market/"
+ENDPOINTS = ("instruments-info", "kline", "open-interest", "funding/history", "tickers")
+# fetch_data のモジュール変数 → エンドポイント
+URL_VARS = {
+    "BASE_URL_SYMBOLS": "instruments-info",
+    "BASE_URL_KLINE": "kline",
+    "BASE_URL_OI": "open-interest",
+    "BASE_URL_FUNDING_HISTORY": "funding/history",
+    "BASE_URL_TICKERS": "tickers",
+}
+OI_INTERVAL_MIN = {"5min": 5, "15min": 15, "30min": 30, "1h": 60, "4h": 240, "1d": 1440}
+FUNDING_INTERVAL_MS = 8 * 60 * 60 * 1000
+THROTTLE_KINDS = ("retcode", "http", "mixed")
+
+
+def symbol_names(n):
+    return [f"SYM{i:04d}USDT" for i in range(n)]
+
+
+def _seed(*parts):
+    return zlib.crc32("|".join(str(p) for p in parts).encode())
+
+
+# --------------------------------------------------------------------
+# 合成データ (銘柄名と時刻だけで決まる)
+# --------------------------------------------------------------------
+def synth_price(symbol, ts):
+    s = _seed(symbol)
+    base = 10 ** ((s % 600) / 100 - 2)
+    return base * (1 + 0.02 * math.sin(ts / 3.6e6 + s % 97) + 0.005 * math.sin(ts / 4.1e5 + s % 13))
+
+
+def synth_volume(symbol, ts):
+    v = 1000 * (1 + 0.5 * math.sin(ts / 7.2e6 + _seed(symbol) % 31))
+    # 50本に1本くらい出来高スパイク
+    return v * 3 if _seed(symbol, ts) % 50 == 0 else v
+
+
+def synth_kline_row(symbol, ts, interval_ms):
+    o = synth_price(symbol, ts)
+    c = synth_price(symbol, ts + interval_ms - 1)
+    # 5分足より長い足は5分足何本分かの出来高 (バーストアからの再集計と桁を揃える)
+    v = synth_volume(symbol, ts) * max(1, interval_ms // 300000)
+    return [str(ts), f"{o:.6g}", f"{max(o, c) * 1.002:.6g}", f"{min(o, c) * 0.998:.6g}", f"{c:.6g}",
+            f"{v:.3f}", f"{v * c:.3f}"]
+
+
+def synth_oi(symbol, ts):
+    return 1e5 * (1 + 0.1 * math.sin(ts / 5.4e6 + _seed(symbol) % 17))
+
+
+def synth_funding(symbol, ts):
+    return 0.0001 * (1 + math.sin(ts / 2.88e7 + _seed(symbol) % 11))
+
+
+# --------------------------------------------------------------------
+# 記録した応答の再生
+# --------------------------------------------------------------------
+class Recording:
+    def __init__(self, root):
+        self.templates = {}
+        for endpoint in ("kline", "open-interest", "funding"):
+            d = os.path.join(root, endpoint)
+            files = sorted(os.listdir(d)) if os.path.isdir(d) else []
+            self.templates[endpoint] = [_load(os.path.join(d, f)) for f in files]
+        if not self.templates["kline"]:
+            raise ValueError(f"no recorded kline responses in {root}")
+        path = os.path.join(root, "instruments-info.json")
+        self.instruments = _load(path)["list"] if os.path.exists(path) else []
+
+    def pick(self, endpoint, symbol):
+        items = self.templates.get(endpoint) or []
+        return items[_seed(symbol) % len(items)] if items else None
+
+
+def _load(path):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _shift(ts, newest, now_aligned):
+    return ts + (now_aligned - newest)
+
+
+def synth_instrument(symbol):
+    return {
+        "symbol": symbol, "contractType": "LinearPerpetual", "status": "Trading",
+        "baseCoin": symbol[:-4], "quoteCoin": "USDT", "launchTime": "1600000000000", "deliveryTime": "0",
+        "priceFilter": {"tickSize": "0.0001"}, "lotSizeFilter": {"qtyStep": "0.1"}, "fundingInterval": 480,
+    }
+
+
+class MockBybit:
+    def __init__(self, n_symbols=450, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, throttle_rate=0.0,
+                 replay_dir=None, seed=0, throttle_kind="retcode"):
+        if throttle_kind not in THROTTLE_KINDS:
+            raise ValueError(f"throttle_kind must be one of {THROTTLE_KINDS}")
+        self.latency = latency_ms / 1000
+        self.jitter = jitter_ms / 1000
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.throttle_kind = throttle_kind
+        self.recording = Recording(replay_dir) if replay_dir else None
+        # 記録した銘柄一覧があればそれを先頭に、足りない分は合成した銘柄で埋める
+        recorded = self.recording.instruments[:n_symbols] if self.recording is not None else []
+        names = {item["symbol"] for item in recorded}
+        extra = [synth_instrument(s) for s in symbol_names(n_symbols) if s not in names]
+        self.instrument_items = recorded + extra[:n_symbols - len(recorded)]
+        self.symbols = [item["symbol"] for item in self.instrument_items]
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.server = None
+        self.reset_stats()
+
+    # ---------------- 統計 ----------------
+    def reset_stats(self):
+        with self.lock:
+            self.counts = {e: 0 for e in ENDPOINTS}
+            self.errors = 0
+            self.throttled = 0
+            self.throttled_http = 0
+
+    def stats(self):
+        with self.lock:
+            return {"requests": sum(self.counts.values()), "by_endpoint": dict(self.counts),
+                    "errors": self.errors, "throttled": self.throttled, "throttled_http": self.throttled_http}
+
+    # ---------------- 応答 ----------------
+    def handle(self, endpoint, q):
+        """(HTTP ステータス, JSON, 追加のヘッダ) を返す。HTTP 429 の本文は JSON ではない (None)"""
+        with self.lock:
+            self.counts[endpoint] += 1
+            r = self.rng.random()
+            delay = self.latency + self.rng.uniform(-self.jitter, self.jitter)
+            http_throttle = (self.throttle_kind == "http"
+                             or (self.throttle_kind == "mixed" and self.rng.random() < 0.5))
+            if r < self.error_rate:
+                self.errors += 1
+            elif r < self.error_rate + self.throttle_rate:
+                self.throttled += 1
+                self.throttled_http += http_throttle
+        if delay > 0:
+            time.sleep(delay)
+        if r < self.error_rate:
+            return 500, {"retCode": 10016, "retMsg": "mock server error", "result": {}}, {}
+        if r < self.error_rate + self.throttle_rate:
+            if http_throttle:
+                return 429, None, {"Retry-After": "1"}
+            return 200, {"retCode": 10006, "retMsg": "Too many visits!", "result": {}}, {}
+        handler = {
+            "instruments-info": self.instruments,
+            "kline": self.kline,
+            "open-interest": self.open_interest,
+            "funding/history": self.funding,
+            "tickers": self.tickers,
+        }[endpoint]
+        return 200, {"retCode": 0, "retMsg": "OK", "result": handler(q), "time": int(time.time() * 1000)}, {}
+
+    def instruments(self, q):
+        limit = min(int(q.get("limit", 500)), 1000)
+        offset = int(q.get("cursor") or 0)
+        items = self.instrument_items[offset:offset + limit]
+        more = offset + limit < len(self.instrument_items)
+        return {"category": "linear", "list": items, "nextPageCursor": str(offset + limit) if more else ""}
+
+    def kline(self, q):
+        symbol = q["symbol"]
+        interval = q.get("interval", "5")
+        interval_ms = (1440 if interval == "D" else int(interval)) * 60 * 1000
+        limit = min(int(q.get("limit", 200)), 1000)
+        now = int(time.time() * 1000)
+        start = int(q.get("start", 0))
+        end = min(int(q.get("end", now)), now)
+        if self.recording is not None:
+            rows = self._replay_rows("kline", symbol, interval_ms, now, start, end, limit)
+        else:
+            rows = []
+            t = end // interval_ms * interval_ms
+            while t >= start and len(rows) < limit:
+                rows.append(synth_kline_row(symbol, t, interval_ms))
+                t -= interval_ms
+        return {"category": "linear", "symbol": symbol, "list": rows}
+
+    def _replay_rows(self, endpoint, symbol, interval_ms, now, start, end, limit):
+        data = self.recording.pick(endpoint, symbol)
+        rows = data.get("result", {}).get("list", [])
+        if not rows:
+            return []
+        newest = max(int(r[0]) for r in rows)
+        aligned = now // interval_ms * interval_ms
+        out = []
+        for r in rows:
+            ts = _shift(int(r[0]), newest, aligned)
+            if start <= ts <= end:
+                out.append([str(ts)] + list(r[1:]))
+        out.sort(key=lambda r: -int(r[0]))
+        return out[:limit]
+
+    def open_interest(self, q):
+        symbol = q["symbol"]
+        interval_ms = OI_INTERVAL_MIN.get(q.get("intervalTime", "5min"), 5) * 60 * 1000
+        limit = min(int(q.get("limit", 50)), 200)
+        now = int(time.time() * 1000)
+        start = int(q.get("start", 0))
+        end = min(int(q.get("end", now)), now)
+        t = int(q.get("cursor") or end // interval_ms * interval_ms)
+        template = self.recording.pick("open-interest", symbol) if self.recording is not None else None
+        values = [float(r["openInterest"]) for r in template["result"]["list"]] if template else None
+        rows = []
+        while t >= start and len(rows) < limit:
+            oi = values[(t // interval_ms) % len(values)] if values else synth_oi(symbol, t)
+            rows.append({"openInterest": f"{oi:.3f}", "timestamp": str(t)})
+            t -= interval_ms
+        cursor = str(t) if t >= start and rows else ""
+        return {"category": "linear", "symbol": symbol, "list": rows, "nextPageCursor": cursor}
+
+    def funding(self, q):
+        symbol = q["symbol"]
+        now = int(time.time() * 1000)
+        end = min(int(q.get("end", now)), now)
+        start = int(q.get("start", end - 2 * 24 * 3600 * 1000))
+        limit = int(q.get("limit", 200))
+        template = self.recording.pick("funding", symbol) if self.recording is not None else None
+        if template is not None:
+            return {"category": "linear", "list": self._replay_funding(template, symbol, now, start, end, limit)}
+        t = end // FUNDING_INTERVAL_MS * FUNDING_INTERVAL_MS
+        rows = []
+        while t >= start and len(rows) < limit:
+            rows.append({"symbol": symbol, "fundingRate": f"{synth_funding(symbol, t):.8f}",
+                         "fundingRateTimestamp": str(t)})
+            t -= FUNDING_INTERVAL_MS
+        return {"category": "linear", "list": rows}
+
+    def _replay_funding(self, template, symbol, now, start, end, limit):
+        # 記録した精算の並び (新しい順) を、最新の精算が直近の精算時刻になるようにずらす
+        rows = template.get("result", {}).get("list", [])
+        if not rows:
+            return []
+        newest = max(int(r["fundingRateTimestamp"]) for r in rows)
+        aligned = now // FUNDING_INTERVAL_MS * FUNDING_INTERVAL_MS
+        out = []
+        for r in sorted(rows, key=lambda r: -int(r["fundingRateTimestamp"])):
+            ts = _shift(int(r["fundingRateTimestamp"]), newest, aligned)
+            if start <= ts <= end:
+                out.append({"symbol": symbol, "fundingRate": r["fundingRate"], "fundingRateTimestamp": str(ts)})
+        return out[:limit]
+
+    def tickers(self, q):
+        now = int(time.time() * 1000)
+        next_funding = (now // FUNDING_INTERVAL_MS + 1) * FUNDING_INTERVAL_MS
+        items = []
+        for s in self.symbols:
+            price = synth_price(s, now)
+            items.append({
+                "symbol": s, "lastPrice": f"{price:.6g}", "openInterest": f"{synth_oi(s, now):.3f}",
+                "fundingRate": f"{synth_funding(s, now):.8f}", "nextFundingTime": str(next_funding),
+                "volume24h": f"{synth_volume(s, now) * 288:.3f}",
+                "turnover24h": f"{synth_volume(s, now) * 288 * price:.3f}",
+            })
+        return {"category": "linear", "list": items}
+
+    # ---------------- サーバ ----------------
+    def start(self, port=0, host="127.0.0.1"):
+        """バックグラウンドのスレッドで起動し、ベース URL を返す"""
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"  # keep-alive
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                q = {k: v[0] for k, v in parse_qs(url.query).items()}
+                path = url.path.rstrip("/")
+                headers = {}
+                if path == "/__stats":
+                    status, payload = 200, mock.stats()
+                elif path == "/__reset":
+                    mock.reset_stats()
+                    status, payload = 200, {"ok": True}
+                else:
+                    endpoint = next((e for e in ENDPOINTS if path.endswith("/" + e)), None)
+                    if endpoint is None:
+                        status, payload = 404, {"retCode": 10001, "retMsg": "not found", "result": {}}
+                    else:
+                        try:
+                            status, payload, headers = mock.handle(endpoint, q)
+                        except (KeyError, ValueError) as e:
+                            status, payload = 200, {"retCode": 10001, "retMsg": f"params error: {e}", "result": {}}
+                if payload is None:
+                    body, content_type = b"Too Many Requests", "text/plain"
+                else:
+                    body, content_type = json.dumps(payload, separators=(",", ":")).encode(), "application/json"
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.base_url
+
+    @property
+    def base_url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v5/market/"
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+def point_to(fd, base_url):
+    """fetch_data の Bybit URL をモックへ向ける"""
+    for var, endpoint in URL_VARS.items():
+        setattr(fd, var, base_url + endpoint)
+
+
+# --------------------------------------------------------------------
+# 本番 Bybit からの記録
+# --------------------------------------------------------------------
+def record(root, n_symbols):
+    import requests
+
+    session = requests.Session()
+    get = lambda endpoint, **params: session.get(BYBIT_URL + endpoint, params=params, timeout=15).json()
+    # instruments-info は全ページをまとめて1ファイルに
+    instruments, cursor = [], None
+    while True:
+        params = {"category": "linear", "limit": 1000, **({"cursor": cursor} if cursor else {})}
+        result = get("instruments-info", **params)["result"]
+        instruments.extend(i for i in result["list"] if i["symbol"].endswith("USDT"))
+        cursor = result.get("nextPageCursor")
+        if not cursor:
+            break
+    os.makedirs(root, exist_ok=True)
+    with open(os.path.join(root, "instruments-info.json"), "w", encoding="utf-8") as f:
+        json.dump({"category": "linear", "list": instruments}, f)
+    print(f"recorded {len(instruments)} instruments")
+
+    tickers = get("tickers", category="linear")["result"]["list"]
+    tickers = [t for t in tickers if t["symbol"].endswith("USDT")]
+    top = sorted(tickers, key=lambda t: -float(t.get("turnover24h") or 0))[:n_symbols]
+    now = int(time.time() * 1000)
+    for d in ("kline", "open-interest", "funding"):
+        os.makedirs(os.path.join(root, d), exist_ok=True)
+    for t in top:
+        s = t["symbol"]
+        responses = {
+            "kline": get("kline", category="linear", symbol=s, interval="5", limit=1000),
+            "open-interest": get("open-interest", category="linear", symbol=s, intervalTime="5min", limit=200),
+            "funding": get("funding/history", category="linear", symbol=s, limit=10, end=now),
+        }
+        for d, data in responses.items():
+            with open(os.path.join(root, d, f"{s}.json"), "w", encoding="utf-8") as f:
+                json.dump(data, f)
+        print(f"recorded {s}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    serve = sub.add_parser("serve")
+    serve.add_argument("--port", type=int, default=18080)
+    serve.add_argument("--symbols", type=int, default=450)
+    serve.add_argument("--latency-ms", type=float, default=0.0)
+    serve.add_argument("--jitter-ms", type=float, default=0.0)
+    serve.add_argument("--error-rate", type=float, default=0.0)
+    serve.add_argument("--throttle-rate", type=float, default=0.0)
+    serve.add_argument("--throttle-kind", default="retcode", choices=THROTTLE_KINDS)
+    serve.add_argument("--replay", default=None)
+    rec = sub.add_parser("record")
+    rec.add_argument("dir")
+    rec.add_argument("--symbols", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record(args.dir, args.symbols)
+        return
+    mock = MockBybit(args.symbols, args.latency_ms, args.jitter_ms, args.error_rate, args.throttle_rate,
+                     args.replay, throttle_kind=args.throttle_kind)
+    print(f"mock Bybit: {mock.start(args.port)} ({args.symbols} symbols)", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""
+Bybit public WebSocket (linear) のローカル・モック。記録したフレームを再生する (動作確認 / テスト用)
+
+    python tests/mock_bybit_ws.py record FILE [--symbols BTCUSDT,ETHUSDT] [--seconds 600]
+    python tests/mock_bybit_ws.py serve FILE [--port 18081] [--drop-after 50] [--interval-ms 50]
+
+record: 本番の kline.5.{symbol} / tickers.{symbol} を購読し、受信したフレームをそのまま JSON Lines で保存
+serve:  タイムスタンプを最後の kline の足が現在の足になるようにずらし、接続毎に次のセッションの
+        フレームを送る。--drop-after N フレーム毎に接続を切る (再接続と REST での埋め直しの確認用)。
+        subscribe には成功の応答、ping には pong を返す
+"""
+import argparse
+import asyncio
+import copy
+import json
+import threading
+import time
+
+from aiohttp import WSMsgType, web
+
+BYBIT_WS_URL = "wss://stream.bybit.com/v5/public/linear"
+BAR_MS = 5 * 60 * 1000
+PING_INTERVAL_SEC = 20
+
+
+def load_frames(path):
+    """JSON Lines のフレーム (topic の無い subscribe / pong の応答は除く)"""
+    frames = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                msg = json.loads(line)
+                if msg.get("topic"):
+                    frames.append(msg)
+    return frames
+
+
+def shift_frames(frames, delta_ms):
+    """フレームの時刻 (ts, kline の start / end / timestamp) を delta_ms ずらしたコピー"""
+    out = copy.deepcopy(frames)
+    for msg in out:
+        if "ts" in msg:
+            msg["ts"] += delta_ms
+        if msg["topic"].startswith("kline."):
+            for bar in msg["data"]:
+                for key in ("start", "end", "timestamp"):
+                    if key in bar:
+                        bar[key] += delta_ms
+    return out
+
+
+def last_kline_start(frames):
+    return max(bar["start"] for msg in frames if msg["topic"].startswith("kline.") for bar in msg["data"])
+
+
+def align_to_now(frames, now_ms=None, bar_ms=BAR_MS):
+    """最後の kline の足が現在の足になるようにずらす"""
+    now_ms = now_ms or int(time.time() * 1000)
+    return shift_frames(frames, now_ms // bar_ms * bar_ms - last_kline_start(frames))
+
+
+def split_sessions(frames, drop_after):
+    if not drop_after:
+        return [frames]
+    return [frames[i:i + drop_after] for i in range(0, len(frames), drop_after)] or [[]]
+
+
+class MockBybitWS:
+    def __init__(self, sessions, interval_ms=0.0):
+        """
+        sessions: 接続毎に送るフレームのリスト。最後のセッション以外は送り終えたら接続を切る
+        (最後のセッションは送り終えた後もクライアントが切るまで開いておく)
+        """
+        self.sessions = sessions
+        self.interval = interval_ms / 1000
+        self.connections = 0
+        self.topics = set()
+        self.pings = 0
+        self._loop = None
+        self._runner = None
+        self._thread = None
+        self._sockets = set()
+        self.port = None
+
+    async def _handle(self, request):
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        self._sockets.add(ws)
+        index = self.connections
+        self.connections += 1
+        frames = self.sessions[index] if index < len(self.sessions) else []
+        last = index >= len(self.sessions) - 1
+        subscribed = asyncio.Event()
+        reader = asyncio.create_task(self._read(ws, subscribed))
+        try:
+            # 購読要求が来てから送る
+            await asyncio.wait_for(subscribed.wait(), timeout=10)
+            for msg in frames:
+                await ws.send_str(json.dumps(msg))
+                if self.interval:
+                    await asyncio.sleep(self.interval)
+            if last:
+                await reader
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            reader.cancel()
+            self._sockets.discard(ws)
+            await ws.close()
+        return ws
+
+    async def _read(self, ws, subscribed):
+        async for msg in ws:
+            if msg.type != WSMsgType.TEXT:
+                continue
+            req = json.loads(msg.data)
+            if req.get("op") == "subscribe":
+                self.topics.update(req.get("args", []))
+                await ws.send_str(json.dumps({"success": True, "ret_msg": "", "op": "subscribe",
+                                              "conn_id": f"mock-{self.connections}"}))
+                subscribed.set()
+            elif req.get("op") == "ping":
+                self.pings += 1
+                await ws.send_str(json.dumps({"success": True, "ret_msg": "pong", "op": "ping"}))
+
+    # ---------------- サーバ ----------------
+    def start(self, port=0, host="127.0.0.1"):
+        """バックグラウンドのスレッドで起動し、接続先 URL を返す"""
+        started = threading.Event()
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            app = web.Application()
+            app.router.add_get("/v5/public/linear", self._handle)
+            self._runner = web.AppRunner(app)
+            self._loop.run_until_complete(self._runner.setup())
+            site = web.TCPSite(self._runner, host, port)
+            self._loop.run_until_complete(site.start())
+            self.port = site._server.sockets[0].getsockname()[1]
+            started.set()
+            self._loop.run_forever()
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        return f"ws://{host}:{self.port}/v5/public/linear"
+
+    async def _shutdown(self):
+        # 開いている接続を閉じてから止める (ハンドラを途中で捨てない)
+        for ws in list(self._sockets):
+            await ws.close()
+        await self._runner.cleanup()
+
+    def stop(self):
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=10)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join(timeout=10)
+        self._loop = None
+
+
+# --------------------------------------------------------------------
+# 本番 Bybit からの記録
+# --------------------------------------------------------------------
+async def record(path, symbols, seconds):
+    import aiohttp
+
+    args = [topic for s in symbols for topic in (f"kline.5.{s}", f"tickers.{s}")]
+    deadline = time.monotonic() + seconds
+    count = 0
+    async with aiohttp.ClientSession() as session, session.ws_connect(BYBIT_WS_URL) as ws:
+        for i in range(0, len(args), 10):
+            await ws.send_str(json.dumps({"op": "subscribe", "args": args[i:i + 10]}))
+        last_ping = time.monotonic()
+        with open(path, "w", encoding="utf-8") as f:
+            while time.monotonic() < deadline:
+                try:
+                    msg = await ws.receive(timeout=1)
+                except asyncio.TimeoutError:
+                    msg = None
+                if time.monotonic() - last_ping >= PING_INTERVAL_SEC:
+                    await ws.send_str('{"op":"ping"}')
+                    last_ping = time.monotonic()
+                if msg is None or msg.type != WSMsgType.TEXT:
+                    continue
+                f.write(msg.data + "\n")
+                count += 1
+    print(f"recorded {count} frames to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    sub = parser.add_subparsers(dest="command", required=True)
+    rec = sub.add_parser("record")
+    rec.add_argument("file")
+    rec.add_argument("--symbols", default="BTCUSDT,ETHUSDT")
+    rec.add_argument("--seconds", type=float, default=600)
+    serve = sub.add_parser("serve")
+    serve.add_argument("file")
+    serve.add_argument("--port", type=int, default=18081)
+    serve.add_argument("--drop-after", type=int, default=0)
+    serve.add_argument("--interval-ms", type=float, default=50.0)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        asyncio.run(record(args.file, args.symbols.split(","), args.seconds))
+        return
+    frames = align_to_now(load_frames(args.file))
+    mock = MockBybitWS(split_sessions(frames, args.drop_after), args.interval_ms)
+    print(f"mock Bybit WebSocket: {mock.start(args.port)} ({len(frames)} frames)", flush=True)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        mock.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import os
+
+import fetch_data as fd
+from mock_bybit import synth_kline_row
+
+
+def test_save_bar_state_once_per_closed_bar(engine, tmp_path, monkeypatch):
+    path = str(tmp_path / "bar_store.npz")
+    fd.bar_store.path = path
+    bar_start = fd.current_bar_start_ms()
+    monkeypatch.setattr(fd, "current_bar_start_ms", lambda now=None: bar_start)
+    fd.bar_store.upsert_klines("BTCUSDT", [synth_kline_row("BTCUSDT", bar_start, fd.BAR_MS)])
+
+    assert fd.save_bar_state()
+    assert os.path.exists(path)
+    os.remove(path)
+    # 同じ足の間は書き直さない
+    assert not fd.save_bar_state()
+    assert not os.path.exists(path)
+    # 足が確定したら保存
+    monkeypatch.setattr(fd, "current_bar_start_ms", lambda now=None: bar_start + fd.BAR_MS)
+    assert fd.save_bar_state()
+    assert os.path.exists(path)
+
+
+def test_save_pending_bar_state_at_exit(engine, tmp_path, monkeypatch):
+    path = str(tmp_path / "bar_store.npz")
+    fd.bar_store.path = path
+    monkeypatch.setattr(fd, "_bar_state_saved_bar", fd.current_bar_start_ms() + fd.BAR_MS)
+
+    # 見送った更新が無ければ書かない
+    fd.save_pending_bar_state()
+    assert not os.path.exists(path)
+    assert not fd.save_bar_state()
+    fd.save_pending_bar_state()
+    assert os.path.exists(path)
+    assert not fd._bar_state_pending
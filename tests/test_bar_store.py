@@ -0,0 +1,55 @@
+import numpy as np
+
+from bar_store import BAR_FIELDS, BarStore
+
+BAR_MS = 300000
+
+
+def make_store():
+    store = BarStore(None, 50)
+    for i, symbol in enumerate(("AUSDT", "BUSDT")):
+        ts = np.arange(1, 21, dtype=np.int64) * BAR_MS
+        bars = np.full((len(ts), len(BAR_FIELDS)), float(i + 1))
+        store.upsert_bars(symbol, ts, bars)
+    return store
+
+
+def test_bars_since():
+    df = make_store().bars_since(16 * BAR_MS)
+    assert list(df.columns) == ["symbol", "ts", *BAR_FIELDS]
+    assert df["symbol"].tolist() == ["AUSDT"] * 5 + ["BUSDT"] * 5
+    assert df["ts"].tolist() == [t * BAR_MS for t in range(16, 21)] * 2
+    assert make_store().bars_since(0, ["BUSDT", "CUSDT"])["symbol"].unique().tolist() == ["BUSDT"]
+
+
+def test_bars_after_per_symbol_watermarks():
+    df = make_store().bars_after({"AUSDT": 18 * BAR_MS}, 20 * BAR_MS)
+    a, b = df[df["symbol"] == "AUSDT"], df[df["symbol"] == "BUSDT"]
+    assert a["ts"].tolist() == [19 * BAR_MS]
+    assert b["ts"].tolist() == [t * BAR_MS for t in range(1, 20)]
+    assert (b["close"] == 2.0).all()
+
+
+def test_empty_frames_keep_columns():
+    store = BarStore(None, 50)
+    assert list(store.bars_since(0).columns) == ["symbol", "ts", *BAR_FIELDS]
+    assert store.bars_after({}, 10**13).empty
+
+
+def test_synthetic_bar_until_upserted(tmp_path):
+    store = make_store()
+    assert store.start_bar("AUSDT", 21 * BAR_MS)
+    assert store.first_synthetic("AUSDT") == 21 * BAR_MS
+    assert store.symbol_bars("AUSDT")[1][-1, BAR_FIELDS.index("volume")] == 0
+    # 履歴への追記は synthetic な足の手前まで
+    assert store.bars_after({}, 22 * BAR_MS).groupby("symbol")["ts"].max().tolist() == [20 * BAR_MS, 20 * BAR_MS]
+
+    path = str(tmp_path / "bars.npz")
+    store.save(path)
+    loaded = BarStore(None, 50)
+    loaded.load(path)
+    assert loaded.first_synthetic("AUSDT") == 21 * BAR_MS
+
+    loaded.upsert_bars("AUSDT", np.array([21 * BAR_MS]), np.full((1, len(BAR_FIELDS)), 5.0))
+    assert loaded.first_synthetic("AUSDT") == 0
+    assert loaded.bars_after({}, 22 * BAR_MS)["ts"].max() == 21 * BAR_MS
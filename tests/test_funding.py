@@ -0,0 +1,18 @@
+import fetch_data as fd
+
+
+def test_latest_funding_rate_uses_newest_settlement():
+    # Bybit の funding/history は新しい順
+    flist = [
+        {"symbol": "BTCUSDT", "fundingRate": "0.0003", "fundingRateTimestamp": "1737302400000"},
+        {"symbol": "BTCUSDT", "fundingRate": "0.0001", "fundingRateTimestamp": "1737273600000"},
+        {"symbol": "BTCUSDT", "fundingRate": "-0.0002", "fundingRateTimestamp": "1737244800000"},
+    ]
+    assert fd.latest_funding_rate(flist) == 0.0003
+    assert fd.latest_funding_rate(flist[::-1]) == 0.0003
+
+
+def test_latest_funding_rate_missing():
+    assert fd.latest_funding_rate([]) is None
+    assert fd.latest_funding_rate([{"fundingRateTimestamp": "1"}]) is None
+    assert fd.latest_funding_rate([{"fundingRate": "x", "fundingRateTimestamp": "1"}]) is None
@@ -0,0 +1,81 @@
+import os
+
+import pandas as pd
+
+from history_store import HistoryStore
+
+DAY_MS = 24 * 3600 * 1000
+T0 = 1737244800000  # 2025-01-19 00:00 UTC
+
+
+def summary(symbols, **extra):
+    return pd.DataFrame({"symbol": symbols, "close": [1.0] * len(symbols), **extra})
+
+
+def parquet_files(store, kind, tf, date):
+    return sorted(os.listdir(store._dir(kind, tf, date)))
+
+
+def fill(store, days=3, refreshes=4):
+    for day in range(days):
+        for i in range(refreshes):
+            store.append_summary(summary(["AUSDT", "BUSDT"]), "15m", T0 + day * DAY_MS + i * 900000)
+
+
+def test_query_limit_reads_oldest_partitions_only(tmp_path, monkeypatch):
+    store = HistoryStore(str(tmp_path))
+    fill(store)
+    read = []
+    read_date = store._read_date
+
+    def tracked(kind, tf, date, columns, expr):
+        read.append(date)
+        return read_date(kind, tf, date, columns, expr)
+
+    monkeypatch.setattr(store, "_read_date", tracked)
+    df = store.query("summary", "15m", limit=3)
+    assert len(df) == 3
+    assert read == ["2025-01-19"]
+    assert df["ts"].tolist() == [T0, T0, T0 + 900000]
+
+    read.clear()
+    df = store.query("summary", "15m", start_ms=T0 + DAY_MS, end_ms=T0 + DAY_MS + 900000, symbol="BUSDT")
+    assert read == ["2025-01-20"]
+    assert df["ts"].tolist() == [T0 + DAY_MS, T0 + DAY_MS + 900000]
+
+
+def test_query_unifies_columns_across_days(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    store.append_summary(summary(["AUSDT"]), "15m", T0)
+    store.append_summary(summary(["AUSDT"], zscore=[2.5]), "15m", T0 + DAY_MS)
+    df = store.query("summary", "15m")
+    assert df["zscore"].isna().tolist() == [True, False]
+
+
+def test_compact_previous_days(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    fill(store)
+    before = store.query("summary", "15m")
+    assert store.compact_if_due(now_ms=T0 + 2 * DAY_MS + 1) == 2
+    assert store.compact_if_due(now_ms=T0 + 2 * DAY_MS + 2) == 0
+    assert len(parquet_files(store, "summary", "15m", "2025-01-19")) == 1
+    assert parquet_files(store, "summary", "15m", "2025-01-19")[0].startswith("compact-")
+    # 当日分はまとめない
+    assert len(parquet_files(store, "summary", "15m", "2025-01-21")) == 4
+    pd.testing.assert_frame_equal(store.query("summary", "15m"), before)
+
+    # まとめた後に遅れて書かれたファイルも読み、次のまとめに含める
+    store.append_summary(summary(["CUSDT"]), "15m", T0 + 3600000)
+    assert len(store.query("summary", "15m", end_ms=T0 + DAY_MS - 1)) == 9
+    assert store.compact(before_date="2025-01-20") == 1
+    assert len(parquet_files(store, "summary", "15m", "2025-01-19")) == 1
+    assert len(store.query("summary", "15m", end_ms=T0 + DAY_MS - 1)) == 9
+
+
+def test_compact_bars_keeps_last_duplicate(tmp_path):
+    store = HistoryStore(str(tmp_path))
+    bars = pd.DataFrame({"symbol": ["AUSDT", "AUSDT"], "ts": [T0, T0 + 300000], "close": [1.0, 2.0]})
+    store._write("bars", "5m", bars)
+    store._write("bars", "5m", bars.assign(close=[1.0, 3.0]).iloc[1:])
+    assert store.compact(before_date="2025-01-20") == 1
+    assert store.query("bars", "5m")["close"].tolist() == [1.0, 3.0]
@@ -0,0 +1,62 @@
+import pandas as pd
+
+import frontend
+from live_events import EventBroker, delta_payload, diff_summaries
+
+
+def test_subscribe_limit():
+    broker = EventBroker(max_subscribers=2)
+    first, second = broker.subscribe(), broker.subscribe()
+    assert first is not None and second is not None
+    assert broker.subscribe() is None
+    broker.unsubscribe(first)
+    assert broker.subscribe() is not None
+
+
+def test_stream_rejects_over_limit(monkeypatch):
+    broker = EventBroker(max_subscribers=1)
+    monkeypatch.setattr(frontend, "event_broker", broker)
+    # バックグラウンド更新 (Bybit への取得) は起動しない
+    monkeypatch.setitem(frontend.app.before_request_funcs, None, [])
+    broker.subscribe()
+    client = frontend.app.test_client()
+    resp = client.get("/api/stream")
+    assert resp.status_code == 503
+    assert resp.headers["Retry-After"] == str(frontend.SSE_RETRY_AFTER_SEC)
+
+
+def summary(close, fetched_at):
+    return pd.DataFrame({"symbol": ["AUSDT", "BUSDT"], "close": close, "fetched_at": fetched_at})
+
+
+def test_delta_ignores_fetched_at():
+    old = summary([1.0, 2.0], ["2025-01-19 00:00:00", "2025-01-19 00:00:00"])
+    new = summary([1.0, 2.0], ["2025-01-19 00:15:00", "2025-01-19 00:15:00"])
+    payload = delta_payload("15m", '"e"', old, new)
+    assert payload["upserts"] == []
+    assert payload["removed"] == []
+
+
+def test_delta_sends_changed_rows_with_fetched_at():
+    old = summary([1.0, 2.0], ["2025-01-19 00:00:00", "2025-01-19 00:00:00"])
+    new = summary([1.0, 2.5], ["2025-01-19 00:15:00", "2025-01-19 00:15:00"])
+    upserts, removed = diff_summaries(old, new)
+    assert upserts == [{"symbol": "BUSDT", "close": 2.5, "fetched_at": "2025-01-19 00:15:00"}]
+    assert removed == []
+
+
+def test_summary_watcher_starts_in_standalone_and_web(monkeypatch):
+    started = []
+    monkeypatch.setattr(frontend, "start_summary_watcher", lambda: started.append("watcher"))
+    monkeypatch.setattr(frontend, "load_bar_state", lambda: started.append("load"))
+    monkeypatch.setattr(frontend.refresh_scheduler, "start_background", lambda: started.append("refresh"))
+    monkeypatch.setattr(frontend, "FETCH_MODE", "full")
+
+    monkeypatch.setattr(frontend, "RUN_ROLE", "standalone")
+    frontend.start_background_refresh()
+    assert started == ["watcher", "load", "refresh"]
+
+    started.clear()
+    monkeypatch.setattr(frontend, "RUN_ROLE", "web")
+    frontend.start_background_refresh()
+    assert started == ["watcher"]
@@ -0,0 +1,177 @@
+"""
+rate_limiter.RequestScheduler をローカルの HTTP サーバに対して動かす
+(429 → retCode 10006 → 成功 の順に返し、リトライ・バックオフ・AIMD・統計を確認)
+"""
+import asyncio
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import aiohttp
+import pytest
+import requests
+
+from rate_limiter import BybitAPIError, RequestScheduler
+
+ENDPOINT_RATE = 40
+
+
+class ScriptedServer:
+    """
+    responses [(HTTP ステータス, retCode, ヘッダ), ...] を順に返す (尽きたら最後のものを繰り返す)。
+    retCode が None なら JSON でない本文 (プロキシの HTML) を返す
+    """
+
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.hits = 0
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                status, ret_code, headers = server.responses[min(server.hits, len(server.responses) - 1)]
+                server.hits += 1
+                if ret_code is None:
+                    body = b"<html><body>502 Bad Gateway</body></html>"
+                else:
+                    body = json.dumps({"retCode": ret_code, "retMsg": "OK" if ret_code == 0 else "Too many visits",
+                                       "result": {"list": []}}).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                for k, v in headers.items():
+                    self.send_header(k, v)
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_port}/v5/market/kline"
+        threading.Thread(target=self.httpd.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class RecordingScheduler(RequestScheduler):
+    """バックオフの待ち時間を記録する"""
+
+    def __init__(self, **kwargs):
+        super().__init__(endpoint_rate=ENDPOINT_RATE, backoff_base=0.05, backoff_cap=0.2, **kwargs)
+        self.backoffs = []
+
+    def _backoff(self, attempt, retry_after=None):
+        delay = super()._backoff(attempt, retry_after)
+        self.backoffs.append((attempt, delay))
+        return delay
+
+
+THROTTLE_THEN_OK = [
+    (429, 0, {"Retry-After": "0"}),
+    (200, 10006, {}),
+    (200, 0, {}),
+]
+
+
+@pytest.fixture
+def server():
+    servers = []
+
+    def make(responses):
+        servers.append(ScriptedServer(responses))
+        return servers[-1]
+
+    yield make
+    for s in servers:
+        s.close()
+
+
+def check_throttled_then_ok(scheduler, server, payload):
+    assert payload["retCode"] == 0
+    assert server.hits == 3
+    assert scheduler.stats() == {"requests": 3, "throttled": 2, "retried": 2, "failed": 0,
+                                 "bytes": scheduler.stats()["bytes"]}
+    assert scheduler.stats()["bytes"] > 0
+    # バックオフは試行毎に上限が倍 (base * 2^attempt, cap まで)
+    assert [a for a, _ in scheduler.backoffs] == [0, 1]
+    for attempt, delay in scheduler.backoffs:
+        assert 0 <= delay <= min(0.2, 0.05 * 2 ** attempt)
+    # AIMD: スロットリング2回で半減 x2、成功1回で上限の 5% 戻す
+    bucket = scheduler.bucket("kline")
+    assert bucket.rate == pytest.approx(ENDPOINT_RATE / 4 + ENDPOINT_RATE * 0.05)
+    assert bucket.max_rate == ENDPOINT_RATE
+
+
+def test_sync_retries_429_and_10006(server):
+    srv = server(THROTTLE_THEN_OK)
+    scheduler = RecordingScheduler()
+    with requests.Session() as session:
+        payload = scheduler.get_json(session, srv.url, {"symbol": "BTCUSDT"}, "kline")
+    check_throttled_then_ok(scheduler, srv, payload)
+
+
+def test_async_retries_429_and_10006(server):
+    srv = server(THROTTLE_THEN_OK)
+    scheduler = RecordingScheduler()
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await scheduler.get_json_async(session, srv.url, {"symbol": "BTCUSDT"}, "kline")
+
+    check_throttled_then_ok(scheduler, srv, asyncio.run(run()))
+
+
+def test_gives_up_after_max_retries(server):
+    srv = server([(429, 0, {"Retry-After": "0"})])
+    scheduler = RecordingScheduler(max_retries=1)
+    with requests.Session() as session, pytest.raises(BybitAPIError):
+        scheduler.get_json(session, srv.url, {}, "kline")
+    assert srv.hits == 2
+    stats = scheduler.stats()
+    assert (stats["requests"], stats["throttled"], stats["retried"], stats["failed"]) == (2, 2, 1, 1)
+    assert scheduler.bucket("kline").rate == pytest.approx(ENDPOINT_RATE / 4)
+
+
+def test_non_retryable_error_fails_immediately(server):
+    srv = server([(200, 10001, {})])
+    scheduler = RecordingScheduler()
+    with requests.Session() as session, pytest.raises(BybitAPIError):
+        scheduler.get_json(session, srv.url, {}, "kline")
+    assert srv.hits == 1
+    assert scheduler.stats()["retried"] == 0
+
+
+def test_limit_headers_set_endpoint_rate(server):
+    srv = server([(200, 0, {"X-Bapi-Limit": "10", "X-Bapi-Limit-Status": "9"})])
+    scheduler = RecordingScheduler()
+    with requests.Session() as session:
+        scheduler.get_json(session, srv.url, {}, "kline")
+    bucket = scheduler.bucket("kline")
+    assert bucket.max_rate == 10
+    assert bucket.rate == 10
+
+
+def test_non_json_body_is_retried(server):
+    srv = server([(200, None, {}), (200, 0, {})])
+    scheduler = RecordingScheduler()
+    with requests.Session() as session:
+        payload = scheduler.get_json(session, srv.url, {}, "kline")
+    assert payload["retCode"] == 0
+    assert srv.hits == 2
+    assert scheduler.stats()["retried"] == 1
+
+
+def test_non_json_body_gives_up(server):
+    srv = server([(200, None, {})])
+    scheduler = RecordingScheduler(max_retries=1)
+
+    async def run():
+        async with aiohttp.ClientSession() as session:
+            return await scheduler.get_json_async(session, srv.url, {}, "kline")
+
+    with pytest.raises(BybitAPIError, match="not a JSON object"):
+        asyncio.run(run())
+    assert srv.hits == 2
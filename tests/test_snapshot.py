@@ -0,0 +1,109 @@
+import numpy as np
+import pytest
+
+import fetch_data as fd
+from bar_store import BAR_FIELDS
+from mock_bybit import synth_kline_row
+
+
+@pytest.fixture
+def rest(engine, bybit, monkeypatch):
+    mock = bybit(3)
+    fetched = []
+    fetch_bars_async = fd.fetch_bars_async
+
+    async def tracked(symbols, *args, **kwargs):
+        fetched.extend(symbols)
+        return await fetch_bars_async(symbols, *args, **kwargs)
+
+    monkeypatch.setattr(fd, "fetch_bars_async", tracked)
+    return mock, fetched
+
+
+def rest_row(symbol, ts):
+    return synth_kline_row(symbol, int(ts), fd.BAR_MS)
+
+
+def fill(symbol, last_ms, n=20):
+    rows = [synth_kline_row(symbol, t, fd.BAR_MS) for t in range(last_ms - (n - 1) * fd.BAR_MS, last_ms + 1, fd.BAR_MS)]
+    fd.bar_store.upsert_klines(symbol, rows[::-1])
+
+
+def test_snapshot_refetches_only_lagging_symbols(rest):
+    mock, fetched = rest
+    current, previous, lagging = mock.symbols
+    bar_start = fd.current_bar_start_ms()
+    fill(current, bar_start)
+    fill(previous, bar_start - fd.BAR_MS)
+    fill(lagging, bar_start - 3 * fd.BAR_MS)
+    # 前の足は確定前に取得した途中の出来高のまま
+    volume = BAR_FIELDS.index("volume")
+    ring = fd.bar_store.rings[previous]
+    ring.values[(ring.head - 1) % ring.capacity, volume] = 1.0
+    prev_ts, prev_values = fd.bar_store.symbol_bars(previous)
+
+    fd.fetch_data_snapshot(mock.symbols)
+
+    # 2本以上遅れている銘柄だけ全て取り直す
+    assert fetched == [lagging]
+    assert fd.bar_store.last_timestamp(lagging) >= bar_start
+    # 前の足まである銘柄は現在の足が始まり、確定した足と合わせて Kline / OI を取り直す
+    ts, values = fd.bar_store.symbol_bars(previous)
+    assert ts[-1] == bar_start and ts[-2] == prev_ts[-1]
+    assert values[-2][volume] == pytest.approx(float(rest_row(previous, ts[-2])[5]))
+    assert values[-1][volume] == pytest.approx(float(rest_row(previous, bar_start)[5]))
+    assert fd.bar_store.first_synthetic(previous) == 0
+    ticker = next(t for t in fd.fetch_tickers() if t["symbol"] == previous)
+    close = BAR_FIELDS.index("close")
+    # (モックの価格は時刻で動くので取り直した tickers とは僅かにずれる)
+    assert values[-1][close] == pytest.approx(float(ticker["lastPrice"]), rel=1e-3)
+
+
+def test_snapshot_keeps_synthetic_bar_until_refetched(rest, monkeypatch):
+    mock, fetched = rest
+    symbol = mock.symbols[0]
+    bar_start = fd.current_bar_start_ms()
+    for s in mock.symbols:
+        fill(s, bar_start - fd.BAR_MS)
+    refetch_bars_async = fd.refetch_bars_async
+
+    async def failing(starts, *args, **kwargs):
+        return list(starts)
+
+    monkeypatch.setattr(fd, "refetch_bars_async", failing)
+    fd.fetch_data_snapshot(mock.symbols)
+
+    # 取り直せなかった足は synthetic のまま (出来高は前の足を写さず 0)。履歴にもローリング統計にも入れない
+    assert fd.bar_store.first_synthetic(symbol) == bar_start
+    ts, values = fd.bar_store.symbol_bars(symbol)
+    assert values[-1][BAR_FIELDS.index("volume")] == 0
+    archived = fd.bar_store.bars_after({}, bar_start + fd.BAR_MS)
+    assert archived["ts"].max() == bar_start - fd.BAR_MS
+    tf = f"{fd.KLINE_INTERVAL}m"
+    fd.feed_rolling(symbol, tf, np.append(ts, bar_start + fd.BAR_MS), np.vstack([values, values[-1:]]))
+    assert fd.rolling_stats[tf].last_timestamp(symbol) == bar_start - fd.BAR_MS
+
+    # 次のスナップショットで取り直す
+    starts = {}
+
+    async def tracked(symbols, *args, **kwargs):
+        starts.update(symbols)
+        return await refetch_bars_async(symbols, *args, **kwargs)
+
+    monkeypatch.setattr(fd, "refetch_bars_async", tracked)
+    fd.fetch_data_snapshot(mock.symbols)
+    assert starts[symbol] == bar_start - fd.BAR_MS
+    assert fd.bar_store.first_synthetic(symbol) == 0
+    ts, values = fd.bar_store.symbol_bars(symbol)
+    assert values[-1][BAR_FIELDS.index("volume")] == pytest.approx(float(rest_row(symbol, bar_start)[5]))
+
+
+def test_snapshot_resync_refetches_closed_bar(rest):
+    mock, fetched = rest
+    bar_start = fd.current_bar_start_ms()
+    for symbol in mock.symbols:
+        fill(symbol, bar_start - fd.BAR_MS)
+
+    fd.fetch_data_snapshot(mock.symbols, roll_bars=False)
+
+    assert sorted(fetched) == sorted(mock.symbols)
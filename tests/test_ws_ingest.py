@@ -0,0 +1,104 @@
+import os
+import threading
+import time
+
+import pytest
+
+import fetch_data as fd
+import ws_ingest
+from bar_store import BAR_FIELDS
+from mock_bybit import synth_kline_row
+from mock_bybit_ws import MockBybitWS, load_frames, shift_frames
+from ws_ingest import WebSocketIngestor
+
+# --------------------------------------------------------------------
+# 記録したフレーム (tests/data/ws_frames.jsonl) を WebSocketIngestor に流す
+#   1回目の接続: T0 の足が確定 (confirm) し、T0 + 1本 の足が始まったところで切断
+#   2回目の接続: 現在の足から再開。間の足は再接続時の on_resync (REST) で埋まる
+# --------------------------------------------------------------------
+
+FRAMES_PATH = os.path.join(os.path.dirname(__file__), "data", "ws_frames.jsonl")
+SYMBOL = "BTCUSDT"
+RECORDED_T0 = 1737300000000      # 記録の確定する足
+RECORDED_RESUME = 1737300600000  # 再接続後の最初の足
+GAP_BARS = 6                     # T0 から現在の足までの本数
+T0_CLOSE = 104262.80             # 確定した T0 の終値 (記録の値)
+
+
+def wait_until(cond, timeout=20.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if cond():
+            return True
+        time.sleep(0.05)
+    return False
+
+
+@pytest.fixture
+def rest(engine, bybit):
+    return bybit(5)
+
+
+def test_replay_bar_close_reconnect_and_resync(rest, monkeypatch):
+    monkeypatch.setattr(ws_ingest, "RECONNECT_BASE_SEC", 0.1)
+    monkeypatch.setattr(ws_ingest, "PUBLISH_INTERVAL_SEC", 0.2)
+
+    now_bar = fd.current_bar_start_ms()
+    t0 = now_bar - GAP_BARS * fd.BAR_MS
+    frames = load_frames(FRAMES_PATH)
+    sessions = [shift_frames(frames[:5], t0 - RECORDED_T0),
+                shift_frames(frames[5:], now_bar - RECORDED_RESUME)]
+    ws_mock = MockBybitWS(sessions)
+    url = ws_mock.start(0)
+
+    # 前回の実行が T0 の直前で止まった状態のバーストア
+    history = [synth_kline_row(SYMBOL, t, fd.BAR_MS) for t in range(t0 - 20 * fd.BAR_MS, t0, fd.BAR_MS)]
+    fd.bar_store.upsert_klines(SYMBOL, history[::-1])
+
+    resyncs, confirmed, published = [], [], []
+    resynced = threading.Event()
+
+    def on_kline(symbol, bars):
+        confirmed.extend(b["start"] for b in bars if b.get("confirm"))
+        fd.apply_ws_klines(symbol, bars)
+
+    def on_resync(symbols):
+        resyncs.append(list(symbols))
+        # 1回目の接続時は T0 の直前の状態のまま (REST で現在まで埋めると切断中の欠けが作れない)
+        if len(resyncs) > 1:
+            fd.resync_stream(symbols)
+            resynced.set()
+
+    ingestor = WebSocketIngestor(on_kline, fd.apply_ws_ticker, on_resync,
+                                 lambda closed: published.append(closed), url=url)
+    monkeypatch.setattr(fd, "stream_ingestor", ingestor)
+    ingestor.start([SYMBOL])
+    try:
+        assert wait_until(lambda: resynced.is_set() and fd.bar_store.last_timestamp(SYMBOL) >= now_bar)
+        assert wait_until(lambda: ingestor.stats["messages"] == len(frames) and published)
+    finally:
+        ingestor.stop()
+        ws_mock.stop()
+
+    # 確定した足と再接続
+    assert confirmed == [t0]
+    assert ingestor.stats["connects"] == 2
+    assert ingestor.stats["reconnects"] == 1
+    assert ws_mock.connections == 2
+    assert ws_mock.topics == {f"kline.5.{SYMBOL}", f"tickers.{SYMBOL}"}
+    assert resyncs == [[SYMBOL], [SYMBOL]]
+    assert True in published
+
+    # 切断中の足は REST で埋まり、欠番が無い
+    ts, values = fd.bar_store.symbol_bars(SYMBOL)
+    assert ts[0] == t0 - 20 * fd.BAR_MS
+    assert ts[-1] >= now_bar
+    assert (ts[1:] - ts[:-1] == fd.BAR_MS).all()
+    # 確定した T0 の足は WebSocket の値のまま (REST は T0 + 1本 から取り直す)
+    assert values[ts == t0][0][BAR_FIELDS.index("close")] == pytest.approx(T0_CLOSE)
+
+    # tickers は snapshot + delta がマージされる
+    ticker = ingestor.tickers[SYMBOL]
+    assert ticker["lastPrice"] == "104301.20"
+    assert ticker["fundingRate"] == "0.000108"
+    assert fd.funding_cache.last(SYMBOL) == pytest.approx(0.000108)
@@ -0,0 +1,96 @@
+import numpy as np
+import pandas as pd
+
+# --------------------------------------------------------------------
+# 時間足の定義と、基準足 (5分足) からの再集計
+#   Bybit の足は UTC 基準で区切られる (日足は 00:00 UTC) ため、
+#   epoch ms を足の長さで切り捨てたものをバケットにする
+# --------------------------------------------------------------------
+
+# 時間足 → 分
+TIMEFRAMES = {
+    "5m": 5,
+    "15m": 15,
+    "30m": 30,
+    "1h": 60,
+    "4h": 240,
+    "1d": 1440,
+}
+DEFAULT_TIMEFRAME = "15m"
+
+# 時間足 → Bybit の kline interval / open-interest intervalTime (時間足そのものを取得するとき)
+BYBIT_KLINE_INTERVALS = {"5m": "5", "15m": "15", "30m": "30", "1h": "60", "4h": "240", "1d": "D"}
+BYBIT_OI_INTERVALS = {"5m": "5min", "15m": "15min", "30m": "30min", "1h": "1h", "4h": "4h", "1d": "1d"}
+
+
+def timeframe_ms(tf):
+    return TIMEFRAMES[tf] * 60 * 1000
+
+
+def window_start_ms(now_ms, tf, n_bars):
+    """確定前の足を含めて n_bars 本分の先頭 (epoch ms)"""
+    tf_ms = timeframe_ms(tf)
+    return now_ms // tf_ms * tf_ms - (n_bars - 1) * tf_ms
+
+
+def resample_bars(bars, tf):
+    """
+    symbol, ts (epoch ms), open, high, low, close, volume, openInterest を持つ
+    基準足 (symbol, ts 昇順) を tf の足に集計する。
+    OI は足の中で最後に観測された値を使う
+    """
+    if bars.empty:
+        return bars
+    tf_ms = timeframe_ms(tf)
+    bucketed = bars.assign(ts=bars["ts"].values // tf_ms * tf_ms)
+    return bucketed.groupby(["symbol", "ts"], sort=True).agg(
+        open=("open", "first"),
+        high=("high", "max"),
+        low=("low", "min"),
+        close=("close", "last"),
+        volume=("volume", "sum"),
+        openInterest=("openInterest", "last"),
+    ).reset_index()
+
+
+def resample_arrays(ts, values, tf):
+    """
+    resample_bars の1銘柄版 (DataFrame を作らない)。
+    ts: 昇順の epoch ms, values: open, high, low, close, volume, openInterest の2次元配列
+    """
+    if len(ts) == 0:
+        return ts, values
+    tf_ms = timeframe_ms(tf)
+    buckets = ts // tf_ms * tf_ms
+    starts = np.flatnonzero(np.r_[True, buckets[1:] != buckets[:-1]])
+    ends = np.r_[starts[1:], len(ts)] - 1
+    out = np.empty((len(starts), values.shape[1]))
+    out[:, 0] = values[starts, 0]
+    out[:, 1] = np.fmax.reduceat(values[:, 1], starts)
+    out[:, 2] = np.fmin.reduceat(values[:, 2], starts)
+    out[:, 3] = values[ends, 3]
+    out[:, 4] = np.add.reduceat(np.nan_to_num(values[:, 4]), starts)
+    # OI は足の中で最後に値がある行 (無ければ NaN)
+    oi = values[:, 5]
+    last = np.maximum.reduceat(np.where(np.isnan(oi), -1, np.arange(len(oi))), starts)
+    out[:, 5] = np.where(last >= 0, oi[last], np.nan)
+    return buckets[starts], out
+
+
+def to_summary_input(bars, funding_rates):
+    """
+    summarize_data_4bars が受け取る形 (fetch_data_parallel の戻り値と同じ列) に変換する
+    """
+    if bars.empty:
+        return pd.DataFrame()
+    return pd.DataFrame({
+        "symbol": bars["symbol"].values,
+        "timestamp": pd.to_datetime(bars["ts"].values, unit="ms", utc=True).tz_convert("Asia/Tokyo"),
+        "open": bars["open"].values,
+        "high": bars["high"].values,
+        "low": bars["low"].values,
+        "close": bars["close"].values,
+        "volume": bars["volume"].values,
+        "fundingRate": bars["symbol"].map(funding_rates).fillna(0.0).values,
+        "openInterest": np.nan_to_num(bars["openInterest"].values.astype(float)),
+    })
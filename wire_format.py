@@ -0,0 +1,177 @@
+import json
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from snapshot_files import gzip_bytes
+
+try:
+    import msgpack
+except ImportError:  # MessagePack は任意
+    msgpack = None
+
+try:
+    import brotli
+except ImportError:  # brotli が無ければ gzip だけ
+    brotli = None
+
+# --------------------------------------------------------------------
+# /api/data のレスポンス形式 (?format= または Accept で選択)
+#   json:    従来の行指向 [{"symbol": ..., ...}, ...] (既定)
+#   columns: 列指向の JSON。列名は1度だけ、文字列列 (symbol, timestamp) は辞書 + コード、
+#            真偽値は 0/1、整数値の float は整数で出す
+#   msgpack: columns と同じ構造を MessagePack で (msgpack が入っている場合)
+#   arrow:   Arrow IPC ストリーム (文字列列は dictionary 型)。件数等はスキーマの metadata
+# 圧縮は Accept-Encoding で br (brotli が入っている場合) → gzip の順に選ぶ
+# --------------------------------------------------------------------
+
+MEDIA_TYPES = {
+    "json": "application/json",
+    "columns": "application/vnd.summary.columns+json",
+    "msgpack": "application/vnd.msgpack",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+ACCEPT_ALIASES = {
+    "application/x-msgpack": "msgpack",
+    "application/msgpack": "msgpack",
+    "application/vnd.apache.arrow.file": "arrow",
+}
+# これより小さい本文は圧縮しない (ヘッダ分で得にならない)
+MIN_COMPRESS_BYTES = 512
+BROTLI_QUALITY = 5
+
+
+class FormatError(Exception):
+    pass
+
+
+def available_formats():
+    return [f for f in MEDIA_TYPES if f != "msgpack" or msgpack is not None]
+
+
+def _parse_accept(header):
+    """"a;q=0.5, b" → [b, a] (q の降順, q=0 は除く)"""
+    items = []
+    for i, part in enumerate((header or "").split(",")):
+        token, *params = [p.strip() for p in part.split(";")]
+        if not token:
+            continue
+        q = 1.0
+        for param in params:
+            key, _, value = param.partition("=")
+            if key.strip() == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if q > 0:
+            items.append((-q, i, token.lower()))
+    return [token for _, _, token in sorted(items)]
+
+
+def choose_format(format_arg=None, accept=None):
+    """?format= が優先。無ければ Accept から対応している形式を選び、無ければ json"""
+    if format_arg:
+        if format_arg not in MEDIA_TYPES:
+            raise FormatError(f"Unsupported format: {format_arg}")
+        if format_arg not in available_formats():
+            raise FormatError(f"Format not available on this server: {format_arg}")
+        return format_arg
+    formats = available_formats()
+    for media_type in _parse_accept(accept):
+        fmt = ACCEPT_ALIASES.get(media_type) or next((f for f in formats if MEDIA_TYPES[f] == media_type), None)
+        if fmt in formats:
+            return fmt
+    return "json"
+
+
+def choose_encoding(accept_encoding):
+    codings = _parse_accept(accept_encoding)
+    if brotli is not None and "br" in codings:
+        return "br"
+    if "gzip" in codings or "*" in codings:
+        return "gzip"
+    return None
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(bytes(body), quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        return gzip_bytes(body)
+    return body
+
+
+def should_compress(body, encoding):
+    return encoding is not None and len(body) >= MIN_COMPRESS_BYTES
+
+
+def variant_etag(etag, fmt, encoding=None):
+    """形式・圧縮毎に別の ETag ("abc" → "abc-columns-br")"""
+    suffix = "-".join(x for x in (fmt, encoding) if x and x != "json")
+    return etag[:-1] + f'-{suffix}"' if suffix else etag
+
+
+# ---------------- 列指向 ----------------
+def _column(name, values):
+    if values.dtype.kind == "b":
+        return {"name": name, "type": "bool", "values": values.astype(np.uint8).tolist()}
+    if values.dtype.kind in "iu":
+        return {"name": name, "type": "int", "values": values.tolist()}
+    if values.dtype.kind == "f":
+        finite = np.isfinite(values)
+        if finite.all() and (values == np.round(values)).all() and (np.abs(values) < 2 ** 53).all():
+            return {"name": name, "type": "int", "values": values.astype(np.int64).tolist()}
+        out = values.tolist()
+        if not finite.all():
+            for i in np.flatnonzero(~finite):
+                out[i] = None
+        return {"name": name, "type": "float", "values": out}
+    codes, uniques = pd.factorize(values, use_na_sentinel=True)
+    return {"name": name, "type": "dict", "dict": [str(u) for u in uniques], "codes": codes.tolist()}
+
+
+def columnar(df, meta=None):
+    """DataFrame → {...meta, "length": n, "columns": [{"name", "type", "values" | "dict" + "codes"}]}"""
+    out = dict(meta or {})
+    out["length"] = len(df)
+    out["columns"] = [_column(name, df[name].to_numpy()) for name in df.columns]
+    return out
+
+
+def _arrow_table(df, meta=None):
+    arrays, names = [], []
+    for name in df.columns:
+        values = df[name].to_numpy()
+        if values.dtype.kind == "O":
+            arrays.append(pa.array(values.astype(str)).dictionary_encode())
+        else:
+            arrays.append(pa.array(values))
+        names.append(name)
+    table = pa.Table.from_arrays(arrays, names=names)
+    if meta:
+        table = table.replace_schema_metadata({k: json.dumps(v) for k, v in meta.items()})
+    return table
+
+
+def encode_frame(fmt, df, meta=None):
+    """
+    fmt の形式で DataFrame をシリアライズ。meta (件数・オフセット等) は
+    json なら {"rows": [...], **meta}、それ以外は列と同じ階層に入れる
+    """
+    if fmt == "json":
+        rows = df.to_dict(orient="records")
+        data = {**meta, "rows": rows} if meta is not None else rows
+        return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if fmt == "columns":
+        return json.dumps(columnar(df, meta), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+    if fmt == "msgpack":
+        return msgpack.packb(columnar(df, meta), use_bin_type=True)
+    if fmt == "arrow":
+        table = _arrow_table(df, meta)
+        sink = pa.BufferOutputStream()
+        with pa.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+    raise FormatError(f"Unsupported format: {fmt}")
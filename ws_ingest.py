@@ -0,0 +1,195 @@
+import asyncio
+import json
+import random
+import threading
+import time
+
+import aiohttp
+
+# --------------------------------------------------------------------
+# Bybit public WebSocket (linear) からの取り込み
+#   - kline.{interval}.{symbol} : 基準足の確定前 / 確定 (confirm) バー
+#   - tickers.{symbol}          : 最新価格 / OI / Funding (snapshot の後は差分 delta)
+#   - 銘柄を SYMBOLS_PER_CONNECTION 毎に分けて接続し、subscribe は
+#     ARGS_PER_MESSAGE トピックずつ送る
+#   - (再)接続の度に on_resync で REST から欠けた足を埋め直す
+#   - 受信があれば PUBLISH_INTERVAL_SEC 毎に on_publish でサマリを作り直す
+# --------------------------------------------------------------------
+
+WS_URL = "wss://stream.bybit.com/v5/public/linear"
+SYMBOLS_PER_CONNECTION = 200
+ARGS_PER_MESSAGE = 10
+PING_INTERVAL_SEC = 20
+PUBLISH_INTERVAL_SEC = 2.0
+RECONNECT_BASE_SEC = 1.0
+RECONNECT_MAX_SEC = 60.0
+
+
+class WebSocketIngestor:
+    def __init__(self, on_kline, on_ticker, on_resync=None, on_publish=None,
+                 kline_interval="5", url=WS_URL, symbols_per_connection=SYMBOLS_PER_CONNECTION):
+        """
+        on_kline(symbol, bars)     : bars は Bybit kline メッセージの data (list of dict)
+        on_ticker(symbol, ticker)  : snapshot + delta をマージ済みの ticker dict
+        on_resync(symbols)         : (再)接続直後に呼ぶ (同期関数, スレッドプールで実行)
+        on_publish(closed)         : 更新があった時に間引いて呼ぶ。closed は足が確定したか
+        """
+        self.on_kline = on_kline
+        self.on_ticker = on_ticker
+        self.on_resync = on_resync
+        self.on_publish = on_publish
+        self.kline_interval = kline_interval
+        self.url = url
+        self.symbols_per_connection = symbols_per_connection
+        self.symbols = []
+        self.tickers = {}
+        self.dirty = False
+        self.closed = False
+        self.stats = {"messages": 0, "connects": 0, "reconnects": 0, "errors": 0, "last_message_at": None}
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._loop = None
+        self._stop = None
+
+    def topics(self, symbol):
+        return [f"kline.{self.kline_interval}.{symbol}", f"tickers.{symbol}"]
+
+    # ---------------- 起動 / 停止 ----------------
+    def start(self, symbols):
+        """
+        専用スレッドでイベントループを回す (Flask / gunicorn のワーカーから呼べる)。
+        symbols は銘柄リストか、それを返す関数 (スレッド側で呼ぶ)
+        """
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._thread_main, args=(symbols,), daemon=True)
+        self._thread.start()
+
+    def _thread_main(self, symbols):
+        if callable(symbols):
+            symbols = symbols()
+        if not symbols:
+            print("WebSocket ingest: no symbols")
+            return
+        asyncio.run(self.run(symbols))
+
+    def stop(self):
+        if self._loop is not None and self._stop is not None:
+            self._loop.call_soon_threadsafe(self._stop.set)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    async def run(self, symbols):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        self.symbols = list(symbols)
+        groups = [symbols[i:i + self.symbols_per_connection]
+                  for i in range(0, len(symbols), self.symbols_per_connection)]
+        async with aiohttp.ClientSession() as session:
+            tasks = [asyncio.create_task(self._connection(session, g)) for g in groups]
+            tasks.append(asyncio.create_task(self._publisher()))
+            await self._stop.wait()
+            for t in tasks:
+                t.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # ---------------- 接続 ----------------
+    async def _connection(self, session, symbols):
+        attempt = 0
+        while not self._stop.is_set():
+            try:
+                async with session.ws_connect(self.url, heartbeat=None, autoping=True) as ws:
+                    await self._subscribe(ws, symbols)
+                    self.stats["connects"] += 1
+                    if attempt:
+                        self.stats["reconnects"] += 1
+                    attempt = 0
+                    if self.on_resync:
+                        # 切断中に確定した足は REST で取り直す
+                        await self._loop.run_in_executor(None, self.on_resync, symbols)
+                        self._mark(True)
+                    await self._read(ws)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.stats["errors"] += 1
+                print(f"WebSocket error ({symbols[0]}.. {len(symbols)} symbols): {e}")
+            if self._stop.is_set():
+                break
+            # full jitter
+            delay = random.uniform(0, min(RECONNECT_MAX_SEC, RECONNECT_BASE_SEC * 2 ** attempt))
+            attempt += 1
+            await asyncio.sleep(delay)
+
+    async def _subscribe(self, ws, symbols):
+        args = [topic for s in symbols for topic in self.topics(s)]
+        for i in range(0, len(args), ARGS_PER_MESSAGE):
+            await ws.send_str(json.dumps({"op": "subscribe", "args": args[i:i + ARGS_PER_MESSAGE]}))
+
+    async def _read(self, ws):
+        last_ping = time.monotonic()
+        while True:
+            timeout = max(0.1, PING_INTERVAL_SEC - (time.monotonic() - last_ping))
+            try:
+                msg = await ws.receive(timeout=timeout)
+            except asyncio.TimeoutError:
+                msg = None
+            if time.monotonic() - last_ping >= PING_INTERVAL_SEC:
+                # Bybit はアプリケーションレベルの ping を要求 (無いと約10分で切断)
+                await ws.send_str('{"op":"ping"}')
+                last_ping = time.monotonic()
+            if msg is None:
+                continue
+            if msg.type == aiohttp.WSMsgType.TEXT:
+                self.handle_message(msg.data)
+            elif msg.type in (aiohttp.WSMsgType.CLOSE, aiohttp.WSMsgType.CLOSED, aiohttp.WSMsgType.ERROR):
+                raise ConnectionError(f"connection closed ({msg.type.name})")
+
+    # ---------------- メッセージ処理 ----------------
+    def handle_message(self, raw):
+        try:
+            msg = json.loads(raw)
+        except ValueError:
+            return
+        topic = msg.get("topic")
+        if not topic:
+            if msg.get("op") == "subscribe" and not msg.get("success", True):
+                print(f"WebSocket subscribe failed: {msg.get('ret_msg')}")
+            return
+        self.stats["messages"] += 1
+        self.stats["last_message_at"] = time.time()
+        data = msg.get("data")
+        try:
+            if topic.startswith("kline."):
+                symbol = topic.rsplit(".", 1)[1]
+                self.on_kline(symbol, data)
+                self._mark(any(bar.get("confirm") for bar in data))
+            elif topic.startswith("tickers."):
+                symbol = topic.split(".", 1)[1]
+                if msg.get("type") == "snapshot" or symbol not in self.tickers:
+                    self.tickers[symbol] = dict(data)
+                else:
+                    self.tickers[symbol].update(data)
+                self.on_ticker(symbol, self.tickers[symbol])
+                self._mark(False)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"Error handling {topic}: {e}")
+
+    def _mark(self, closed):
+        self.dirty = True
+        self.closed = self.closed or closed
+
+    async def _publisher(self):
+        while True:
+            await asyncio.sleep(PUBLISH_INTERVAL_SEC)
+            if not self.dirty or self.on_publish is None:
+                continue
+            closed, self.dirty, self.closed = self.closed, False, False
+            try:
+                await self._loop.run_in_executor(None, self.on_publish, closed)
+            except Exception as e:
+                print(f"Error publishing stream summary: {e}")